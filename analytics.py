@@ -0,0 +1,164 @@
+import argparse
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils import db_connection, routed, current_outlet
+
+# --- Food Cost & Profitability ---
+# Recipes, batch costs and per-dish sales are loaded once and every figure is
+# computed with vectorized pandas/NumPy operations, replacing dish_cost_view
+# (which averages cost_per_unit over all batches on every read). Batch costs are
+# summed per ingredient in SQL, so the load is one row per ingredient however
+# many batches (depleted ones included) have been received.
+#
+# Cost methods:
+#   'consumed' - average cost of the units drawn from batches so far (sales take
+#                them soonest-expiring first), weighted by quantity drawn.
+#   'weighted' - average cost of every unit received, weighted by quantity.
+# Both are averages per ingredient; neither prices a sale against its own batches.
+
+COST_METHODS = ('consumed', 'weighted')
+BATCH_COST_COLUMNS = ['ingredient_id', 'received', 'received_cost', 'consumed', 'consumed_cost']
+
+@routed('replica')
+def load_cost_inputs(days=None):
+    """Fetches dishes, recipes, per-ingredient batch costs and per-dish sales for the last N days (all time if None)"""
+    with db_connection() as conn:
+        if not conn: return None
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id AS dish_id, dname, category, price FROM dish")
+            dishes = pd.DataFrame(cursor.fetchall(), columns=['dish_id', 'dname', 'category', 'price'])
+            cursor.execute("SELECT dish_id, ingredient_id, quantity_needed FROM recipe")
+            recipes = pd.DataFrame(cursor.fetchall(), columns=['dish_id', 'ingredient_id', 'quantity_needed'])
+            sql = """
+            SELECT ingredient_id,
+                   SUM(quantity_received) AS received,
+                   SUM(quantity_received * cost_per_unit) AS received_cost,
+                   SUM(quantity_received - quantity_remaining) AS consumed,
+                   SUM((quantity_received - quantity_remaining) * cost_per_unit) AS consumed_cost
+            FROM ingredient_batches
+            GROUP BY ingredient_id
+            """
+            cursor.execute(sql)
+            batch_costs = pd.DataFrame(cursor.fetchall(), columns=BATCH_COST_COLUMNS)
+            cursor.execute("SELECT id AS ingredient_id, name, unit FROM ingredients")
+            ingredients = pd.DataFrame(cursor.fetchall(), columns=['ingredient_id', 'name', 'unit'])
+            # All-time quantities come from the rollup; usage variance needs them whatever the window.
+            cursor.execute("SELECT dish_id, total_sold AS sold, total_revenue AS revenue FROM dish_sales_rollup")
+            sold_all_time = pd.DataFrame(cursor.fetchall(), columns=['dish_id', 'sold', 'revenue'])
+            if days is None:
+                sold = sold_all_time
+            else:
+                sql = """
+                SELECT si.dish_id, SUM(si.quantity) AS sold, SUM(si.quantity * si.price_per_item) AS revenue
+                FROM sale_items si
+                JOIN sales s ON si.sale_id = s.id
+                WHERE s.sale_time >= CURDATE() - INTERVAL %s DAY
+                GROUP BY si.dish_id
+                """
+                cursor.execute(sql, (days,))
+                sold = pd.DataFrame(cursor.fetchall(), columns=['dish_id', 'sold', 'revenue'])
+    # DECIMAL columns arrive as Decimal objects; float64 is what NumPy vectorizes over.
+    for frame, columns in ((dishes, ['price']), (recipes, ['quantity_needed']),
+                           (batch_costs, BATCH_COST_COLUMNS[1:]),
+                           (sold, ['sold', 'revenue']), (sold_all_time, ['sold', 'revenue'])):
+        frame[columns] = frame[columns].astype(float)
+    return {'dishes': dishes, 'recipes': recipes, 'batch_costs': batch_costs, 'ingredients': ingredients,
+            'sold': sold, 'sold_all_time': sold_all_time}
+
+def ingredient_unit_costs(batch_costs, method='consumed'):
+    """Returns a Series of cost per unit indexed by ingredient_id"""
+    totals = batch_costs.set_index('ingredient_id')
+    weighted = totals['received_cost'] / totals['received'].replace(0, np.nan)
+    if method != 'consumed':
+        return weighted
+    # Ingredients nothing has been drawn from yet fall back to the weighted average
+    return (totals['consumed_cost'] / totals['consumed'].replace(0, np.nan)).fillna(weighted)
+
+def compute_dish_profitability(inputs, method='consumed'):
+    """Per-dish unit cost, margin and gross profit over the loaded sales window"""
+    unit_costs = ingredient_unit_costs(inputs['batch_costs'], method)
+    lines = inputs['recipes']
+    line_cost = lines['quantity_needed'].to_numpy() * lines['ingredient_id'].map(unit_costs).to_numpy()
+    costed = pd.DataFrame({'dish_id': lines['dish_id'].to_numpy(), 'unit_cost': line_cost,
+                           'uncosted_ingredients': np.isnan(line_cost).astype(int)})
+    per_dish = costed.groupby('dish_id').agg(unit_cost=('unit_cost', 'sum'), uncosted_ingredients=('uncosted_ingredients', 'sum'))
+
+    dishes = inputs['dishes'].merge(per_dish, on='dish_id', how='left').merge(inputs['sold'], on='dish_id', how='left')
+    dishes[['unit_cost', 'uncosted_ingredients', 'sold', 'revenue']] = dishes[['unit_cost', 'uncosted_ingredients', 'sold', 'revenue']].fillna(0)
+    price = dishes['price'].to_numpy()
+    unit_cost = dishes['unit_cost'].to_numpy()
+    dishes['margin'] = price - unit_cost
+    dishes['margin_pct'] = np.divide(dishes['margin'].to_numpy() * 100, price, out=np.zeros_like(price), where=price > 0)
+    dishes['cogs'] = dishes['sold'].to_numpy() * unit_cost
+    dishes['gross_profit'] = dishes['revenue'].to_numpy() - dishes['cogs'].to_numpy()
+    return dishes.sort_values('gross_profit', ascending=False).round(2).reset_index(drop=True)
+
+def compute_usage_variance(inputs):
+    """Theoretical (all-time sales x current recipes) versus actual (drawn from batches) usage per ingredient.
+
+    Recipe edits after a dish was sold skew the theoretical figure, so treat large
+    variances as a prompt to investigate rather than an exact waste number.
+    """
+    lines = inputs['recipes'].merge(inputs['sold_all_time'][['dish_id', 'sold']], on='dish_id', how='inner')
+    theoretical = pd.Series(lines['quantity_needed'].to_numpy() * lines['sold'].to_numpy(), index=lines['ingredient_id']).groupby(level=0).sum()
+    actual = inputs['batch_costs'].set_index('ingredient_id')['consumed']
+
+    usage = inputs['ingredients'].set_index('ingredient_id')
+    usage['theoretical_usage'] = theoretical.reindex(usage.index, fill_value=0)
+    usage['actual_usage'] = actual.reindex(usage.index, fill_value=0)
+    usage['variance'] = usage['actual_usage'] - usage['theoretical_usage']
+    theoretical_values = usage['theoretical_usage'].to_numpy()
+    usage['variance_pct'] = np.divide(usage['variance'].to_numpy() * 100, theoretical_values, out=np.zeros_like(theoretical_values), where=theoretical_values > 0)
+    return usage.reset_index().sort_values('variance', ascending=False).round(2).reset_index(drop=True)
+
+# --- Dashboard & Export ---
+
+PROFITABILITY_TTL = 60  # seconds the dashboard panel's rows are reused; every sale would otherwise reload them
+
+_profitability_cache = {}  # (outlet, days, method) -> (monotonic time, rows)
+_profitability_lock = threading.Lock()
+
+def get_profitability_rows(days=30, method='consumed'):
+    """Dish profitability rows for the dashboard panel, most profitable first, no older than PROFITABILITY_TTL seconds"""
+    key = (current_outlet(), days, method)
+    with _profitability_lock:
+        cached = _profitability_cache.get(key)
+    if cached and time.monotonic() - cached[0] < PROFITABILITY_TTL:
+        return cached[1]
+    inputs = load_cost_inputs(days)
+    if inputs is None: return []
+    rows = compute_dish_profitability(inputs, method).to_dict('records')
+    with _profitability_lock: _profitability_cache[key] = (time.monotonic(), rows)
+    return rows
+
+def export_profitability(path, days=None, method='consumed'):
+    """Writes dish profitability to path and ingredient usage variance next to it (CSV). Returns a summary message."""
+    inputs = load_cost_inputs(days)
+    if inputs is None: return "Database connection failed."
+    dishes = compute_dish_profitability(inputs, method)
+    usage = compute_usage_variance(inputs)
+    usage_path = path.rsplit('.', 1)[0] + "_usage.csv"
+    try:
+        dishes.to_csv(path, index=False)
+        usage.to_csv(usage_path, index=False)
+    except OSError as e:
+        return f"Error exporting profitability: {e}"
+    return f"Exported {len(dishes)} dishes to {path} and {len(usage)} ingredients to {usage_path} successfully!"
+
+def main():
+    """Exports dish profitability and ingredient usage variance to CSV"""
+    parser = argparse.ArgumentParser(description="Food cost and profitability report.")
+    parser.add_argument("path", help="CSV file for dish profitability; usage variance goes to <path>_usage.csv")
+    parser.add_argument("--days", type=int, help="sales window in days (default: all time)")
+    parser.add_argument("--method", choices=COST_METHODS, default='consumed')
+    args = parser.parse_args()
+
+    print("--- Food Cost & Profitability ---")
+    print(export_profitability(args.path, args.days, args.method))
+
+if __name__ == "__main__":
+    main()
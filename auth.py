@@ -0,0 +1,249 @@
+import functools
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+import pymysql
+
+from utils import db_connection, routed, set_current_outlet, DEFAULT_OUTLET, OUTLETS
+
+# --- Password Hashing ---
+# Hashes are stored as "pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>" in
+# user_account.password_hash. Accounts created before this module still hold a
+# bare SHA-256 hex digest; those are accepted once and rehashed on that login.
+
+PASSWORD_HASH_ALGORITHM = 'pbkdf2_sha256'
+PASSWORD_HASH_ITERATIONS = 260000   # raise over time; older hashes are upgraded on their next login
+PASSWORD_SALT_BYTES = 16
+
+def hash_password(password, iterations=PASSWORD_HASH_ITERATIONS):
+    """Returns a salted PBKDF2-SHA256 hash string for storing in user_account"""
+    salt = os.urandom(PASSWORD_SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f"{PASSWORD_HASH_ALGORITHM}${iterations}${salt.hex()}${digest.hex()}"
+
+def verify_password(password, stored_hash):
+    """Constant-time check of password against a stored hash (PBKDF2 or legacy SHA-256)"""
+    if stored_hash.startswith(PASSWORD_HASH_ALGORITHM + '$'):
+        try:
+            _, iterations, salt, expected = stored_hash.split('$')
+            digest = hashlib.pbkdf2_hmac('sha256', password.encode(), bytes.fromhex(salt), int(iterations))
+        except ValueError:
+            return False
+        return hmac.compare_digest(digest.hex(), expected)
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored_hash)
+
+def needs_rehash(stored_hash):
+    """True for legacy SHA-256 hashes and hashes made with fewer iterations than the current setting"""
+    parts = stored_hash.split('$')
+    return len(parts) != 4 or parts[0] != PASSWORD_HASH_ALGORITHM or int(parts[1]) < PASSWORD_HASH_ITERATIONS
+
+@functools.lru_cache(maxsize=None)
+def _dummy_hash():
+    # Verified against when the username does not exist, so a miss costs as long as a
+    # wrong password. Made on first use rather than at import, to keep startup fast.
+    return hash_password(secrets.token_hex(8))
+
+# --- Login Rate Limiting ---
+
+LOGIN_MAX_FAILURES = 5          # failed attempts allowed per username within the window
+LOGIN_FAILURE_WINDOW = 300      # seconds
+LOGIN_LOCKOUT_SECONDS = 60      # how long a username is refused once it hits the limit
+LOGIN_TRACKED_MAX = 10000       # usernames tracked at once; the oldest are dropped past this
+
+class LoginRateLimiter:
+    """Sliding-window count of failed logins per username, with a short lockout once it is exceeded"""
+
+    def __init__(self, max_failures=LOGIN_MAX_FAILURES, window=LOGIN_FAILURE_WINDOW, lockout=LOGIN_LOCKOUT_SECONDS, max_tracked=LOGIN_TRACKED_MAX):
+        self.max_failures = max_failures
+        self.window = window
+        self.lockout = lockout
+        self.max_tracked = max_tracked
+        self._failures = {}      # username -> deque of failure times
+        self._locked_until = {}  # username -> monotonic time the lockout ends
+        self._lock = threading.Lock()
+        self.stats = {'failures': 0, 'lockouts': 0, 'refused': 0}
+
+    def retry_after(self, username):
+        """Seconds until username may try again (0 if it is not locked out)"""
+        with self._lock:
+            remaining = self._locked_until.get(username, 0) - time.monotonic()
+            if remaining <= 0:
+                self._locked_until.pop(username, None)
+                return 0
+            self.stats['refused'] += 1
+            return remaining
+
+    def record_failure(self, username):
+        now = time.monotonic()
+        with self._lock:
+            self.stats['failures'] += 1
+            failures = self._failures.pop(username, None) or deque()
+            self._failures[username] = failures  # re-inserted, so the dict stays ordered by last failure
+            failures.append(now)
+            while failures and failures[0] <= now - self.window:
+                failures.popleft()
+            if len(failures) >= self.max_failures:
+                self._locked_until[username] = now + self.lockout
+                self.stats['lockouts'] += 1
+                del self._failures[username]
+            if len(self._failures) + len(self._locked_until) > self.max_tracked:
+                self._prune(now)
+
+    def _prune(self, now):
+        # Usernames are chosen by whoever is typing, so the dicts are kept bounded: stale
+        # entries go first, then the least recently failed counts. Live lockouts are kept
+        # (each one takes max_failures attempts and lapses after the lockout).
+        for username in [u for u, failures in self._failures.items() if failures[-1] <= now - self.window]:
+            del self._failures[username]
+        for username in [u for u, until in self._locked_until.items() if until <= now]:
+            del self._locked_until[username]
+        while self._failures and len(self._failures) > self.max_tracked // 2:
+            del self._failures[next(iter(self._failures))]
+
+    def record_success(self, username):
+        with self._lock:
+            self._failures.pop(username, None)
+            self._locked_until.pop(username, None)
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, 'locked_users': len(self._locked_until), 'tracked_users': len(self._failures)}
+
+# --- Permissions ---
+# Tabs and actions check named permissions. Each role's set is read from the
+# role_permission table (migration 009) and cached; DEFAULT_ROLE_PERMISSIONS is
+# what that table is seeded with and the fallback until it exists.
+
+PERMISSIONS = ('dashboard', 'sales', 'menu', 'inventory', 'suppliers', 'employees', 'all_outlets', 'diagnostics')
+
+DEFAULT_ROLE_PERMISSIONS = {
+    'admin': {'dashboard', 'sales', 'menu', 'inventory', 'suppliers', 'employees', 'all_outlets', 'diagnostics'},
+    'manager': {'dashboard', 'sales', 'menu', 'inventory'},
+    'waiter': {'sales'},
+    'chef': {'menu', 'inventory'},
+}
+
+PERMISSION_CACHE_SECONDS = 300
+
+_permission_cache = {}   # (outlet, role) -> (frozenset of permissions, loaded_at)
+_permission_lock = threading.Lock()
+
+def _role_permissions(cursor, outlet, role):
+    with _permission_lock:
+        cached = _permission_cache.get((outlet, role))
+        if cached and time.monotonic() - cached[1] < PERMISSION_CACHE_SECONDS:
+            return cached[0]
+    try:
+        cursor.execute("SELECT permission FROM role_permission WHERE role = %s", (role,))
+        permissions = frozenset(row['permission'] for row in cursor.fetchall())
+    except pymysql.ProgrammingError as e:
+        if not e.args or e.args[0] != 1146: raise  # 1146: table doesn't exist, migrations not applied yet
+        permissions = frozenset(DEFAULT_ROLE_PERMISSIONS.get(role, ()))
+    with _permission_lock:
+        _permission_cache[(outlet, role)] = (permissions, time.monotonic())
+    return permissions
+
+# --- Sessions ---
+
+SESSION_IDLE_TIMEOUT = 12 * 3600   # seconds without activity before a session lapses
+
+@dataclass
+class Session:
+    token: str
+    user: dict
+    permissions: frozenset
+    created_at: float = field(default_factory=time.monotonic)
+    last_seen: float = field(default_factory=time.monotonic)
+
+    def can(self, permission):
+        return permission in self.permissions
+
+_sessions = {}           # token -> Session
+_session_lock = threading.Lock()
+_limiter = LoginRateLimiter()
+_login_stats = {'logins': 0, 'rehashed': 0}
+
+LOGIN_ACCOUNT_SQL = "SELECT u.uid, u.password_hash, e.id as employee_id, u.username, e.role, e.fname FROM user_account u JOIN employee e ON u.uid = e.uid WHERE u.username = %s"
+
+@routed('primary')
+def login(username, password, outlet=DEFAULT_OUTLET):
+    """Verifies the credentials against an outlet's accounts and opens a session there.
+
+    Returns (session, None) or (None, error message). On success every later
+    db_connection() goes to that outlet.
+    """
+    if outlet not in OUTLETS:
+        return None, f"Unknown outlet '{outlet}'."
+    account = (outlet, username)
+    wait = _limiter.retry_after(account)
+    if wait:
+        return None, f"Too many failed attempts. Try again in {int(wait) + 1} seconds."
+    with db_connection(outlet) as conn:
+        if not conn: return None, "Database connection failed."
+        with conn.cursor() as cursor:
+            cursor.execute(LOGIN_ACCOUNT_SQL, (username,))
+            user = cursor.fetchone()
+            if not user:
+                verify_password(password, _dummy_hash())
+                _limiter.record_failure(account)
+                return None, "Invalid username or password."
+            stored_hash = user.pop('password_hash')
+            if not verify_password(password, stored_hash):
+                _limiter.record_failure(account)
+                return None, "Invalid username or password."
+            if needs_rehash(stored_hash):
+                cursor.execute("UPDATE user_account SET password_hash = %s WHERE uid = %s", (hash_password(password), user['uid']))
+                with _session_lock: _login_stats['rehashed'] += 1
+            permissions = _role_permissions(cursor, outlet, user['role'])
+        conn.commit()
+
+    _limiter.record_success(account)
+    user['outlet'] = outlet
+    set_current_outlet(outlet)
+    session = Session(secrets.token_urlsafe(24), user, permissions)
+    with _session_lock:
+        _evict_lapsed_sessions()
+        _sessions[session.token] = session
+        _login_stats['logins'] += 1
+    return session, None
+
+def _evict_lapsed_sessions():
+    # Called with _session_lock held, on every login, so sessions that were never
+    # closed (a terminal switched off) do not pile up.
+    cutoff = time.monotonic() - SESSION_IDLE_TIMEOUT
+    for token in [t for t, s in _sessions.items() if s.last_seen < cutoff]:
+        del _sessions[token]
+
+def get_session(token):
+    """Returns the live session for token, or None if it has been closed or has lapsed"""
+    with _session_lock:
+        session = _sessions.get(token)
+        if session is None: return None
+        now = time.monotonic()
+        if now - session.last_seen > SESSION_IDLE_TIMEOUT:
+            del _sessions[token]
+            return None
+        session.last_seen = now
+        return session
+
+def logout(token):
+    with _session_lock:
+        _sessions.pop(token, None)
+
+def forget_employee(employee_id, outlet=DEFAULT_OUTLET):
+    """Closes the open sessions of an employee whose role changed or who was deleted"""
+    with _session_lock:
+        for token in [t for t, s in _sessions.items() if (s.user.get('outlet'), s.user.get('employee_id')) == (outlet, employee_id)]:
+            del _sessions[token]
+
+def get_auth_stats():
+    """Returns login counts, rehashes, open sessions and rate limiter counts"""
+    with _session_lock:
+        stats = {**_login_stats, 'sessions': len(_sessions)}
+    return {**stats, **_limiter.get_stats()}
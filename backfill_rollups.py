@@ -0,0 +1,9 @@
+from utils import rebuild_sales_rollups
+
+def main():
+    """Rebuilds the dashboard rollup tables from the existing sales history"""
+    print("--- Backfilling Sales Rollups ---")
+    print(rebuild_sales_rollups())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+import customtkinter as ctk
+
+from main import DashboardChart
+
+def current_rss_mb():
+    """Resident memory of this process in MB (peak RSS where psutil is not installed)"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+def fake_dashboard_rows():
+    today = date.today()
+    sales = [{'sale_date': today - timedelta(days=d), 'daily_sales': random.uniform(500, 5000)} for d in range(random.randint(1, 7), 0, -1)]
+    dishes = [{'dname': f"Dish {i}", 'total_sold': random.randint(1, 400)} for i in range(random.randint(0, 5))]
+    return sales, dishes
+
+def main():
+    """Measures dashboard chart refresh time and memory growth without a database"""
+    parser = argparse.ArgumentParser(description="Benchmark dashboard chart refreshes.")
+    parser.add_argument("--refreshes", type=int, default=1000)
+    args = parser.parse_args()
+
+    root = ctk.CTk()
+    root.geometry("1200x500")
+    sales_frame = ctk.CTkFrame(root); sales_frame.pack(side="left", fill="both", expand=True)
+    dishes_frame = ctk.CTkFrame(root); dishes_frame.pack(side="left", fill="both", expand=True)
+    sales_chart = DashboardChart(sales_frame, 'Sales Over Last 7 Days', 'Date', 'Revenue (₹)', kind='line')
+    dishes_chart = DashboardChart(dishes_frame, 'Top 5 Selling Dishes', 'Dish', 'Quantity Sold', kind='bar')
+    root.update()
+
+    rss_start = current_rss_mb()
+    timings = []
+    for _ in range(args.refreshes):
+        sales, dishes = fake_dashboard_rows()
+        started = time.perf_counter()
+        sales_chart.update(sales, 'sale_date', 'daily_sales')
+        dishes_chart.update(dishes, 'dname', 'total_sold')
+        root.update()  # lets draw_idle actually render
+        timings.append((time.perf_counter() - started) * 1000)
+    rss_end = current_rss_mb()
+    root.destroy()
+
+    timings.sort()
+    print(f"--- {args.refreshes} dashboard chart refreshes ---")
+    print(f"mean {statistics.mean(timings):.1f} ms, p50 {timings[len(timings) // 2]:.1f} ms, p95 {timings[int(len(timings) * 0.95)]:.1f} ms")
+    print(f"RSS {rss_start:.1f} MB -> {rss_end:.1f} MB ({rss_end - rss_start:+.1f} MB)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import random
+import statistics
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+import pymysql
+
+import utils
+from migrations import migrate
+
+# --- Throwaway Database Setup ---
+# Everything here runs against a scratch database that is dropped and recreated
+# on each run. Never point it at the real restaurant database.
+
+PRODUCTION_DATABASE = 'restaurant-inventory-db'
+
+def load_schema(cursor, path='schema.sql'):
+    """Runs schema.sql statement by statement, skipping its CREATE DATABASE / USE lines"""
+    with open(path, encoding='utf-8') as f:
+        lines = [line for line in f if not line.lstrip().upper().startswith(('CREATE DATABASE', 'USE ', '--'))]
+    for statement in ''.join(lines).split(';'):
+        if statement.strip():
+            cursor.execute(statement)
+
+def create_bench_database(args):
+    conn = pymysql.connect(host=args.host, port=args.port, user=args.user, password=args.password, autocommit=True)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE IF EXISTS `{args.database}`")
+            cursor.execute(f"CREATE DATABASE `{args.database}`")
+            cursor.execute(f"USE `{args.database}`")
+            load_schema(cursor)
+    finally:
+        conn.close()
+    utils.DB_CONFIG.update(host=args.host, port=args.port, user=args.user, password=args.password, database=args.database)
+    utils.configure_pool(size=args.waiters + 2)
+    migrate()
+
+def seed_restaurant(args):
+    """Creates a synthetic restaurant and returns (waiter_ids, dishes)"""
+    rng = random.Random(args.seed)
+    today = date.today()
+    with utils.db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.executemany("INSERT INTO ingredients (name, unit, reorder_level) VALUES (%s, %s, %s)",
+                               [(f"Ingredient {i}", 'kg', 10) for i in range(args.ingredients)])
+            cursor.execute("SELECT id FROM ingredients")
+            ingredient_ids = [row['id'] for row in cursor.fetchall()]
+            cursor.execute("INSERT INTO supplier (name, email, phone) VALUES ('Bench Supplier', 'bench@example.com', '000')")
+            supplier_id = cursor.lastrowid
+
+            batches = []
+            for _ in range(args.batches):
+                qty = rng.randint(20, 200)
+                batches.append((rng.choice(ingredient_ids), supplier_id, qty, qty, rng.randint(1, 50),
+                                today, today + timedelta(days=rng.randint(1, 60))))
+            for start in range(0, len(batches), 5000):
+                cursor.executemany("""
+                INSERT INTO ingredient_batches
+                (ingredient_id, supplier_id, quantity_received, quantity_remaining, cost_per_unit, received_date, expiry_date)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """, batches[start:start + 5000])
+
+            cursor.executemany("INSERT INTO dish (dname, price, category) VALUES (%s, %s, %s)",
+                               [(f"Dish {i}", rng.randint(100, 900), rng.choice(['Starter', 'Main', 'Dessert'])) for i in range(args.dishes)])
+            cursor.execute("SELECT id, price FROM dish")
+            dishes = [(row['id'], float(row['price'])) for row in cursor.fetchall()]
+            recipe_rows = []
+            for dish_id, _ in dishes:
+                for ing_id in rng.sample(ingredient_ids, min(len(ingredient_ids), rng.randint(3, 6))):
+                    recipe_rows.append((dish_id, ing_id, round(rng.uniform(0.05, 0.5), 2)))
+            cursor.executemany("INSERT INTO recipe (dish_id, ingredient_id, quantity_needed) VALUES (%s, %s, %s)", recipe_rows)
+
+            cursor.executemany("INSERT INTO employee (role, fname, lname, email) VALUES ('waiter', %s, 'Bench', %s)",
+                               [(f"Waiter{i}", f"waiter{i}@bench.local") for i in range(args.waiters)])
+            cursor.execute("SELECT id FROM employee WHERE role = 'waiter'")
+            waiter_ids = [row['id'] for row in cursor.fetchall()]
+        conn.commit()
+    utils.reconcile_ingredient_stock(apply=True)
+    utils.warm_recipe_cache()
+    return waiter_ids, dishes
+
+# --- Load Driver ---
+
+def waiter_worker(waiter_id, dishes, sales, rng, results, lock):
+    for _ in range(sales):
+        order = rng.sample(dishes, rng.randint(1, min(5, len(dishes))))
+        order_items = [(dish_id, rng.randint(1, 3), price) for dish_id, price in order]
+        total_amount = sum(qty * price for _, qty, price in order_items)
+        started = time.perf_counter()
+        response = utils.process_sale(waiter_id, order_items, total_amount)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with lock:
+            results.append((elapsed_ms, response))
+
+def classify(response):
+    if "successfully" in response: return 'ok'
+    if "Insufficient stock" in response: return 'insufficient_stock'
+    if "1213" in response: return 'deadlock'
+    if "1205" in response: return 'lock_wait_timeout'
+    return 'other_error'
+
+def percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+def check_invariants():
+    """Returns a list of problems found after the run"""
+    problems = []
+    with utils.db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) AS n FROM ingredient_batches WHERE quantity_remaining < 0")
+            negative = cursor.fetchone()['n']
+            if negative: problems.append(f"{negative} batch(es) went negative")
+    drift = utils.reconcile_ingredient_stock(apply=False)
+    if drift: problems.append(f"ingredient_stock drifted for {len(drift)} ingredient(s)")
+    return problems
+
+def main():
+    """Drives concurrent waiters through utils.process_sale against a throwaway database"""
+    parser = argparse.ArgumentParser(description="Concurrent POS stress test. Drops and recreates --database.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--database", default="restaurant_bench")
+    parser.add_argument("--waiters", type=int, default=8)
+    parser.add_argument("--sales-per-waiter", type=int, default=200)
+    parser.add_argument("--dishes", type=int, default=50)
+    parser.add_argument("--ingredients", type=int, default=40)
+    parser.add_argument("--batches", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    if args.database == PRODUCTION_DATABASE:
+        sys.exit(f"Refusing to run against '{PRODUCTION_DATABASE}'; pick a throwaway --database.")
+
+    print(f"--- Setting up '{args.database}' ---")
+    create_bench_database(args)
+    waiter_ids, dishes = seed_restaurant(args)
+    print(f"{len(dishes)} dishes, {args.ingredients} ingredients, {args.batches} batches, {len(waiter_ids)} waiters")
+
+    results, lock = [], threading.Lock()
+    threads = [threading.Thread(target=waiter_worker, args=(waiter_id, dishes, args.sales_per_waiter, random.Random(args.seed + i), results, lock))
+               for i, waiter_id in enumerate(waiter_ids)]
+    started = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - started
+
+    outcomes = {}
+    for _, response in results:
+        outcome = classify(response)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    latencies = sorted(ms for ms, _ in results)
+    print(f"\n--- {len(results)} sales in {wall:.1f} s ({outcomes.get('ok', 0) / wall:.1f} successful sales/s) ---")
+    print(f"latency ms: p50 {percentile(latencies, 50):.1f}, p95 {percentile(latencies, 95):.1f}, p99 {percentile(latencies, 99):.1f}, mean {statistics.mean(latencies):.1f}")
+    for outcome in ('ok', 'insufficient_stock', 'deadlock', 'lock_wait_timeout', 'other_error'):
+        print(f"  {outcome}: {outcomes.get(outcome, 0)}")
+    print(f"sale metrics: {utils.get_sale_metrics()}")
+    print(f"pool: {utils.get_pool_stats()}")
+
+    problems = check_invariants()
+    for problem in problems: print(f"INVARIANT FAILED: {problem}")
+    if problems: sys.exit(1)
+    print("Invariants hold: no negative batches, ingredient_stock matches the batches.")
+
+if __name__ == "__main__":
+    main()
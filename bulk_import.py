@@ -0,0 +1,216 @@
+import argparse
+import csv
+import os
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from utils import get_import_lookups, bulk_insert_rows
+
+# --- Bulk Import ---
+# Streams a CSV or XLSX file, validates each row in memory against name -> id
+# lookups taken once up front, and inserts the good rows in chunks (one
+# executemany and one commit per chunk). Rejected rows go to an error report
+# next to the input file.
+
+CHUNK_SIZE = 5000
+# Quantities, costs and prices are DECIMAL(10, 2) columns
+DECIMAL_STEP = Decimal('0.01')
+DECIMAL_LIMIT = Decimal(10) ** 8
+
+IMPORT_COLUMNS = {
+    'ingredients': ('name', 'unit', 'reorder_level'),
+    'suppliers': ('name', 'email', 'phone'),
+    'batches': ('ingredient', 'supplier', 'quantity', 'cost_per_unit', 'expiry_date', 'received_date'),
+    'dishes': ('name', 'price', 'category'),
+    'recipes': ('dish', 'ingredient', 'quantity'),
+}
+OPTIONAL_COLUMNS = {'email', 'phone', 'supplier', 'received_date', 'category', 'reorder_level'}
+
+# --- Readers ---
+
+def _normalise_header(header):
+    return [str(h or '').strip().lower().replace(' ', '_') for h in header]
+
+def read_rows(path):
+    """Yields (row_number, dict) pairs from a CSV or XLSX file without loading it all"""
+    if path.lower().endswith(('.xlsx', '.xlsm')):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ValueError("Reading .xlsx files needs openpyxl (pip install openpyxl).")
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = _normalise_header(next(rows, []))
+            for number, values in enumerate(rows, start=2):
+                if any(v not in (None, '') for v in values):
+                    yield number, dict(zip(header, values))
+        finally:
+            workbook.close()
+    else:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            header = _normalise_header(next(reader, []))
+            for number, values in enumerate(reader, start=2):
+                if any(v.strip() for v in values):
+                    yield number, dict(zip(header, values))
+
+# --- Validation ---
+
+def _text(row, column):
+    value = row.get(column)
+    value = '' if value is None else str(value).strip()
+    if not value and column not in OPTIONAL_COLUMNS:
+        raise ValueError(f"'{column}' is required")
+    return value or None
+
+def _decimal(row, column, allow_zero=False):
+    try:
+        value = Decimal(str(_text(row, column)))
+    except InvalidOperation:
+        raise ValueError(f"'{column}' must be a number")
+    if not value.is_finite():
+        raise ValueError(f"'{column}' must be a number")  # NaN and Infinity parse but can't be compared or stored
+    if value < 0:
+        raise ValueError(f"'{column}' must be greater than zero")
+    if value < DECIMAL_LIMIT:
+        value = value.quantize(DECIMAL_STEP, rounding=ROUND_HALF_UP)
+    if value >= DECIMAL_LIMIT:
+        raise ValueError(f"'{column}' must be less than {DECIMAL_LIMIT:,}")
+    if value == 0 and not allow_zero:
+        raise ValueError(f"'{column}' must be greater than zero")
+    return value
+
+def _integer(row, column):
+    value = _decimal(row, column, allow_zero=True)
+    if Decimal(str(_text(row, column))) % 1:
+        raise ValueError(f"'{column}' must be a whole number")  # reorder_level is an INT column
+    return int(value)
+
+def _date(row, column):
+    value = row.get(column)
+    if isinstance(value, datetime): return value.date()
+    if isinstance(value, date): return value
+    text = _text(row, column)
+    if text is None: return None
+    try:
+        return date.fromisoformat(text[:10])
+    except ValueError:
+        raise ValueError(f"'{column}' must be a date (YYYY-MM-DD)")
+
+def _resolve(lookups, table, row, column):
+    name = _text(row, column)
+    if name is None: return None
+    found = lookups[table].get(name.lower())
+    if found is None:
+        raise ValueError(f"unknown {column} '{name}'")
+    return found
+
+def _check_name(lookups, table, name):
+    # Names are unique for ingredients and dishes, so duplicates are rejected here
+    # rather than failing the whole chunk with an IntegrityError.
+    if name.lower() in lookups[table]:
+        raise ValueError(f"'{name}' already exists")
+
+def _claim(kind, params, lookups):
+    # Called once the whole row is valid, so a rejected row never blocks a corrected one
+    if kind in ('ingredients', 'dishes'): lookups[kind][params[0].lower()] = None
+    elif kind == 'recipes': lookups['recipe_pairs'].add(params[:2])
+
+def release_claims(kind, rows, lookups):
+    """Forgets the names and recipe lines of a chunk that was rolled back"""
+    for params in rows:
+        if kind in ('ingredients', 'dishes'): lookups[kind].pop(params[0].lower(), None)
+        elif kind == 'recipes': lookups['recipe_pairs'].discard(params[:2])
+
+def validate_row(kind, row, lookups):
+    """Returns the INSERT parameters for one row, or raises ValueError"""
+    params = _row_params(kind, row, lookups)
+    _claim(kind, params, lookups)
+    return params
+
+def _row_params(kind, row, lookups):
+    if kind == 'ingredients':
+        name = _text(row, 'name'); _check_name(lookups, 'ingredients', name)
+        reorder_level = _text(row, 'reorder_level')
+        return (name, _text(row, 'unit'), _integer(row, 'reorder_level') if reorder_level else None)
+    if kind == 'suppliers':
+        return (_text(row, 'name'), _text(row, 'email'), _text(row, 'phone'))
+    if kind == 'batches':
+        ingredient_id = _resolve(lookups, 'ingredients', row, 'ingredient')
+        quantity = _decimal(row, 'quantity')
+        expiry_date = _date(row, 'expiry_date')
+        return (ingredient_id, _resolve(lookups, 'suppliers', row, 'supplier'), quantity, quantity,
+                _decimal(row, 'cost_per_unit', allow_zero=True), _date(row, 'received_date') or date.today(), expiry_date)
+    if kind == 'dishes':
+        name = _text(row, 'name'); _check_name(lookups, 'dishes', name)
+        return (name, _decimal(row, 'price'), _text(row, 'category'))
+    if kind == 'recipes':
+        dish_id = _resolve(lookups, 'dishes', row, 'dish')
+        ingredient_id = _resolve(lookups, 'ingredients', row, 'ingredient')
+        if (dish_id, ingredient_id) in lookups['recipe_pairs']:
+            raise ValueError("this ingredient is already in the recipe")
+        return (dish_id, ingredient_id, _decimal(row, 'quantity'))
+    raise ValueError(f"unknown import type '{kind}'")
+
+# --- Pipeline ---
+
+def import_file(path, kind, chunk_size=CHUNK_SIZE, error_report=None):
+    """Imports a CSV/XLSX file of the given kind. Returns a summary message."""
+    if kind not in IMPORT_COLUMNS:
+        return f"Error: Unknown import type '{kind}'. Choose one of: {', '.join(IMPORT_COLUMNS)}."
+    lookups = get_import_lookups()
+    if lookups is None:
+        return "Database connection failed."
+    error_report = error_report or os.path.splitext(path)[0] + "_errors.csv"
+    imported = rejected = 0
+    chunk, chunk_rows = [], []
+
+    with open(error_report, 'w', newline='', encoding='utf-8') as report_file:
+        report = csv.writer(report_file)
+        report.writerow(['row', 'error', *IMPORT_COLUMNS[kind]])
+
+        def flush():
+            nonlocal imported, rejected
+            result = bulk_insert_rows(kind, chunk)
+            if isinstance(result, str):
+                # The whole chunk was rolled back; report every row in it
+                for number, row in chunk_rows: report.writerow([number, result, *(row.get(c) for c in IMPORT_COLUMNS[kind])])
+                rejected += len(chunk)
+                release_claims(kind, chunk, lookups)
+            else:
+                imported += result
+            chunk.clear(); chunk_rows.clear()
+
+        try:
+            for number, row in read_rows(path):
+                try:
+                    chunk.append(validate_row(kind, row, lookups)); chunk_rows.append((number, row))
+                except ValueError as e:
+                    report.writerow([number, str(e), *(row.get(c) for c in IMPORT_COLUMNS[kind])])
+                    rejected += 1
+                if len(chunk) >= chunk_size: flush()
+            if chunk: flush()
+        except (OSError, ValueError) as e:
+            return f"Error: Could not read {os.path.basename(path)}: {e}"
+
+    if not rejected:
+        os.remove(error_report)
+        return f"Imported {imported} {kind} row(s) successfully!"
+    return f"Imported {imported} {kind} row(s) successfully! {rejected} row(s) rejected, see {error_report}."
+
+def main():
+    """Bulk-loads ingredients, suppliers, batches, dishes or recipes from a CSV or XLSX file"""
+    parser = argparse.ArgumentParser(description="Bulk import restaurant data from CSV or XLSX.")
+    parser.add_argument("kind", choices=list(IMPORT_COLUMNS))
+    parser.add_argument("path", help="CSV or XLSX file with a header row")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--errors", help="where to write rejected rows (default: <file>_errors.csv)")
+    args = parser.parse_args()
+
+    print(f"--- Importing {args.kind} from {args.path} ---")
+    print(f"Columns: {', '.join(IMPORT_COLUMNS[args.kind])} (optional: {', '.join(c for c in IMPORT_COLUMNS[args.kind] if c in OPTIONAL_COLUMNS) or 'none'})")
+    print(import_file(args.path, args.kind, args.chunk_size, args.errors))
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,20 @@
 import pymysql
-import pymysql.cursors
-import hashlib
 from getpass import getpass
 
-# --- Database Connection ---
-def connect_db():
-    """Establishes a connection to the database"""
-    try:
-        return pymysql.connect(
-            host='localhost',
-            user='root',
-            password='java0603',
-            database='restaurant-inventory-db',
-            cursorclass=pymysql.cursors.DictCursor,
-            autocommit=True
-        )
-    except pymysql.Error as e:
-        print(f"Database Error: {e}")
-        return None
+from auth import hash_password
+from utils import connect_db, OUTLETS, DEFAULT_OUTLET
 
 def create_admin_user():
     """Securely creates the first admin user"""
-    conn = connect_db()
+    outlet = DEFAULT_OUTLET
+    if len(OUTLETS) > 1:
+        outlet = input(f"Outlet ({', '.join(OUTLETS)}) [{DEFAULT_OUTLET}]: ").strip() or DEFAULT_OUTLET
+        if outlet not in OUTLETS:
+            print(f"Error: Unknown outlet '{outlet}'.")
+            return
+    conn = connect_db(outlet)
     if not conn:
+        print("Database Error: could not connect.")
         return
 
     print("--- Creating Initial Admin User ---")
@@ -30,8 +22,8 @@ def create_admin_user():
         username = input("Enter admin username: ")
         password = getpass("Enter admin password: ")
         
-        # Hash the password using SHA-256
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
+        # Salted PBKDF2 hash, the same format the login screen verifies
+        password_hash = hash_password(password)
 
         with conn.cursor() as cursor:
             # Create the user account
@@ -48,6 +40,7 @@ def create_admin_user():
             cursor.execute(sql_employee, ('admin', 'Admin', 'User', f'{username}@restaurant.com', user_id))
             employee_id = cursor.lastrowid
             print(f"Employee record created with ID: {employee_id}")
+        conn.commit()
 
         print("\nAdmin user created successfully!")
 
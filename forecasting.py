@@ -0,0 +1,203 @@
+import argparse
+import math
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from utils import db_connection, routed, fan_out, PerOutlet
+
+# --- Demand Forecasting ---
+# Sales are expanded through recipes into a days x ingredients consumption matrix
+# and every ingredient is forecast at once with array operations. The model only
+# looks at complete days, so it is fitted once and then advanced by one vector
+# update per day that has finished since; sales during the day only change the
+# stock side of the calculation, which is re-read on every call.
+
+HISTORY_DAYS = 90           # days of history used for a full fit
+SMOOTHING_ALPHA = 0.3       # exponential smoothing weight of the newest day
+MOVING_AVERAGE_DAYS = 14    # window for the moving-average model and the demand spread
+LEAD_TIME_DAYS = 3          # days between placing an order and the delivery
+REVIEW_DAYS = 7             # days until stock is next reviewed; orders cover lead time + review
+SERVICE_LEVEL_Z = 1.65      # safety stock multiplier (~95% of days without a stockout)
+FULL_REFIT_DAYS = 7         # refit from scratch at least this often (picks up recipe edits and late sales)
+
+FORECAST_METHODS = ('ses', 'moving_average')
+
+def load_daily_consumption(cursor, start, end):
+    """Ingredient usage per day for start <= day < end, as a days x ingredients DataFrame"""
+    sql = """
+    SELECT DATE(s.sale_time) AS day, r.ingredient_id, SUM(si.quantity * r.quantity_needed) AS used
+    FROM sales s
+    JOIN sale_items si ON si.sale_id = s.id
+    JOIN recipe r ON r.dish_id = si.dish_id
+    WHERE s.sale_time >= %s AND s.sale_time < %s
+    GROUP BY day, r.ingredient_id
+    """
+    cursor.execute(sql, (start, end))
+    frame = pd.DataFrame(cursor.fetchall(), columns=['day', 'ingredient_id', 'used'])
+    days = [start + timedelta(days=i) for i in range((end - start).days)]
+    if frame.empty:
+        return pd.DataFrame(index=days, dtype=float)
+    frame['used'] = frame['used'].astype(float)
+    return frame.pivot_table(index='day', columns='ingredient_id', values='used', aggfunc='sum', fill_value=0).reindex(days, fill_value=0)
+
+def exponential_smoothing(matrix, alpha=SMOOTHING_ALPHA, level=None):
+    """Simple exponential smoothing down the rows of matrix, for all columns at once. Returns the final level."""
+    values = matrix.to_numpy(dtype=float)
+    if level is None:
+        if not len(values): return pd.Series(0.0, index=matrix.columns)
+        level, values = values[0], values[1:]
+    else:
+        level = level.reindex(matrix.columns, fill_value=0).to_numpy()
+    for row in values:
+        level = alpha * row + (1 - alpha) * level
+    return pd.Series(level, index=matrix.columns)
+
+class ForecastCache:
+    """Fitted demand state: the smoothed level per ingredient and the most recent complete days."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.level = None          # Series of smoothed daily demand, indexed by ingredient_id
+        self.recent = None         # last MOVING_AVERAGE_DAYS complete days of consumption
+        self.fitted_through = None # last complete day folded into the model
+        self.fitted_on = None      # day of the last full fit
+        self.suppliers = None      # latest supplier per ingredient, reloaded once a day
+        self.suppliers_on = None
+        self.stats = {'full_fits': 0, 'days_folded': 0, 'cache_hits': 0}
+
+    def demand(self, cursor, today=None):
+        """Returns (smoothed level, recent days) as of yesterday, fitting or advancing as needed"""
+        today = today or date.today()
+        yesterday = today - timedelta(days=1)
+        with self._lock:
+            if self.fitted_on is None or (today - self.fitted_on).days >= FULL_REFIT_DAYS:
+                start = today - timedelta(days=HISTORY_DAYS)
+                history = load_daily_consumption(cursor, start, today)
+                self.level = exponential_smoothing(history)
+                self.recent = history.tail(MOVING_AVERAGE_DAYS)
+                self.fitted_through, self.fitted_on = yesterday, today
+                self.stats['full_fits'] += 1
+            elif self.fitted_through < yesterday:
+                new_days = load_daily_consumption(cursor, self.fitted_through + timedelta(days=1), today)
+                columns = self.level.index.union(new_days.columns)
+                new_days = new_days.reindex(columns=columns, fill_value=0)
+                self.level = exponential_smoothing(new_days, level=self.level.reindex(columns, fill_value=0))
+                self.recent = pd.concat([self.recent.reindex(columns=columns, fill_value=0), new_days]).tail(MOVING_AVERAGE_DAYS)
+                self.stats['days_folded'] += len(new_days)
+                self.fitted_through = yesterday
+            else:
+                self.stats['cache_hits'] += 1
+            return self.level, self.recent
+
+    def latest_suppliers(self, cursor, today=None):
+        """Returns who delivered each ingredient most recently, as of the start of today"""
+        today = today or date.today()
+        with self._lock:
+            if self.suppliers_on != today:
+                self.suppliers = _load_latest_suppliers(cursor)
+                self.suppliers_on = today
+            return self.suppliers
+
+    def clear(self):
+        with self._lock:
+            self.level = self.recent = self.fitted_through = self.fitted_on = None
+            self.suppliers = self.suppliers_on = None
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, 'fitted_through': self.fitted_through, 'ingredients': 0 if self.level is None else len(self.level)}
+
+_forecast_cache = PerOutlet(ForecastCache)  # each outlet has its own sales history
+
+def _load_latest_suppliers(cursor):
+    # Suggestions go to whoever delivered the ingredient most recently. This reads every
+    # batch, so ForecastCache keeps the result for the day instead of running it per call.
+    cursor.execute("""
+    SELECT ib.ingredient_id, ib.supplier_id, sp.name AS supplier_name
+    FROM ingredient_batches ib
+    JOIN (SELECT ingredient_id, MAX(id) AS id FROM ingredient_batches WHERE supplier_id IS NOT NULL GROUP BY ingredient_id) latest ON ib.id = latest.id
+    LEFT JOIN supplier sp ON ib.supplier_id = sp.id
+    """)
+    return pd.DataFrame(cursor.fetchall(), columns=['ingredient_id', 'supplier_id', 'supplier_name'])
+
+def _load_stock(cursor):
+    # Usable stock: the view leaves out batches that have already expired
+    cursor.execute("""
+    SELECT ingredient_id, ingredient_name AS name, unit, reorder_level, COALESCE(total_stock, 0) AS stock
+    FROM current_inventory_view
+    """)
+    stock = pd.DataFrame(cursor.fetchall(), columns=['ingredient_id', 'name', 'unit', 'reorder_level', 'stock'])
+    stock['stock'] = stock['stock'].astype(float)
+    return stock
+
+@routed('replica')
+def get_reorder_suggestions(method='ses', today=None):
+    """Forecast daily demand, days of cover and suggested order quantity for every ingredient.
+
+    Returns a DataFrame sorted by days of cover, or None if the database is unreachable.
+    """
+    with db_connection() as conn:
+        if not conn: return None
+        with conn.cursor() as cursor:
+            level, recent = _forecast_cache.demand(cursor, today)
+            frame = _load_stock(cursor).merge(_forecast_cache.latest_suppliers(cursor, today), on='ingredient_id', how='left')
+
+    ids = frame['ingredient_id']
+    if method == 'moving_average':
+        daily_demand = recent.mean().reindex(ids, fill_value=0).to_numpy() if len(recent) else np.zeros(len(ids))
+    else:
+        daily_demand = level.reindex(ids, fill_value=0).to_numpy()
+    spread = recent.std(ddof=0).reindex(ids, fill_value=0).to_numpy() if len(recent) else np.zeros(len(ids))
+    stock = frame['stock'].to_numpy()
+
+    frame['daily_demand'] = daily_demand
+    frame['days_of_cover'] = np.divide(stock, daily_demand, out=np.full(len(stock), np.inf), where=daily_demand > 0)
+    target = daily_demand * (LEAD_TIME_DAYS + REVIEW_DAYS) + SERVICE_LEVEL_Z * spread * math.sqrt(LEAD_TIME_DAYS)
+    frame['suggested_order'] = np.ceil(np.maximum(target - stock, 0) * 100) / 100
+    return frame.sort_values('days_of_cover').round({'daily_demand': 2, 'days_of_cover': 1}).reset_index(drop=True)
+
+def get_stock_alerts(method='ses'):
+    """Ingredients that need ordering: forecast shortfall before the next review, or below reorder level"""
+    frame = get_reorder_suggestions(method)
+    if frame is None: return []
+    needs_order = (frame['suggested_order'] > 0) | (frame['stock'] <= frame['reorder_level'].fillna(-1))
+    alerts = frame[needs_order].replace({np.inf: np.nan})
+    return alerts.astype(object).where(alerts.notna(), None).to_dict('records')
+
+@routed('replica')
+def get_group_stock_alerts(method='ses', outlets=None):
+    """Every outlet's stock alerts, fetched in parallel; each row carries its 'outlet'. Outlets that failed are left out."""
+    results = fan_out(get_stock_alerts, method, outlets=outlets)
+    return [{**alert, 'outlet': outlet} for outlet, alerts in results.items() if isinstance(alerts, list) for alert in alerts]
+
+def get_forecast_cache_stats():
+    """Returns full fits, days folded in incrementally and cache hits"""
+    return _forecast_cache.get_stats()
+
+def main():
+    """Prints suggested orders grouped by supplier"""
+    parser = argparse.ArgumentParser(description="Forecast ingredient demand and suggest orders per supplier.")
+    parser.add_argument("--method", choices=FORECAST_METHODS, default='ses')
+    parser.add_argument("--csv", help="also write every ingredient's forecast to this CSV file")
+    args = parser.parse_args()
+
+    frame = get_reorder_suggestions(args.method)
+    if frame is None:
+        print("Database Error: could not connect.")
+        return
+    if args.csv:
+        frame.to_csv(args.csv, index=False)
+    orders = frame[frame['suggested_order'] > 0]
+    if orders.empty:
+        print("No orders needed: every ingredient covers the lead time and review period.")
+        return
+    for supplier, lines in orders.groupby(orders['supplier_name'].fillna("(no supplier on record)")):
+        print(f"--- {supplier} ---")
+        for line in lines.itertuples():
+            print(f"  {line.name}: order {line.suggested_order} {line.unit} (stock {line.stock}, {line.days_of_cover} days of cover)")
+
+if __name__ == "__main__":
+    main()
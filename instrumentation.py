@@ -0,0 +1,312 @@
+import bisect
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pymysql
+import pymysql.cursors
+
+# --- Instrumentation ---
+# In-process metrics for the data layer:
+#   - every @routed function in utils (and the modules built on it): call latency
+#     and errors, counting both raised exceptions and returned error messages
+#   - every SQL statement run through an InstrumentedCursor: latency, rows
+#     returned or affected, and errors, keyed by the parameterised SQL text
+#   - every pool checkout: time spent waiting for a connection
+# Statements slower than SLOW_QUERY_SECONDS are logged with their EXPLAIN plan.
+# The numbers can be read as Prometheus text, as JSON, or in the admin's
+# Diagnostics tab.
+
+SLOW_QUERY_SECONDS = 0.2        # statements at least this slow go to the slow query log
+SLOW_QUERY_LOG_SIZE = 100       # slow statements kept in memory for the Diagnostics tab
+EXPLAIN_INTERVAL_SECONDS = 300  # the same slow statement is re-EXPLAINed at most this often
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRIC_PREFIX = 'restaurant'
+MAX_STATEMENT_KEYS = 500        # distinct statement shapes tracked; later ones are counted together
+OTHER_STATEMENTS = '(other statements)'
+
+slow_query_logger = logging.getLogger('restaurant.slow_queries')
+
+class Histogram:
+    """Cumulative-bucket latency histogram (Prometheus style) plus count, sum and max"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max: self.max = seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (the max if it falls past the last bucket)"""
+        if not self.count: return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank: return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count, 'avg_ms': round(self.total / self.count * 1000, 2) if self.count else 0.0,
+                'p50_ms': round(self.quantile(0.5) * 1000, 2), 'p95_ms': round(self.quantile(0.95) * 1000, 2),
+                'p99_ms': round(self.quantile(0.99) * 1000, 2), 'max_ms': round(self.max * 1000, 2),
+                'total_ms': round(self.total * 1000, 2)}
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.now()
+            self.functions = {}    # name -> {'latency': Histogram, 'exceptions': n, 'error_results': n}
+            self.statements = {}   # normalised SQL -> {'latency': Histogram, 'rows': n, 'errors': n}
+            self.acquires = {}     # pool label -> {'latency': Histogram, 'failed': n}
+            self.slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+            self._explained_at = {}
+
+    def record_call(self, name, seconds, outcome=None):
+        with self._lock:
+            entry = self.functions.get(name)
+            if entry is None:
+                entry = self.functions[name] = {'latency': Histogram(), 'exceptions': 0, 'error_results': 0}
+            entry['latency'].observe(seconds)
+            if outcome: entry[outcome] += 1
+
+    def record_statement(self, sql, seconds, rows, error=False):
+        with self._lock:
+            entry = self.statements.get(sql)
+            if entry is None:
+                if len(self.statements) >= MAX_STATEMENT_KEYS:
+                    sql = OTHER_STATEMENTS  # keeps memory and Prometheus label cardinality bounded
+                entry = self.statements.setdefault(sql, {'latency': Histogram(), 'rows': 0, 'errors': 0})
+            entry['latency'].observe(seconds)
+            entry['rows'] += max(rows, 0)
+            if error: entry['errors'] += 1
+
+    def record_acquire(self, pool, seconds, failed=False):
+        with self._lock:
+            entry = self.acquires.get(pool)
+            if entry is None:
+                entry = self.acquires[pool] = {'latency': Histogram(), 'failed': 0}
+            entry['latency'].observe(seconds)
+            if failed: entry['failed'] += 1
+
+    def should_explain(self, sql):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._explained_at.get(sql, -EXPLAIN_INTERVAL_SECONDS) < EXPLAIN_INTERVAL_SECONDS:
+                return False
+            if len(self._explained_at) >= MAX_STATEMENT_KEYS:
+                self._explained_at = {key: at for key, at in self._explained_at.items() if now - at < EXPLAIN_INTERVAL_SECONDS}
+            self._explained_at[sql] = now
+            return True
+
+    def record_slow(self, sql, seconds, rows, plan):
+        entry = {'at': datetime.now().isoformat(timespec='seconds'), 'statement': sql,
+                 'ms': round(seconds * 1000, 2), 'rows': rows, 'plan': plan}
+        with self._lock:
+            self.slow_queries.append(entry)
+        slow_query_logger.warning("slow query (%.1f ms, %d rows): %s\n  plan: %s", seconds * 1000, rows, sql, json.dumps(plan, default=str))
+
+    def snapshot(self):
+        """All metrics as plain JSON-serialisable data"""
+        with self._lock:
+            return {
+                'started_at': self.started_at.isoformat(timespec='seconds'),
+                'taken_at': datetime.now().isoformat(timespec='seconds'),
+                'functions': {name: {**e['latency'].summary(), 'exceptions': e['exceptions'], 'error_results': e['error_results']}
+                              for name, e in self.functions.items()},
+                'statements': {sql: {**e['latency'].summary(), 'rows': e['rows'], 'errors': e['errors']}
+                               for sql, e in self.statements.items()},
+                'pool_acquire': {pool: {**e['latency'].summary(), 'failed': e['failed']} for pool, e in self.acquires.items()},
+                'slow_queries': list(self.slow_queries),
+            }
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+
+        def histogram(name, help_text, label, entries):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} histogram")
+            for key, hist in entries:
+                labels = f'{label}="{_escape_label(key)}"'
+                seen = 0
+                for bound, count in zip(hist.buckets, hist.counts):
+                    seen += count
+                    lines.append(f'{METRIC_PREFIX}_{name}_bucket{{{labels},le="{bound}"}} {seen}')
+                lines.append(f'{METRIC_PREFIX}_{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f'{METRIC_PREFIX}_{name}_sum{{{labels}}} {hist.total:.6f}')
+                lines.append(f'{METRIC_PREFIX}_{name}_count{{{labels}}} {hist.count}')
+
+        def counter(name, help_text, samples):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} counter")
+            for labels, value in samples:
+                lines.append(f"{METRIC_PREFIX}_{name}{{{labels}}} {value}")
+
+        with self._lock:
+            histogram('function_duration_seconds', "Latency of data-layer functions.", 'function',
+                      [(name, e['latency']) for name, e in self.functions.items()])
+            counter('function_errors_total', "Data-layer calls that raised or returned an error message.",
+                    [(f'function="{_escape_label(name)}",kind="{kind}"', e[kind]) for name, e in self.functions.items() for kind in ('exceptions', 'error_results')])
+            histogram('sql_duration_seconds', "Latency of SQL statements.", 'statement',
+                      [(sql, e['latency']) for sql, e in self.statements.items()])
+            counter('sql_rows_total', "Rows returned or affected by SQL statements.",
+                    [(f'statement="{_escape_label(sql)}"', e['rows']) for sql, e in self.statements.items()])
+            counter('sql_errors_total', "SQL statements that raised an error.",
+                    [(f'statement="{_escape_label(sql)}"', e['errors']) for sql, e in self.statements.items()])
+            histogram('pool_acquire_seconds', "Time spent waiting for a pooled connection.", 'pool',
+                      [(pool, e['latency']) for pool, e in self.acquires.items()])
+            counter('pool_acquire_failures_total', "Checkouts that got no connection.",
+                    [(f'pool="{_escape_label(pool)}"', e['failed']) for pool, e in self.acquires.items()])
+        return "\n".join(lines) + "\n"
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+metrics = MetricsRegistry()
+
+_WHITESPACE = re.compile(r'\s+')
+_REPEATED_TUPLES = re.compile(r'(\([^()]*\))(?:, \1)+')          # VALUES (%s, 1), (%s, 1), ...
+_REPEATED_CASES = re.compile(r'WHEN %s THEN %s(?: WHEN %s THEN %s)+')  # CASE id WHEN %s THEN %s ...
+_REPEATED_PARAMS = re.compile(r'%s(?:, %s)+')                       # IN (%s, %s, ...)
+
+def normalise_sql(sql):
+    """Collapses whitespace and the lists generated per batch size (IN lists, VALUES tuples,
+    CASE ... WHEN arms) so one query shape is one metric"""
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    sql = _REPEATED_TUPLES.sub(r'\1, ...', sql)
+    sql = _REPEATED_CASES.sub('WHEN %s THEN %s ...', sql)
+    return _REPEATED_PARAMS.sub('%s, ...', sql)
+
+# How the message strings returned by the data functions start when they report a failure
+ERROR_MESSAGE_PREFIXES = ("Error", "Database", "An error", "An unexpected error")
+
+def call_outcome(result):
+    """'error_results' for the error messages data functions return instead of raising"""
+    if isinstance(result, str) and result.startswith(ERROR_MESSAGE_PREFIXES):
+        return 'error_results'
+    return None
+
+# --- Instrumented Cursor ---
+
+_EXPLAINABLE = ('select', 'insert', 'update', 'delete', 'replace', 'with')
+
+class InstrumentedCursor(pymysql.cursors.DictCursor):
+    """DictCursor that times each statement and EXPLAINs the slow ones"""
+
+    _in_executemany = False
+
+    def execute(self, query, args=None):
+        if self._in_executemany:
+            return super().execute(query, args)
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, args)
+        except Exception:
+            metrics.record_statement(normalise_sql(query), time.perf_counter() - started, 0, error=True)
+            raise
+        elapsed = time.perf_counter() - started
+        sql = normalise_sql(query)
+        metrics.record_statement(sql, elapsed, self.rowcount)
+        if elapsed >= SLOW_QUERY_SECONDS:
+            self._log_slow(sql, query, args, elapsed)
+        return result
+
+    def executemany(self, query, args):
+        # pymysql runs executemany through execute(); time the batch once, under its template
+        started = time.perf_counter()
+        self._in_executemany = True
+        try:
+            result = super().executemany(query, args)
+        except Exception:
+            metrics.record_statement(normalise_sql(query), time.perf_counter() - started, 0, error=True)
+            raise
+        finally:
+            self._in_executemany = False
+        elapsed = time.perf_counter() - started
+        metrics.record_statement(normalise_sql(query), elapsed, self.rowcount)
+        if elapsed >= SLOW_QUERY_SECONDS:
+            metrics.record_slow(normalise_sql(query), elapsed, self.rowcount, None)  # a batch has no single plan
+        return result
+
+    def _log_slow(self, sql, query, args, elapsed):
+        plan = None
+        if query.lstrip().lower().startswith(_EXPLAINABLE) and metrics.should_explain(sql):
+            # Rows of the slow statement are already buffered, so the connection is free for one more query
+            try:
+                with self.connection.cursor(pymysql.cursors.DictCursor) as cursor:
+                    cursor.execute("EXPLAIN " + query, args)
+                    plan = cursor.fetchall()
+            except pymysql.Error as e:
+                plan = [{'error': str(e)}]
+        metrics.record_slow(sql, elapsed, self.rowcount, plan)
+
+# --- Export ---
+
+def get_metrics():
+    return metrics.snapshot()
+
+def reset_metrics():
+    metrics.reset()
+
+def write_metrics_json(path):
+    """Writes the metrics snapshot to path (atomically, so readers never see half a file)"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(metrics.snapshot(), f, indent=2, default=str)
+    os.replace(tmp_path, path)
+    return f"Metrics saved to {path} successfully!"
+
+def start_json_dump(path, interval=60):
+    """Rewrites path with the current metrics every interval seconds on a daemon thread"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_metrics_json(path)
+            except OSError as e:
+                slow_query_logger.error("could not write metrics to %s: %s", path, e)
+    thread = threading.Thread(target=loop, name="metrics-json", daemon=True)
+    thread.start()
+    return thread
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, content_type = metrics.render_prometheus(), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, content_type = json.dumps(metrics.snapshot(), default=str), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        data = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the console
+
+def start_metrics_server(port, host='127.0.0.1'):
+    """Serves /metrics (Prometheus text) and /metrics.json on a daemon thread"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
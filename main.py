@@ -1,49 +1,318 @@
+import time
+_STARTUP_T0 = time.perf_counter()
+
+import argparse
+import sys
 import tkinter
 import customtkinter as ctk
-from tkinter import ttk, messagebox
-from tkcalendar import DateEntry
-import pymysql
-import pymysql.cursors
-import hashlib
+from tkinter import ttk, messagebox, filedialog
 import re
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
 
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.dates import DateFormatter
-from PIL import Image, ImageTk
+# matplotlib takes longer to import than the rest of the app put together;
+# it is loaded by import_charting() when the dashboard is first built.
+matplotlib = Figure = FigureCanvasTkAgg = DateFormatter = date2num = None
 
 from utils import (
-    get_all_employees, add_employee, update_employee, delete_employee,
-    get_all_ingredient_types, add_ingredient_type, get_all_suppliers,
-    get_batches_for_ingredient, add_ingredient_batch, add_supplier,
-    update_supplier, delete_supplier, get_all_dishes, add_dish,
+    get_employees_page, add_employee, update_employee, delete_employee,
+    get_ingredient_types_page, add_ingredient_type, get_all_suppliers, get_suppliers_page,
+    get_batches_page, add_ingredient_batch, add_supplier,
+    update_supplier, delete_supplier, get_pos_menu_index, get_dishes_page, add_dish,
     update_dish, delete_dish, get_recipe_for_dish, get_all_ingredient_names,
     add_ingredient_to_recipe, update_recipe_ingredient, remove_ingredient_from_recipe,
-    process_sale,
-    get_dashboard_kpis, get_sales_by_day, get_top_selling_dishes, get_low_stock_alerts
+    warm_recipe_cache,
+    get_dashboard_snapshot, get_group_dashboard_snapshot, OUTLETS, DEFAULT_OUTLET,
+    get_change_versions, get_expiry_summary, get_pool_stats, get_routing_stats, get_sale_metrics, get_recipe_cache_stats
 )
+from instrumentation import get_metrics, reset_metrics, write_metrics_json, start_metrics_server, start_json_dump
+import auth
+from sale_queue import submit_sale, replay_pending, QUEUED_MESSAGE
+from bulk_import import import_file, IMPORT_COLUMNS
+
+PROFILE_STARTUP = False
+
+def profile_mark(label, since=None):
+    """Prints elapsed time for --profile-startup, measured from process start by default"""
+    if PROFILE_STARTUP:
+        print(f"[startup] {label}: {(time.perf_counter() - (since or _STARTUP_T0)) * 1000:.0f} ms")
+
+def import_charting():
+    global matplotlib, Figure, FigureCanvasTkAgg, DateFormatter, date2num
+    if Figure is not None: return
+    started = time.perf_counter()
+    import matplotlib
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    from matplotlib.dates import DateFormatter, date2num
+    matplotlib.style.use('dark_background')
+    profile_mark("import matplotlib", since=started)
+
+# --- Dashboard Charts ---
+class DashboardChart:
+    """A dashboard chart whose figure, axes and canvas are built once and updated in place.
+
+    Figures are created directly rather than through pyplot, so nothing is kept
+    in pyplot's global figure registry between refreshes.
+    """
+    BAR_COLOR = '#3498db'
+
+    def __init__(self, parent_frame, title, xlabel, ylabel, kind='bar', max_bars=5):
+        import_charting()
+        self.kind = kind
+        self.figure = Figure(figsize=(6, 4), facecolor='#2B2B2B')
+        # Fixed margins instead of tight_layout(), which re-measures every label on each refresh
+        self.figure.subplots_adjust(left=0.13, right=0.97, top=0.85, bottom=0.22)
+        ax = self.ax = self.figure.add_subplot()
+        ax.set_facecolor('#242424')
+        ax.set_title(title, color='white', fontsize=14, fontweight='bold', pad=20)
+        ax.set_xlabel(xlabel, color='white', fontsize=10, labelpad=10)
+        ax.set_ylabel(ylabel, color='white', fontsize=10, labelpad=10)
+        ax.tick_params(axis='x', colors='white', labelsize=9, labelrotation=15)
+        ax.tick_params(axis='y', colors='white')
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+        ax.spines['left'].set_color('grey')
+        ax.spines['bottom'].set_color('grey')
+        ax.grid(axis='y', linestyle='--', alpha=0.2)
+        self.empty_text = ax.text(0.5, 0.5, "(No data available)", transform=ax.transAxes, ha='center', va='center', color='grey', visible=False)
+        if kind == 'bar':
+            self.bars = ax.bar(range(max_bars), [0] * max_bars, color=self.BAR_COLOR)
+            self.bar_labels = [ax.text(i, 0, "", ha='center', va='bottom', color='white', fontsize=10) for i in range(max_bars)]
+            ax.set_xticks(range(max_bars))
+        else:
+            self.line, = ax.plot([], [], marker='o', linestyle='-', color=self.BAR_COLOR, markersize=8, markerfacecolor='#85c1e9')
+            ax.xaxis.set_major_formatter(DateFormatter('%b %d'))
+        self.canvas = FigureCanvasTkAgg(self.figure, master=parent_frame)
+        self.canvas.get_tk_widget().pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=True, padx=10, pady=10)
+
+    def update(self, rows, x_col, y_col):
+        """Plots straight from the query rows, skipping any row without a numeric value"""
+        points = [(row[x_col], float(row[y_col])) for row in rows if row.get(y_col) is not None]
+        self.empty_text.set_visible(not points)
+        if self.kind == 'bar': self._update_bars(points)
+        else: self._update_line(points)
+        self.canvas.draw_idle()
+
+    def _update_bars(self, points):
+        top = max((y for _, y in points), default=0) or 1
+        for i, (bar, label) in enumerate(zip(self.bars, self.bar_labels)):
+            visible = i < len(points)
+            height = points[i][1] if visible else 0
+            bar.set_height(height); bar.set_visible(visible)
+            label.set_text(f"{height:.0f}" if visible else ""); label.set_y(height)
+        self.ax.set_xticklabels([str(x) for x, _ in points] + [""] * (len(self.bars) - len(points)), ha='right')
+        self.ax.set_xlim(-0.5, max(len(points), 1) - 0.5)
+        self.ax.set_ylim(0, top * 1.15)
+
+    def _update_line(self, points):
+        self.line.set_data([date2num(x) for x, _ in points], [y for _, y in points])
+        self.ax.relim()
+        self.ax.autoscale_view()
+        if len(points) == 1:
+            # A single point has no width for autoscale to work with
+            x = date2num(points[0][0])
+            self.ax.set_xlim(x - 1, x + 1)
+
+# --- Background Data Loading ---
+class BackgroundLoader:
+    """Runs utils data calls on worker threads and applies their results on the Tk thread.
+
+    Every request has a key (normally the widget it fills) and only the latest
+    request per key is applied. Requests tagged with a tab group can be cancelled
+    when the user leaves that tab and re-run when they come back.
+    """
+    POLL_MS = 30
+
+    def __init__(self, widget, max_workers=4, on_busy_change=None):
+        self.widget = widget
+        self.on_busy_change = on_busy_change
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db-loader")
+        self._results = queue.Queue()
+        self._pending = {}   # key -> (future, group, request)
+        self._deferred = {}  # group -> {key: request} cancelled while the tab was hidden
+        self._busy = False
+        self._poll_id = self.widget.after(self.POLL_MS, self._poll)
+
+    def submit(self, key, fn, on_done, *args, group=None, on_error=None):
+        previous = self._pending.pop(key, None)
+        if previous: previous[0].cancel()
+        if group is not None: self._deferred.get(group, {}).pop(key, None)
+        request = (fn, on_done, args, on_error)
+        future = self._executor.submit(fn, *args)
+        self._pending[key] = (future, group, request)
+        # Tk is not thread-safe, so workers only hand results over through the queue.
+        future.add_done_callback(lambda f, k=key: self._results.put((k, f)))
+        self._set_busy(True)
+
+    def cancel(self, key):
+        entry = self._pending.pop(key, None)
+        if entry: entry[0].cancel()
+        self._set_busy(bool(self._pending))
+
+    def cancel_other_groups(self, current_group):
+        for key, (future, group, request) in list(self._pending.items()):
+            if group is not None and group != current_group:
+                future.cancel()
+                del self._pending[key]
+                self._deferred.setdefault(group, {})[key] = request
+        self._set_busy(bool(self._pending))
 
-# --- Database Connection & Login Verification ---
-def connect_db():
-    try:
-        return pymysql.connect(host='localhost', user='root', password='java0603', database='restaurant-inventory-db', cursorclass=pymysql.cursors.DictCursor, autocommit=False)
-    except pymysql.Error as e:
-        messagebox.showerror("Database Error", f"Could not connect: {e}")
-        return None
-
-def verify_login(username, password):
-    try:
-        conn = pymysql.connect(host='localhost', user='root', password='java0603', database='restaurant-inventory-db', cursorclass=pymysql.cursors.DictCursor, autocommit=True)
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
-        with conn.cursor() as cursor:
-            sql = "SELECT u.uid, e.id as employee_id, u.username, e.role, e.fname FROM user_account u JOIN employee e ON u.uid = e.uid WHERE u.username = %s AND u.password_hash = %s"
-            cursor.execute(sql, (username, password_hash))
-            return cursor.fetchone()
-    except pymysql.Error:
-        return None
-    finally:
-        if 'conn' in locals() and conn: conn.close()
+    def resume_group(self, group):
+        for key, (fn, on_done, args, on_error) in self._deferred.pop(group, {}).items():
+            self.submit(key, fn, on_done, *args, group=group, on_error=on_error)
+
+    def shutdown(self):
+        self.widget.after_cancel(self._poll_id)
+        self._pending.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _poll(self):
+        try:
+            while True:
+                try: key, future = self._results.get_nowait()
+                except queue.Empty: break
+                entry = self._pending.get(key)
+                if not entry or entry[0] is not future: continue  # superseded or cancelled
+                del self._pending[key]
+                fn, on_done, args, on_error = entry[2]
+                if future.exception() is not None:
+                    if on_error: on_error(future.exception())
+                    else: messagebox.showerror("Database Error", f"Could not load data: {future.exception()}")
+                else:
+                    on_done(future.result())
+            self._set_busy(bool(self._pending))
+        finally:
+            self._poll_id = self.widget.after(self.POLL_MS, self._poll)
+
+    def _set_busy(self, busy):
+        if busy != self._busy:
+            self._busy = busy
+            if self.on_busy_change: self.on_busy_change(busy)
+
+# --- Paged Tables ---
+PAGE_SIZE = 100
+
+class PagedTable:
+    """A Treeview that shows one keyset-paginated page of rows at a time.
+
+    fetch_page(*params, after, limit) must return rows ordered by the key that
+    cursor_of(row) gives for the last row. Refreshes diff the new page against
+    the rows already shown (matched by row_key), so unchanged rows are left
+    alone and the selection survives.
+    """
+
+    def __init__(self, parent, columns, loader, loader_key, group, fetch_page, row_key, row_values, cursor_of=None, page_size=PAGE_SIZE):
+        self.loader = loader
+        self.loader_key = loader_key
+        self.group = group
+        self.fetch_page = fetch_page
+        self.row_key = row_key
+        self.row_values = row_values
+        self.cursor_of = cursor_of or row_key
+        self.page_size = page_size
+        self.params = ()
+        self.page_starts = [None]  # cursor each visited page starts after; the last one is the current page
+        self.next_cursor = None
+
+        self.frame = ctk.CTkFrame(parent, fg_color="transparent"); self.frame.grid_rowconfigure(0, weight=1); self.frame.grid_columnconfigure(0, weight=1)
+        self.tree = ttk.Treeview(self.frame, columns=columns, show="headings"); self.tree.grid(row=0, column=0, sticky="nsew")
+        v_scroll = ttk.Scrollbar(self.frame, orient="vertical", command=self.tree.yview); v_scroll.grid(row=0, column=1, sticky="ns"); self.tree.configure(yscrollcommand=v_scroll.set)
+        nav_frame = ctk.CTkFrame(self.frame, fg_color="transparent"); nav_frame.grid(row=1, column=0, columnspan=2, sticky="ew", pady=(5, 0)); nav_frame.grid_columnconfigure(1, weight=1)
+        self.prev_button = ctk.CTkButton(nav_frame, text="< Prev", width=70, command=self.previous_page); self.prev_button.grid(row=0, column=0)
+        self.page_label = ctk.CTkLabel(nav_frame, text="Page 1"); self.page_label.grid(row=0, column=1)
+        self.next_button = ctk.CTkButton(nav_frame, text="Next >", width=70, command=self.next_page); self.next_button.grid(row=0, column=2)
+        self._update_nav()
+
+    def set_params(self, *params):
+        """Points the table at a new query (e.g. another ingredient) and goes back to page 1"""
+        self.params = params
+        self.page_starts = [None]
+        self.refresh()
+
+    def refresh(self):
+        self.loader.submit(self.loader_key, self.fetch_page, self._apply, *self.params, self.page_starts[-1], self.page_size + 1, group=self.group)
+
+    def clear(self):
+        self.loader.cancel(self.loader_key)
+        self.page_starts = [None]; self.next_cursor = None
+        self.tree.delete(*self.tree.get_children())
+        self._update_nav()
+
+    def next_page(self):
+        if self.next_cursor is None: return
+        self.page_starts.append(self.next_cursor); self.refresh()
+
+    def previous_page(self):
+        if len(self.page_starts) == 1: return
+        self.page_starts.pop(); self.refresh()
+
+    def _apply(self, rows):
+        if not rows and len(self.page_starts) > 1:
+            # Everything on this page went away; fall back to the previous one
+            self.page_starts.pop(); self.refresh(); return
+        page = rows[:self.page_size]
+        self.next_cursor = self.cursor_of(page[-1]) if len(rows) > self.page_size else None
+        existing = set(self.tree.get_children())
+        wanted = set()
+        for index, row in enumerate(page):
+            iid = str(self.row_key(row)); values = tuple(str(v) for v in self.row_values(row))
+            wanted.add(iid)
+            if iid not in existing:
+                self.tree.insert("", index, iid=iid, values=values)
+                continue
+            if tuple(str(v) for v in self.tree.item(iid, 'values')) != values: self.tree.item(iid, values=values)
+            if self.tree.index(iid) != index: self.tree.move(iid, "", index)
+        stale = existing - wanted
+        if stale: self.tree.delete(*stale)
+        self._update_nav()
+
+    def _update_nav(self):
+        self.page_label.configure(text=f"Page {len(self.page_starts)}")
+        self.prev_button.configure(state="normal" if len(self.page_starts) > 1 else "disabled")
+        self.next_button.configure(state="normal" if self.next_cursor is not None else "disabled")
+
+PROFITABILITY_DAYS = 30
+EXPIRY_WINDOW_DAYS = 7
+
+def load_dish_profitability():
+    # analytics pulls in pandas and NumPy, so it is imported the first time the panel loads
+    from analytics import get_profitability_rows
+    return get_profitability_rows(days=PROFITABILITY_DAYS)
+
+def load_stock_alerts():
+    # Forecast-based: flags ingredients that will run short before the next delivery could arrive
+    from forecasting import get_stock_alerts
+    return get_stock_alerts()
+
+def load_group_stock_alerts():
+    from forecasting import get_group_stock_alerts
+    return get_group_stock_alerts()
+
+def load_forecast_cache_stats():
+    # Only once the alerts panel has loaded forecasting; Diagnostics shouldn't pull in pandas for it
+    forecasting = sys.modules.get('forecasting')
+    return forecasting.get_forecast_cache_stats() if forecasting else None
+
+def export_dish_profitability(path):
+    from analytics import export_profitability
+    return export_profitability(path, days=PROFITABILITY_DAYS)
+
+# Each dashboard panel: the utils call that feeds it and the change-log topics it depends on
+DASHBOARD_PANELS = {
+    # KPIs, the sales chart and top dishes, all from one stored-procedure call
+    'snapshot': (lambda versions: get_dashboard_snapshot(days=7, top=5, versions=versions), ('sales',)),
+    'alerts': (load_stock_alerts, ('sales', 'stock')),
+    'profitability': (load_dish_profitability, ('sales', 'stock', 'recipes')),  # rows reused for analytics.PROFITABILITY_TTL
+    'expiry': (lambda: get_expiry_summary(days=EXPIRY_WINDOW_DAYS), ('stock',)),
+}
+LIVE_POLL_MS = 5000
+SALE_REPLAY_MS = 15000  # how often queued offline sales are sent to the database
+DIAGNOSTICS_REFRESH_MS = 5000
+POS_GRID_COLUMNS = 4
+POS_PAGE_SIZE = 24          # menu buttons on one page (six rows of four)
+POS_ALL_CATEGORIES = "All"
 
 # --- App and Frame Classes ---
 class App(ctk.CTk):
@@ -54,7 +323,7 @@ class App(ctk.CTk):
         self.minsize(500, 450)
         ctk.set_appearance_mode("Dark")
         ctk.set_default_color_theme("blue")
-        self.user_info = None
+        self.session_token = None
         
         self.container = ctk.CTkFrame(self)
         self.container.pack(side="top", fill="both", expand=True)
@@ -72,26 +341,41 @@ class App(ctk.CTk):
         if frame:
             frame.tkraise()
 
-    def successful_login(self, user_data):
-        self.user_info = user_data
+    def successful_login(self, session):
+        self.session_token = session.token
+        if len(OUTLETS) > 1: self.title(f"Restaurant BI Dashboard - {session.user['outlet']}")
+        threading.Thread(target=warm_recipe_cache, args=(session.user['outlet'],), daemon=True).start()  # before the first sale needs it
+        self.login_time = time.perf_counter()
         
         self.main_app_frame = MainApplicationFrame(parent=self.container, controller=self)
         self.frames[MainApplicationFrame] = self.main_app_frame
         self.main_app_frame.grid(row=0, column=0, sticky="nsew")
         
         self.login_frame.destroy()
+        self.unbind('<Return>')  # the login shortcut; Enter in the POS search adds a dish
         
         self.geometry("1300x800")
         self.minsize(1200, 700)
         
         self.show_frame(MainApplicationFrame)
 
+    def current_session(self):
+        """The live auth session (touching it), or None after logging out once it has lapsed"""
+        session = auth.get_session(self.session_token) if self.session_token else None
+        if session is None and self.session_token:
+            self.session_token = None
+            messagebox.showinfo("Session Expired", "You were logged out after a long time without activity. Please log in again.")
+            self.after_idle(self.logout)
+        return session
+
     def logout(self):
         if hasattr(self, 'main_app_frame'):
             self.main_app_frame.destroy()
             del self.frames[MainApplicationFrame]
 
-        self.user_info = None
+        if self.session_token: auth.logout(self.session_token)
+        self.session_token = None
+        self.title("Restaurant BI Dashboard")
         self.login_frame = LoginFrame(parent=self.container, controller=self)
         self.frames[LoginFrame] = self.login_frame
         self.login_frame.grid(row=0, column=0, sticky="nsew")
@@ -109,6 +393,9 @@ class LoginFrame(ctk.CTkFrame):
         self.username_entry.pack(pady=12, padx=10)
         self.password_entry = ctk.CTkEntry(self, width=250, placeholder_text="Password", show="*")
         self.password_entry.pack(pady=12, padx=10)
+        self.outlet_menu = ctk.CTkOptionMenu(self, width=250, values=list(OUTLETS))
+        self.outlet_menu.set(DEFAULT_OUTLET)
+        if len(OUTLETS) > 1: self.outlet_menu.pack(pady=12, padx=10)
         self.login_button = ctk.CTkButton(self, text="Login", command=self.login_event)
         self.login_button.pack(pady=20, padx=10)
         self.controller.bind('<Return>', lambda event=None: self.login_button.invoke())
@@ -119,27 +406,49 @@ class LoginFrame(ctk.CTkFrame):
         if not username or not password:
             messagebox.showwarning("Login Error", "Username and password are required.")
             return
-        user_data = verify_login(username, password)
-        if user_data:
-            messagebox.showinfo("Login Successful", f"Welcome, {user_data['fname']}!")
-            self.controller.successful_login(user_data)
+        session, error = auth.login(username, password, self.outlet_menu.get())
+        if session:
+            messagebox.showinfo("Login Successful", f"Welcome, {session.user['fname']}!")
+            self.controller.successful_login(session)
         else:
-            messagebox.showerror("Login Failed", "Invalid username or password.")
+            messagebox.showerror("Login Failed", error)
 
 class MainApplicationFrame(ctk.CTkFrame):
     def __init__(self, parent, controller):
         super().__init__(parent)
         self.controller = controller
-        plt.style.use('dark_background')
+        self.tab_builders = {}
+        self.built_tabs = set()
+        style = ttk.Style(); style.theme_use("default"); style.configure("Treeview", background="#2a2d2e", foreground="white", fieldbackground="#2a2d2e", borderwidth=0); style.map('Treeview', background=[('selected', '#2c5d87')]); style.configure("Treeview.Heading", font=('Calibri', 10,'bold'), background="#2c5d87", foreground="white", relief="flat"); style.map("Treeview.Heading", background=[('active', '#3a75a8')])
         
         logout_button = ctk.CTkButton(self, text="Logout", width=100, command=self.controller.logout, fg_color="#D32F2F", hover_color="#B71C1C")
         logout_button.place(relx=0.99, y=10, anchor='ne')
+        self.loading_label = ctk.CTkLabel(self, text="", text_color="gray")
+        self.loading_label.place(relx=0.90, y=12, anchor='ne')
+        self.loader = BackgroundLoader(self, on_busy_change=self.set_loading)
 
-        self.notebook = ctk.CTkTabview(self, width=1250, height=750)
+        self.notebook = ctk.CTkTabview(self, width=1250, height=750, command=self.on_tab_change)
         self.notebook.pack(pady=(40, 10), padx=10, fill="both", expand=True)
         
         self.create_tabs_based_on_role()
 
+    def destroy(self):
+        if hasattr(self, 'dashboard_poll_id'): self.after_cancel(self.dashboard_poll_id)
+        if hasattr(self, 'sale_replay_id'): self.after_cancel(self.sale_replay_id)
+        if hasattr(self, 'diagnostics_poll_id'): self.after_cancel(self.diagnostics_poll_id)
+        self.loader.shutdown()
+        super().destroy()
+
+    def set_loading(self, busy):
+        self.loading_label.configure(text="Loading..." if busy else "")
+
+    def on_tab_change(self):
+        if not self.controller.current_session(): return
+        current_tab = self.notebook.get()
+        self.ensure_tab_built(current_tab)
+        self.loader.cancel_other_groups(current_tab)
+        self.loader.resume_group(current_tab)
+
 
     def is_valid_email(self, email):
         """regex for validating an email address"""
@@ -148,29 +457,43 @@ class MainApplicationFrame(ctk.CTkFrame):
         return False
 
     def create_tabs_based_on_role(self):
-        user_role = self.controller.user_info.get('role')
+        # Tabs are only added here; each one is built and populated the first time it is shown.
+        session = self.controller.current_session()
+        if not session: return
         
-        if user_role in ['admin', 'manager']:
-            dashboard_tab = self.notebook.add("Dashboard")
-            self.populate_dashboard_tab(dashboard_tab)
-        if user_role in ['admin', 'manager', 'waiter']:
-            pos_tab = self.notebook.add("New Sale")
-            self.populate_pos_tab(pos_tab)
-        if user_role in ['admin', 'manager', 'chef']:
-            menu_tab = self.notebook.add("Menu & Recipes")
-            self.populate_menu_tab(menu_tab)
-        if user_role in ['admin', 'manager', 'chef']:
-            inventory_tab = self.notebook.add("Inventory")
-            self.populate_inventory_tab(inventory_tab)
-        if user_role == 'admin':
-            suppliers_tab = self.notebook.add("Suppliers")
-            employees_tab = self.notebook.add("Employees")
-            self.populate_suppliers_tab(suppliers_tab)
-            self.populate_employees_tab(employees_tab)
+        if session.can('dashboard'):
+            self.add_lazy_tab("Dashboard", self.populate_dashboard_tab)
+        if session.can('sales'):
+            self.add_lazy_tab("New Sale", self.populate_pos_tab)
+        if session.can('menu'):
+            self.add_lazy_tab("Menu & Recipes", self.populate_menu_tab)
+        if session.can('inventory'):
+            self.add_lazy_tab("Inventory", self.populate_inventory_tab)
+        if session.can('suppliers'):
+            self.add_lazy_tab("Suppliers", self.populate_suppliers_tab)
+        if session.can('employees'):
+            self.add_lazy_tab("Employees", self.populate_employees_tab)
+        if session.can('diagnostics'):
+            self.add_lazy_tab("Diagnostics", self.populate_diagnostics_tab)
             
-        if user_role == 'waiter': self.notebook.set("New Sale")
-        elif user_role == 'chef': self.notebook.set("Menu & Recipes")
-        else: self.notebook.set("Dashboard")
+        if not self.tab_builders:
+            messagebox.showerror("Access Denied", "Your role has no screens assigned. Ask an admin to grant permissions.")
+            self.after_idle(self.controller.logout)
+            return
+        first_tab = next(iter(self.tab_builders))
+        self.notebook.set(first_tab)
+        self.ensure_tab_built(first_tab)
+        login_time = self.controller.login_time
+        self.after_idle(lambda: profile_mark("time to first tab (from login)", since=login_time))
+
+    def add_lazy_tab(self, name, builder):
+        self.notebook.add(name)
+        self.tab_builders[name] = builder
+
+    def ensure_tab_built(self, name):
+        if name in self.built_tabs or name not in self.tab_builders: return
+        self.built_tabs.add(name)
+        self.tab_builders[name](self.notebook.tab(name))
 
     def populate_dashboard_tab(self, tab):
         self.dashboard_widgets = {}
@@ -180,37 +503,61 @@ class MainApplicationFrame(ctk.CTkFrame):
         header_frame.grid(row=0, column=0, sticky="ew", padx=10, pady=10)
         header_frame.grid_columnconfigure(0, weight=1)
         ctk.CTkLabel(header_frame, text="Business Intelligence Dashboard", font=ctk.CTkFont(size=20, weight="bold")).grid(row=0, column=0, padx=10, pady=10)
-        ctk.CTkButton(header_frame, text="Refresh Data", command=self.refresh_dashboard_data).grid(row=0, column=1, padx=10, pady=10)
+        self.dashboard_widgets['updated_label'] = ctk.CTkLabel(header_frame, text="", text_color="gray"); self.dashboard_widgets['updated_label'].grid(row=0, column=1, padx=10, pady=10)
+        self.live_switch = ctk.CTkSwitch(header_frame, text="Live"); self.live_switch.select(); self.live_switch.grid(row=0, column=2, padx=10, pady=10)
+        ctk.CTkButton(header_frame, text="Refresh Data", command=self.refresh_dashboard_data).grid(row=0, column=3, padx=10, pady=10)
+        self.dashboard_scope = ctk.CTkSegmentedButton(header_frame, values=["This Outlet", "All Outlets"], command=lambda _: self.refresh_dashboard_data(['snapshot', 'alerts'])); self.dashboard_scope.set("This Outlet")
+        session = self.controller.current_session()
+        if len(OUTLETS) > 1 and session and session.can('all_outlets'): self.dashboard_scope.grid(row=0, column=4, padx=10, pady=10)
         content_frame = ctk.CTkFrame(tab, fg_color="transparent")
         content_frame.grid(row=1, column=0, sticky="nsew", padx=10, pady=0)
         content_frame.grid_columnconfigure((0, 1), weight=1)
         content_frame.grid_rowconfigure((1, 2), weight=1)
         kpi_frame = ctk.CTkFrame(content_frame)
         kpi_frame.grid(row=0, column=0, columnspan=2, sticky="ew", pady=(0, 10))
-        kpi_frame.grid_columnconfigure((0, 1, 2), weight=1)
+        kpi_frame.grid_columnconfigure((0, 1, 2, 3, 4), weight=1)
         self.create_kpi_widgets(kpi_frame)
         self.dashboard_widgets['sales_chart_frame'] = ctk.CTkFrame(content_frame)
         self.dashboard_widgets['sales_chart_frame'].grid(row=1, column=0, sticky="nsew", padx=(0, 5), pady=5)
         self.dashboard_widgets['top_dishes_chart_frame'] = ctk.CTkFrame(content_frame)
         self.dashboard_widgets['top_dishes_chart_frame'].grid(row=1, column=1, sticky="nsew", padx=(5, 0), pady=5)
+        self.dashboard_widgets['sales_chart'] = DashboardChart(self.dashboard_widgets['sales_chart_frame'], 'Sales Over Last 7 Days', 'Date', 'Revenue (₹)', kind='line')
+        self.dashboard_widgets['top_dishes_chart'] = DashboardChart(self.dashboard_widgets['top_dishes_chart_frame'], 'Top 5 Selling Dishes', 'Dish', 'Quantity Sold', kind='bar')
         alerts_frame = ctk.CTkFrame(content_frame)
-        alerts_frame.grid(row=2, column=0, columnspan=2, sticky="nsew", pady=(5, 0))
+        alerts_frame.grid(row=2, column=0, sticky="nsew", padx=(0, 5), pady=(5, 0))
         alerts_frame.grid_rowconfigure(1, weight=1)
         alerts_frame.grid_columnconfigure(0, weight=1)
-        ctk.CTkLabel(alerts_frame, text="Low Stock Alerts", font=ctk.CTkFont(size=16, weight="bold")).grid(row=0, column=0, pady=5)
-        alert_columns = ("Ingredient", "Stock", "Reorder Level", "Unit")
+        ctk.CTkLabel(alerts_frame, text="Stock Alerts & Reorder Suggestions", font=ctk.CTkFont(size=16, weight="bold")).grid(row=0, column=0, pady=5)
+        alert_columns = ("Ingredient", "Stock", "Days of Cover", "Suggested Order", "Supplier")
         self.dashboard_widgets['alerts_tree'] = ttk.Treeview(alerts_frame, columns=alert_columns, show="headings")
         self.dashboard_widgets['alerts_tree'].grid(row=1, column=0, sticky="nsew", padx=10, pady=(0, 10))
         for col in alert_columns:
             self.dashboard_widgets['alerts_tree'].heading(col, text=col, anchor='center')
-            self.dashboard_widgets['alerts_tree'].column(col, anchor='center')
-        self.refresh_dashboard_data()
+            self.dashboard_widgets['alerts_tree'].column(col, anchor='center', width=90)
+        profit_frame = ctk.CTkFrame(content_frame)
+        profit_frame.grid(row=2, column=1, sticky="nsew", padx=(5, 0), pady=(5, 0))
+        profit_frame.grid_rowconfigure(1, weight=1)
+        profit_frame.grid_columnconfigure(0, weight=1)
+        ctk.CTkLabel(profit_frame, text=f"Dish Profitability (last {PROFITABILITY_DAYS} days)", font=ctk.CTkFont(size=16, weight="bold")).grid(row=0, column=0, pady=5)
+        ctk.CTkButton(profit_frame, text="Export...", width=80, command=self.export_profitability_event).grid(row=0, column=0, padx=10, sticky="e")
+        profit_columns = ("Dish", "Price", "Unit Cost", "Margin %", "Sold", "Gross Profit")
+        self.dashboard_widgets['profit_tree'] = ttk.Treeview(profit_frame, columns=profit_columns, show="headings")
+        self.dashboard_widgets['profit_tree'].grid(row=1, column=0, sticky="nsew", padx=10, pady=(0, 10))
+        for col in profit_columns:
+            self.dashboard_widgets['profit_tree'].heading(col, text=col, anchor='center')
+            self.dashboard_widgets['profit_tree'].column(col, anchor='w' if col == "Dish" else 'center', width=80)
+        # The first change-feed check finds every topic new and so loads every panel.
+        self.dashboard_versions = {}
+        self.check_dashboard_changes()
+        self.dashboard_poll_id = self.after(LIVE_POLL_MS, self.poll_dashboard_changes)
 
     def create_kpi_widgets(self, parent_frame):
         kpi_data = [
             {"label": "Total Revenue", "key": "total_revenue", "format": "₹{:.2f}"},
             {"label": "Total Dishes Sold", "key": "total_dishes_sold", "format": "{}"},
-            {"label": "Total Transactions", "key": "num_sales", "format": "{}"}
+            {"label": "Total Transactions", "key": "num_sales", "format": "{}"},
+            {"label": f"At Risk (expiring in {EXPIRY_WINDOW_DAYS} days)", "key": "value_at_risk", "format": "₹{:.2f}"},
+            {"label": "Expired Stock on Hand", "key": "expired_value", "format": "₹{:.2f}"}
         ]
         for i, data in enumerate(kpi_data):
             frame = ctk.CTkFrame(parent_frame)
@@ -222,68 +569,104 @@ class MainApplicationFrame(ctk.CTkFrame):
             value_label.grid(row=1, column=0, pady=(0,5))
             self.dashboard_widgets[data['key']] = value_label
 
-    def refresh_dashboard_data(self):
-        kpis = get_dashboard_kpis()
+    def refresh_dashboard_data(self, panels=None):
+        appliers = {'snapshot': self.apply_dashboard_snapshot, 'alerts': self.apply_low_stock_alerts, 'profitability': self.apply_profitability, 'expiry': self.apply_expiry_summary}
+        for panel in panels or DASHBOARD_PANELS:
+            if panel == 'snapshot' and self.dashboard_scope.get() == "All Outlets":
+                # Every outlet's snapshot, fetched in parallel and merged
+                self.loader.submit('dashboard_snapshot', get_group_dashboard_snapshot, appliers[panel], group="Dashboard")
+                continue
+            if panel == 'alerts' and self.dashboard_scope.get() == "All Outlets":
+                self.loader.submit('dashboard_alerts', load_group_stock_alerts, appliers[panel], group="Dashboard")
+                continue
+            # The snapshot is shared through a short TTL cache; the versions seen here stop it returning one older than them.
+            args = (dict(self.dashboard_versions),) if panel == 'snapshot' else ()
+            self.loader.submit(f'dashboard_{panel}', DASHBOARD_PANELS[panel][0], appliers[panel], *args, group="Dashboard")
+
+    def poll_dashboard_changes(self):
+        self.dashboard_poll_id = self.after(LIVE_POLL_MS, self.poll_dashboard_changes)
+        if self.live_switch.get() and self.notebook.get() == "Dashboard":
+            self.check_dashboard_changes()
+
+    def check_dashboard_changes(self):
+        self.loader.submit('dashboard_changes', get_change_versions, self.on_dashboard_changes, group="Dashboard", on_error=self.on_change_feed_error)
+
+    def on_dashboard_changes(self, versions):
+        # Only panels whose inputs moved since the last poll are re-queried.
+        changed = {topic for topic, version in versions.items() if self.dashboard_versions.get(topic) != version}
+        self.dashboard_versions = versions
+        panels = [panel for panel, (_, topics) in DASHBOARD_PANELS.items() if changed.intersection(topics)]
+        if panels: self.refresh_dashboard_data(panels)
+
+    def on_change_feed_error(self, error):
+        self.live_switch.deselect()
+        messagebox.showwarning("Live Dashboard", f"Live updates have been turned off: {error}")
+        if not self.dashboard_versions: self.refresh_dashboard_data()
+
+    def apply_dashboard_snapshot(self, snapshot):
+        if not snapshot: return
+        self.apply_dashboard_kpis(snapshot.kpis); self.apply_sales_chart(snapshot.sales_by_day); self.apply_top_dishes_chart(snapshot.top_dishes)
+        scope = " (all outlets)" if self.dashboard_scope.get() == "All Outlets" else ""
+        self.dashboard_widgets['updated_label'].configure(text=f"Updated {snapshot.taken_at:%H:%M:%S}{scope}")
+
+    def apply_dashboard_kpis(self, kpis):
         if kpis:
             self.dashboard_widgets['total_revenue'].configure(text=f"₹{kpis.get('total_revenue', 0):.2f}")
             self.dashboard_widgets['total_dishes_sold'].configure(text=f"{int(kpis.get('total_dishes_sold', 0))}")
             self.dashboard_widgets['num_sales'].configure(text=f"{kpis.get('num_sales', 0)}")
-        sales_data = get_sales_by_day(days=7)
-        self.create_chart(self.dashboard_widgets['sales_chart_frame'], sales_data, 'Sales Over Last 7 Days', 'sale_date', 'daily_sales', 'Date', 'Revenue (₹)', kind='line')
-        top_dishes_data = get_top_selling_dishes(limit=5)
-        self.create_chart(self.dashboard_widgets['top_dishes_chart_frame'], top_dishes_data, 'Top 5 Selling Dishes', 'dname', 'total_sold', 'Dish', 'Quantity Sold', kind='bar')
-        alerts = get_low_stock_alerts()
+
+    def apply_expiry_summary(self, summary):
+        self.dashboard_widgets['value_at_risk'].configure(text=f"₹{summary['value_at_risk']:.2f} ({summary['at_risk_batches']})")
+        self.dashboard_widgets['expired_value'].configure(text=f"₹{summary['expired_value']:.2f} ({summary['expired_batches']})", text_color="#D32F2F" if summary['expired_batches'] else ctk.ThemeManager.theme["CTkLabel"]["text_color"])
+
+    def apply_sales_chart(self, sales_data):
+        self.dashboard_widgets['sales_chart'].update(sales_data, 'sale_date', 'daily_sales')
+
+    def apply_top_dishes_chart(self, top_dishes_data):
+        self.dashboard_widgets['top_dishes_chart'].update(top_dishes_data, 'dname', 'total_sold')
+
+    def apply_low_stock_alerts(self, alerts):
         for item in self.dashboard_widgets['alerts_tree'].get_children(): self.dashboard_widgets['alerts_tree'].delete(item)
         for alert in alerts:
-            self.dashboard_widgets['alerts_tree'].insert("", "end", values=(alert['ingredient_name'], alert['total_stock'], alert['reorder_level'], alert['unit']))
+            cover = "-" if alert['days_of_cover'] is None else f"{alert['days_of_cover']:.1f}"
+            name = f"{alert['outlet']}: {alert['name']}" if 'outlet' in alert else alert['name']
+            self.dashboard_widgets['alerts_tree'].insert("", "end", values=(name, f"{alert['stock']:g} {alert['unit']}", cover, f"{alert['suggested_order']:g} {alert['unit']}", alert['supplier_name'] or "-"))
 
-    def create_chart(self, parent_frame, data, title, x_col, y_col, xlabel, ylabel, kind='bar'):
-        for widget in parent_frame.winfo_children():
-            widget.destroy()
-        if not data:
-            ctk.CTkLabel(parent_frame, text=f"{title}\n(No data available)").pack(expand=True, padx=10, pady=10)
-            return
-        df = pd.DataFrame(data)
-        df[y_col] = pd.to_numeric(df[y_col], errors='coerce')
-        df.dropna(subset=[y_col], inplace=True)
-        if df.empty:
-            ctk.CTkLabel(parent_frame, text=f"{title}\n(No data available)").pack(expand=True, padx=10, pady=10)
-            return
-        fig, ax = plt.subplots(figsize=(6, 4))
-        fig.patch.set_facecolor('#2B2B2B')
-        ax.set_facecolor('#242424')
-        bar_color = '#3498db'
-        if kind == 'bar':
-            bars = ax.bar(df[x_col], df[y_col], color=bar_color)
-            ax.bar_label(bars, fmt='%.0f', color='white', fontsize=10)
-            plt.xticks(rotation=15, ha='right', fontsize=9)
-        else:
-            df[x_col] = pd.to_datetime(df[x_col])
-            ax.plot(df[x_col], df[y_col], marker='o', linestyle='-', color=bar_color, markersize=8, markerfacecolor='#85c1e9')
-            ax.xaxis.set_major_formatter(DateFormatter('%b %d'))
-            plt.xticks(rotation=15, ha='right', fontsize=9)
-        ax.set_title(title, color='white', fontsize=14, fontweight='bold', pad=20)
-        ax.set_xlabel(xlabel, color='white', fontsize=10, labelpad=10)
-        ax.set_ylabel(ylabel, color='white', fontsize=10, labelpad=10)
-        ax.tick_params(axis='x', colors='white')
-        ax.tick_params(axis='y', colors='white')
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-        ax.spines['left'].set_color('grey')
-        ax.spines['bottom'].set_color('grey')
-        ax.grid(axis='y', linestyle='--', alpha=0.2)
-        plt.tight_layout()
-        canvas = FigureCanvasTkAgg(fig, master=parent_frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=True, padx=10, pady=10)
-        plt.close(fig)
+    def apply_profitability(self, dishes):
+        tree = self.dashboard_widgets['profit_tree']
+        for item in tree.get_children(): tree.delete(item)
+        for d in dishes:
+            unit_cost = f"{d['unit_cost']:.2f}" + (" *" if d['uncosted_ingredients'] else "")  # * = some ingredients have no batch cost yet
+            tree.insert("", "end", values=(d['dname'], f"{d['price']:.2f}", unit_cost, f"{d['margin_pct']:.1f}", int(d['sold']), f"{d['gross_profit']:.2f}"))
+
+    def export_profitability_event(self):
+        path = filedialog.asksaveasfilename(title="Export Profitability", defaultextension=".csv", filetypes=[("CSV", "*.csv")])
+        if not path: return
+        self.loader.submit('profitability_export', export_dish_profitability, lambda response: messagebox.showinfo("Export", response), path)
 
     def populate_pos_tab(self, tab):
         self.current_order = {}
         tab.grid_columnconfigure(0, weight=2); tab.grid_columnconfigure(1, weight=1); tab.grid_rowconfigure(0, weight=1)
         menu_frame = ctk.CTkFrame(tab); menu_frame.grid(row=0, column=0, padx=10, pady=10, sticky="nsew")
-        ctk.CTkLabel(menu_frame, text="Menu", font=ctk.CTkFont(size=18, weight="bold")).pack(pady=10)
-        self.menu_items_frame = ctk.CTkScrollableFrame(menu_frame, label_text="Dishes"); self.menu_items_frame.pack(fill="both", expand=True, padx=10, pady=10)
+        menu_frame.grid_columnconfigure(0, weight=1); menu_frame.grid_rowconfigure(2, weight=1)
+        search_frame = ctk.CTkFrame(menu_frame, fg_color="transparent"); search_frame.grid(row=0, column=0, sticky="ew", padx=10, pady=(10, 5)); search_frame.grid_columnconfigure(1, weight=1)
+        ctk.CTkLabel(search_frame, text="Menu", font=ctk.CTkFont(size=18, weight="bold")).grid(row=0, column=0, padx=(0, 10))
+        self.menu_search_entry = ctk.CTkEntry(search_frame, placeholder_text="Search dishes (Enter adds the top match)"); self.menu_search_entry.grid(row=0, column=1, sticky="ew")
+        self.menu_search_entry.bind("<KeyRelease>", self.on_menu_search); self.menu_search_entry.bind("<Escape>", lambda e: self.clear_menu_search())
+        self.menu_category_bar = ctk.CTkSegmentedButton(menu_frame, values=[POS_ALL_CATEGORIES], command=self.on_menu_category); self.menu_category_bar.set(POS_ALL_CATEGORIES); self.menu_category_bar.grid(row=1, column=0, sticky="ew", padx=10, pady=5)
+        # A fixed set of buttons, created once; paging and searching only change their text and command.
+        self.menu_items_frame = ctk.CTkFrame(menu_frame); self.menu_items_frame.grid(row=2, column=0, sticky="nsew", padx=10, pady=5)
+        self.menu_items_frame.grid_columnconfigure(tuple(range(POS_GRID_COLUMNS)), weight=1, uniform="menu")
+        self.menu_buttons = []; self.menu_button_dishes = [None] * POS_PAGE_SIZE
+        for i in range(POS_PAGE_SIZE):
+            button = ctk.CTkButton(self.menu_items_frame, text="", height=56, command=lambda i=i: self.menu_button_event(i))
+            button.grid(row=i // POS_GRID_COLUMNS, column=i % POS_GRID_COLUMNS, padx=4, pady=4, sticky="ew"); button.grid_remove()
+            self.menu_buttons.append(button)
+        paging_frame = ctk.CTkFrame(menu_frame, fg_color="transparent"); paging_frame.grid(row=3, column=0, sticky="ew", padx=10, pady=(5, 10)); paging_frame.grid_columnconfigure(1, weight=1)
+        self.menu_prev_button = ctk.CTkButton(paging_frame, text="< Prev", width=80, command=lambda: self.menu_page_step(-1)); self.menu_prev_button.grid(row=0, column=0)
+        self.menu_page_label = ctk.CTkLabel(paging_frame, text="Loading menu..."); self.menu_page_label.grid(row=0, column=1)
+        self.menu_next_button = ctk.CTkButton(paging_frame, text="Next >", width=80, command=lambda: self.menu_page_step(1)); self.menu_next_button.grid(row=0, column=2)
+        self.menu_index = None; self.menu_category = None; self.menu_page = 0
         self.load_menu_for_pos()
         order_frame = ctk.CTkFrame(tab); order_frame.grid(row=0, column=1, padx=10, pady=10, sticky="nsew"); order_frame.grid_rowconfigure(1, weight=1); order_frame.grid_columnconfigure(0, weight=1)
         ctk.CTkLabel(order_frame, text="Current Order", font=ctk.CTkFont(size=18, weight="bold")).grid(row=0, column=0, pady=10)
@@ -298,16 +681,59 @@ class MainApplicationFrame(ctk.CTkFrame):
         order_button_frame = ctk.CTkFrame(order_frame); order_button_frame.grid(row=3, column=0, sticky="ew", padx=10, pady=(0, 10)); order_button_frame.grid_columnconfigure((0,1), weight=1)
         ctk.CTkButton(order_button_frame, text="Remove Selected", command=self.remove_from_order_event, fg_color="#D32F2F", hover_color="#B71C1C").grid(row=0, column=0, padx=5, sticky="ew")
         ctk.CTkButton(order_button_frame, text="Clear Order", command=self.clear_order_event).grid(row=0, column=1, padx=5, sticky="ew")
-        ctk.CTkButton(order_frame, text="COMPLETE SALE", font=ctk.CTkFont(size=16, weight="bold"), command=self.complete_sale_event).grid(row=4, column=0, sticky="ew", padx=10, pady=10, ipady=10)
+        self.complete_sale_button = ctk.CTkButton(order_frame, text="COMPLETE SALE", font=ctk.CTkFont(size=16, weight="bold"), command=self.complete_sale_event); self.complete_sale_button.grid(row=4, column=0, sticky="ew", padx=10, pady=10, ipady=10)
+        self.sale_queue_label = ctk.CTkLabel(order_frame, text="", text_color="orange"); self.sale_queue_label.grid(row=5, column=0, pady=(0, 5))
+        self.replay_sale_queue()
     
     def load_menu_for_pos(self):
-        for widget in self.menu_items_frame.winfo_children(): widget.destroy()
-        dishes = get_all_dishes()
-        for dish in dishes:
-            dish_id = dish['id']; dname = dish['dname']; price = dish['price']
-            btn_text = f"{dname}\n₹{price:.2f}"
-            button = ctk.CTkButton(self.menu_items_frame, text=btn_text, command=lambda d_id=dish_id, d_name=dname, d_price=price: self.add_to_order_event(d_id, d_name, d_price))
-            button.pack(fill="x", padx=10, pady=5)
+        # The search index is built on the worker thread along with the fetch.
+        self.loader.submit('pos_menu', get_pos_menu_index, self.apply_menu_for_pos, group="New Sale")
+
+    def apply_menu_for_pos(self, index):
+        self.menu_index = index
+        if self.menu_category not in index.categories: self.menu_category = None
+        self.menu_category_bar.configure(values=[POS_ALL_CATEGORIES] + index.categories); self.menu_category_bar.set(self.menu_category or POS_ALL_CATEGORIES)
+        self.render_menu_page()
+
+    def render_menu_page(self):
+        if self.menu_index is None: return
+        query = self.menu_search_entry.get().strip()
+        if query:
+            dishes = self.menu_index.search(query, limit=POS_PAGE_SIZE)
+            self.menu_page_label.configure(text=f"{len(dishes)} match(es)" if dishes else "No dishes match")
+            paging = ("disabled", "disabled")
+        else:
+            dishes, self.menu_page, pages = self.menu_index.page(self.menu_category, self.menu_page, POS_PAGE_SIZE)
+            self.menu_page_label.configure(text=f"Page {self.menu_page + 1} of {pages}")
+            paging = ("normal" if self.menu_page > 0 else "disabled", "normal" if self.menu_page < pages - 1 else "disabled")
+        self.menu_prev_button.configure(state=paging[0]); self.menu_next_button.configure(state=paging[1])
+        for i, button in enumerate(self.menu_buttons):
+            dish = dishes[i] if i < len(dishes) else None
+            if dish is self.menu_button_dishes[i]: continue  # unchanged; skip the redraw
+            self.menu_button_dishes[i] = dish
+            if dish is None: button.grid_remove()
+            else: button.configure(text=f"{dish['dname']}\n₹{dish['price']:.2f}"); button.grid()
+
+    def menu_button_event(self, i):
+        dish = self.menu_button_dishes[i]
+        if dish: self.add_to_order_event(dish['id'], dish['dname'], dish['price'])
+
+    def on_menu_search(self, event):
+        if event.keysym == "Return":
+            if self.menu_button_dishes[0] and self.menu_search_entry.get().strip(): self.menu_button_event(0); self.clear_menu_search()
+            return
+        self.render_menu_page()
+
+    def clear_menu_search(self):
+        self.menu_search_entry.delete(0, 'end'); self.render_menu_page()
+
+    def on_menu_category(self, value):
+        self.menu_category = None if value == POS_ALL_CATEGORIES else value; self.menu_page = 0
+        if self.menu_search_entry.get(): self.menu_search_entry.delete(0, 'end')
+        self.render_menu_page()
+
+    def menu_page_step(self, step):
+        self.menu_page += step; self.render_menu_page()
     
     def add_to_order_event(self, dish_id, name, price):
         if dish_id in self.current_order: self.current_order[dish_id]['quantity'] += 1
@@ -340,23 +766,45 @@ class MainApplicationFrame(ctk.CTkFrame):
     
     def complete_sale_event(self):
         if not self.current_order: messagebox.showwarning("Empty Order", "Cannot process an empty order."); return
-        waiter_id = self.controller.user_info['employee_id']
+        session = self.controller.current_session()
+        if not session: return
+        waiter_id = session.user['employee_id']
         total_amount = sum(d['price'] * d['quantity'] for d in self.current_order.values())
         order_items = [(dish_id, details['quantity'], details['price']) for dish_id, details in self.current_order.items()]
         if not messagebox.askyesno("Confirm Sale", f"Complete sale for a total of ₹{total_amount:.2f}?"): return
-        response = process_sale(waiter_id, order_items, total_amount)
+        self.complete_sale_button.configure(state="disabled")
+        self.loader.submit('sale', submit_sale, self.on_sale_processed, waiter_id, order_items, total_amount, on_error=self.on_sale_failed)
+
+    def replay_sale_queue(self):
+        # Sales saved while the database was unreachable are flushed from here, in order.
+        self.loader.submit('sale_replay', replay_pending, self.on_sale_queue_replayed, on_error=lambda e: None)
+        self.sale_replay_id = self.after(SALE_REPLAY_MS, self.replay_sale_queue)
+
+    def on_sale_queue_replayed(self, result):
+        self.sale_queue_label.configure(text=f"{result['pending']} sale(s) waiting to sync" if result['pending'] else "")
+        if result['sent'] and hasattr(self, 'dashboard_widgets'): self.check_dashboard_changes()
+
+    def on_sale_failed(self, error):
+        self.complete_sale_button.configure(state="normal")
+        messagebox.showerror("Sale Processing", f"Error processing sale: {error}")
+
+    def on_sale_processed(self, response):
+        self.complete_sale_button.configure(state="normal")
         messagebox.showinfo("Sale Processing", response)
-        if "successfully" in response:
+        if response == QUEUED_MESSAGE: self.sale_queue_label.configure(text="Offline: sales are being saved on this terminal")
+        if "successfully" in response or response == QUEUED_MESSAGE:
             self.current_order = {}; self.refresh_order_tree()
             if hasattr(self, 'ingredient_types_tree'): self.refresh_ingredient_types_table()
-            if hasattr(self, 'dashboard_widgets'): self.refresh_dashboard_data()
+            if hasattr(self, 'dashboard_widgets'): self.check_dashboard_changes()
     
     def populate_menu_tab(self, tab):
         self.selected_dish_id = None; self.selected_recipe_item_id = None; self.ingredients_map = {}
         tab.grid_columnconfigure(0, weight=2); tab.grid_columnconfigure(1, weight=3); tab.grid_rowconfigure(0, weight=1)
         dish_frame = ctk.CTkFrame(tab); dish_frame.grid(row=0, column=0, padx=10, pady=10, sticky="nsew"); dish_frame.grid_rowconfigure(1, weight=1); dish_frame.grid_columnconfigure(0, weight=1)
         ctk.CTkLabel(dish_frame, text="Menu Dishes", font=ctk.CTkFont(size=18, weight="bold")).grid(row=0, column=0, pady=10)
-        dish_columns = ("ID", "Dish Name", "Price", "Category"); self.dish_tree = ttk.Treeview(dish_frame, columns=dish_columns, show="headings"); self.dish_tree.grid(row=1, column=0, sticky="nsew")
+        dish_columns = ("ID", "Dish Name", "Price", "Category")
+        self.dish_table = PagedTable(dish_frame, dish_columns, self.loader, 'dish_tree', "Menu & Recipes", get_dishes_page, row_key=lambda d: d['id'], cursor_of=lambda d: d['dname'], row_values=lambda d: (d['id'], d['dname'], f"{d['price']:.2f}", d['category']))
+        self.dish_table.frame.grid(row=1, column=0, sticky="nsew"); self.dish_tree = self.dish_table.tree
         for col in dish_columns: self.dish_tree.heading(col, text=col, anchor='center'); self.dish_tree.column(col, anchor='center', width=80)
         self.dish_tree.bind("<<TreeviewSelect>>", self.on_dish_select)
         dish_form_frame = ctk.CTkFrame(dish_frame); dish_form_frame.grid(row=2, column=0, pady=10, sticky="ew"); dish_form_frame.grid_columnconfigure((0, 1), weight=1)
@@ -383,12 +831,13 @@ class MainApplicationFrame(ctk.CTkFrame):
         self.refresh_dish_table(); self.load_all_ingredients_for_menu()
     
     def refresh_dish_table(self):
-        for item in self.dish_tree.get_children(): self.dish_tree.delete(item)
-        dishes = get_all_dishes()
-        for dish in dishes: self.dish_tree.insert("", "end", values=(dish['id'], dish['dname'], f"{dish['price']:.2f}", dish['category']))
+        self.dish_table.refresh()
     
     def load_all_ingredients_for_menu(self):
-        ingredients = get_all_ingredient_names()
+        if not hasattr(self, 'recipe_ingredient_menu'): return
+        self.loader.submit('recipe_ingredient_menu', get_all_ingredient_names, self.apply_ingredients_for_menu, group="Menu & Recipes")
+
+    def apply_ingredients_for_menu(self, ingredients):
         if not ingredients: self.recipe_ingredient_menu.configure(values=["No ingredients found"]); return
         ingredient_names = [ing['name'] for ing in ingredients]; self.ingredients_map = {ing['name']: ing['id'] for ing in ingredients}; self.recipe_ingredient_menu.configure(values=ingredient_names); self.recipe_ingredient_menu_var.set(ingredient_names[0])
     
@@ -408,7 +857,10 @@ class MainApplicationFrame(ctk.CTkFrame):
     def refresh_recipe_view(self):
         for item in self.recipe_tree.get_children(): self.recipe_tree.delete(item)
         if self.selected_dish_id is None: return
-        recipe_items = get_recipe_for_dish(self.selected_dish_id)
+        self.loader.submit('recipe_tree', get_recipe_for_dish, self.apply_recipe_view, self.selected_dish_id, group="Menu & Recipes")
+
+    def apply_recipe_view(self, recipe_items):
+        for item in self.recipe_tree.get_children(): self.recipe_tree.delete(item)
         for item in recipe_items: self.recipe_tree.insert("", "end", values=(item['id'], item['name'], item['quantity_needed'], item['unit']))
         self.clear_recipe_form()
     
@@ -487,15 +939,14 @@ class MainApplicationFrame(ctk.CTkFrame):
         ctk.CTkButton(button_frame, text="Delete Selected", command=self.delete_supplier_event, fg_color="#D32F2F", hover_color="#B71C1C").grid(row=0, column=2, padx=5, pady=5, sticky="ew")
         ctk.CTkButton(button_frame, text="Clear Form", command=self.clear_supplier_form).grid(row=0, column=3, padx=5, pady=5, sticky="ew")
         table_frame = ctk.CTkFrame(tab); table_frame.grid(row=0, column=1, padx=10, pady=10, sticky="nsew"); table_frame.grid_rowconfigure(0, weight=1); table_frame.grid_columnconfigure(0, weight=1)
-        style = ttk.Style(); style.theme_use("default"); style.configure("Treeview", background="#2a2d2e", foreground="white", fieldbackground="#2a2d2e", borderwidth=0); style.map('Treeview', background=[('selected', '#2c5d87')]); style.configure("Treeview.Heading", font=('Calibri', 10,'bold'), background="#2c5d87", foreground="white", relief="flat"); style.map("Treeview.Heading", background=[('active', '#3a75a8')])
-        supplier_columns = ("ID", "Name", "Email", "Phone"); self.supplier_tree = ttk.Treeview(table_frame, columns=supplier_columns, show="headings"); self.supplier_tree.grid(row=0, column=0, sticky="nsew")
+        supplier_columns = ("ID", "Name", "Email", "Phone")
+        self.supplier_table = PagedTable(table_frame, supplier_columns, self.loader, 'supplier_tree', "Suppliers", get_suppliers_page, row_key=lambda s: s['id'], row_values=lambda s: (s['id'], s['name'], s['email'], s['phone']))
+        self.supplier_table.frame.grid(row=0, column=0, sticky="nsew"); self.supplier_tree = self.supplier_table.tree
         for col in supplier_columns: self.supplier_tree.heading(col, text=col, anchor='center'); self.supplier_tree.column(col, anchor='center')
         self.supplier_tree.bind("<<TreeviewSelect>>", self.on_supplier_select); self.refresh_supplier_table()
     
     def refresh_supplier_table(self):
-        for item in self.supplier_tree.get_children(): self.supplier_tree.delete(item)
-        suppliers = get_all_suppliers()
-        for sup in suppliers: self.supplier_tree.insert("", "end", values=(sup['id'], sup['name'], sup['email'], sup['phone']))
+        self.supplier_table.refresh()
     
     def clear_supplier_form(self):
         self.selected_supplier_id = None; self.supplier_name_entry.delete(0, 'end'); self.supplier_email_entry.delete(0, 'end'); self.supplier_phone_entry.delete(0, 'end')
@@ -527,11 +978,14 @@ class MainApplicationFrame(ctk.CTkFrame):
             if "successfully" in response: self.refresh_supplier_table(); self.clear_supplier_form(); self.load_suppliers()
     
     def populate_inventory_tab(self, tab):
+        from tkcalendar import DateEntry
         self.selected_ingredient_id = None; self.suppliers_map = {}
         tab.grid_columnconfigure(0, weight=2); tab.grid_columnconfigure(1, weight=3); tab.grid_rowconfigure(0, weight=1)
         types_frame = ctk.CTkFrame(tab); types_frame.grid(row=0, column=0, padx=10, pady=10, sticky="nsew"); types_frame.grid_rowconfigure(1, weight=1); types_frame.grid_columnconfigure(0, weight=1)
         ctk.CTkLabel(types_frame, text="Ingredient Stock", font=ctk.CTkFont(size=18, weight="bold")).grid(row=0, column=0, pady=10)
-        types_columns = ("ID", "Name", "Unit", "Total Stock", "Reorder Level"); self.ingredient_types_tree = ttk.Treeview(types_frame, columns=types_columns, show="headings"); self.ingredient_types_tree.grid(row=1, column=0, sticky="nsew")
+        types_columns = ("ID", "Name", "Unit", "Total Stock", "Reorder Level")
+        self.ingredient_types_table = PagedTable(types_frame, types_columns, self.loader, 'ingredient_types_tree', "Inventory", get_ingredient_types_page, row_key=lambda i: i['ingredient_id'], row_values=lambda i: (i['ingredient_id'], i['ingredient_name'], i['unit'], i['total_stock'] if i['total_stock'] is not None else 0, i['reorder_level']))
+        self.ingredient_types_table.frame.grid(row=1, column=0, sticky="nsew"); self.ingredient_types_tree = self.ingredient_types_table.tree
         for col in types_columns: self.ingredient_types_tree.heading(col, text=col, anchor='center'); self.ingredient_types_tree.column(col, anchor='center', width=80)
         self.ingredient_types_tree.bind("<<TreeviewSelect>>", self.on_ingredient_type_select); self.refresh_ingredient_types_table()
         add_type_frame = ctk.CTkFrame(types_frame); add_type_frame.grid(row=2, column=0, pady=10, sticky="ew"); add_type_frame.grid_columnconfigure((0,1,2), weight=1)
@@ -539,9 +993,15 @@ class MainApplicationFrame(ctk.CTkFrame):
         self.ing_unit_entry = ctk.CTkEntry(add_type_frame, placeholder_text="Unit (e.g., kg)"); self.ing_unit_entry.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
         self.ing_reorder_entry = ctk.CTkEntry(add_type_frame, placeholder_text="Reorder Level"); self.ing_reorder_entry.grid(row=0, column=2, padx=5, pady=5, sticky="ew")
         ctk.CTkButton(add_type_frame, text="Add New Type", command=self.add_ingredient_type_event).grid(row=1, column=0, columnspan=3, pady=5, sticky="ew")
+        import_frame = ctk.CTkFrame(types_frame); import_frame.grid(row=3, column=0, pady=(0, 10), sticky="ew"); import_frame.grid_columnconfigure(1, weight=1)
+        self.import_kind_var = ctk.StringVar(value="batches"); ctk.CTkOptionMenu(import_frame, variable=self.import_kind_var, values=list(IMPORT_COLUMNS)).grid(row=0, column=0, padx=5, pady=5)
+        self.bulk_import_button = ctk.CTkButton(import_frame, text="Bulk Import from CSV/Excel...", command=self.bulk_import_event); self.bulk_import_button.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
         batches_frame = ctk.CTkFrame(tab); batches_frame.grid(row=0, column=1, padx=10, pady=10, sticky="nsew"); batches_frame.grid_rowconfigure(1, weight=1); batches_frame.grid_columnconfigure(0, weight=1)
         self.batch_label = ctk.CTkLabel(batches_frame, text="Ingredient Batches", font=ctk.CTkFont(size=18, weight="bold")); self.batch_label.grid(row=0, column=0, pady=10)
-        batches_columns = ("Batch ID", "Supplier", "Qty Rcvd", "Qty Left", "Cost/Unit", "Received", "Expires"); self.batches_tree = ttk.Treeview(batches_frame, columns=batches_columns, show="headings"); self.batches_tree.grid(row=1, column=0, sticky="nsew")
+        self.show_depleted_var = ctk.BooleanVar(value=False); ctk.CTkCheckBox(batches_frame, text="Show depleted", variable=self.show_depleted_var, command=self.refresh_batch_view).grid(row=0, column=0, padx=10, sticky="e")
+        batches_columns = ("Batch ID", "Supplier", "Qty Rcvd", "Qty Left", "Cost/Unit", "Received", "Expires")
+        self.batches_table = PagedTable(batches_frame, batches_columns, self.loader, 'batches_tree', "Inventory", get_batches_page, row_key=lambda b: b['id'], cursor_of=lambda b: (b['expiry_date'], b['id']), row_values=lambda b: (b['id'], b['supplier_name'], b['quantity_received'], b['quantity_remaining'], b['cost_per_unit'], b['received_date'], b['expiry_date']))
+        self.batches_table.frame.grid(row=1, column=0, sticky="nsew"); self.batches_tree = self.batches_table.tree
         for col in batches_columns: self.batches_tree.heading(col, text=col, anchor='center'); self.batches_tree.column(col, anchor='center', width=100)
         add_batch_frame = ctk.CTkFrame(batches_frame); add_batch_frame.grid(row=2, column=0, pady=10, sticky="ew"); add_batch_frame.grid_columnconfigure(1, weight=1)
         ctk.CTkLabel(add_batch_frame, text="Record New Delivery:", font=ctk.CTkFont(weight="bold")).grid(row=0, column=0, columnspan=2, pady=(5,10))
@@ -553,7 +1013,10 @@ class MainApplicationFrame(ctk.CTkFrame):
         self.load_suppliers()
     
     def load_suppliers(self):
-        suppliers = get_all_suppliers()
+        if not hasattr(self, 'supplier_menu'): return
+        self.loader.submit('supplier_menu', get_all_suppliers, self.apply_suppliers, group="Inventory")
+
+    def apply_suppliers(self, suppliers):
         if not suppliers: self.supplier_menu.configure(values=["No suppliers found"]); return
         supplier_names = [s['name'] for s in suppliers]; self.suppliers_map = {s['name']: s['id'] for s in suppliers}; self.supplier_menu.configure(values=supplier_names); self.supplier_menu_var.set(supplier_names[0])
     
@@ -563,10 +1026,10 @@ class MainApplicationFrame(ctk.CTkFrame):
         self.batch_label.configure(text=f"Batches for: {ingredient_name}"); self.refresh_batch_view()
     
     def refresh_batch_view(self):
-        for item in self.batches_tree.get_children(): self.batches_tree.delete(item)
-        if self.selected_ingredient_id is None: return
-        batches = get_batches_for_ingredient(self.selected_ingredient_id)
-        for batch in batches: self.batches_tree.insert("", "end", values=(batch['id'], batch['supplier_name'], batch['quantity_received'], batch['quantity_remaining'], batch['cost_per_unit'], batch['received_date'], batch['expiry_date']))
+        if self.selected_ingredient_id is None: self.batches_table.clear(); return
+        params = (self.selected_ingredient_id, self.show_depleted_var.get())
+        if params == self.batches_table.params: self.batches_table.refresh()
+        else: self.batches_table.set_params(*params)
     
     def add_batch_event(self):
         if self.selected_ingredient_id is None: messagebox.showwarning("Selection Error", "Please select an ingredient type from the left table first."); return
@@ -578,9 +1041,21 @@ class MainApplicationFrame(ctk.CTkFrame):
         if "successfully" in response: self.refresh_batch_view(); self.refresh_ingredient_types_table(); self.batch_qty_entry.delete(0, 'end'); self.batch_cost_entry.delete(0, 'end')
     
     def refresh_ingredient_types_table(self):
-        for item in self.ingredient_types_tree.get_children(): self.ingredient_types_tree.delete(item)
-        ingredients = get_all_ingredient_types()
-        for ing in ingredients: self.ingredient_types_tree.insert("", "end", values=(ing['ingredient_id'], ing['ingredient_name'], ing['unit'], ing['total_stock'] if ing['total_stock'] is not None else 0, ing['reorder_level']))
+        self.ingredient_types_table.refresh()
+
+    def bulk_import_event(self):
+        kind = self.import_kind_var.get()
+        path = filedialog.askopenfilename(title=f"Import {kind}", filetypes=[("CSV or Excel", "*.csv *.xlsx"), ("All files", "*.*")])
+        if not path: return
+        if not messagebox.askyesno("Confirm Import", f"Import {kind} from {path}?\n\nExpected columns: {', '.join(IMPORT_COLUMNS[kind])}"): return
+        self.bulk_import_button.configure(state="disabled")
+        self.loader.submit('bulk_import', import_file, self.on_bulk_import_done, path, kind, on_error=self.on_bulk_import_done)
+
+    def on_bulk_import_done(self, response):
+        self.bulk_import_button.configure(state="normal"); messagebox.showinfo("Bulk Import", str(response))
+        self.refresh_ingredient_types_table(); self.refresh_batch_view(); self.load_suppliers(); self.load_all_ingredients_for_menu()
+        if hasattr(self, 'dish_table'): self.refresh_dish_table()
+        if hasattr(self, 'supplier_table'): self.refresh_supplier_table()
     
     def add_ingredient_type_event(self):
         details = {'name': self.ing_name_entry.get(), 'unit': self.ing_unit_entry.get(), 'reorder_level': self.ing_reorder_entry.get()}
@@ -605,9 +1080,10 @@ class MainApplicationFrame(ctk.CTkFrame):
         ctk.CTkButton(button_frame, text="Delete Selected", command=self.delete_employee_event, fg_color="#D32F2F", hover_color="#B71C1C").grid(row=0, column=2, padx=5, pady=5, sticky="ew")
         ctk.CTkButton(button_frame, text="Clear Form", command=self.clear_form_button_action).grid(row=0, column=3, padx=5, pady=5, sticky="ew")
         table_frame = ctk.CTkFrame(tab); table_frame.grid(row=0, column=1, padx=10, pady=10, sticky="nsew"); table_frame.grid_rowconfigure(0, weight=1); table_frame.grid_columnconfigure(0, weight=1)
-        columns = ("ID", "First Name", "Last Name", "Role", "Email", "Username"); self.employee_tree = ttk.Treeview(table_frame, columns=columns, show="headings"); self.employee_tree.grid(row=0, column=0, sticky="nsew")
-        for col in columns: self.employee_tree.column(col, anchor='center')
-        v_scroll = ttk.Scrollbar(table_frame, orient="vertical", command=self.employee_tree.yview); v_scroll.grid(row=0, column=1, sticky="ns"); self.employee_tree.configure(yscrollcommand=v_scroll.set)
+        columns = ("ID", "First Name", "Last Name", "Role", "Email", "Username")
+        self.employee_table = PagedTable(table_frame, columns, self.loader, 'employee_tree', "Employees", get_employees_page, row_key=lambda e: e['id'], row_values=lambda e: (e['id'], e['fname'], e['lname'], e['role'], e['email'], e['username']))
+        self.employee_table.frame.grid(row=0, column=0, sticky="nsew"); self.employee_tree = self.employee_table.tree
+        for col in columns: self.employee_tree.heading(col, text=col); self.employee_tree.column(col, anchor='center')
         h_scroll = ttk.Scrollbar(table_frame, orient="horizontal", command=self.employee_tree.xview); h_scroll.grid(row=1, column=0, sticky="ew"); self.employee_tree.configure(xscrollcommand=h_scroll.set)
         self.employee_tree.bind("<<TreeviewSelect>>", self.on_employee_select); self.refresh_employee_table()
     
@@ -629,10 +1105,7 @@ class MainApplicationFrame(ctk.CTkFrame):
         self.password_entry.configure(state="disabled")
     
     def refresh_employee_table(self):
-        for item in self.employee_tree.get_children(): self.employee_tree.delete(item)
-        employees = get_all_employees()
-        for col in self.employee_tree["columns"]: self.employee_tree.heading(col, text=col)
-        for emp in employees: self.employee_tree.insert("", "end", values=(emp['id'], emp['fname'], emp['lname'], emp['role'], emp['email'], emp['username']))
+        self.employee_table.refresh()
     
     def add_employee_event(self):
         details = {'fname': self.fname_entry.get(), 'lname': self.lname_entry.get(), 'email': self.email_entry.get(), 'username': self.username_entry.get(), 'password': self.password_entry.get(), 'role': self.role_menu.get()}
@@ -667,11 +1140,88 @@ class MainApplicationFrame(ctk.CTkFrame):
 
     def delete_employee_event(self):
         if self.selected_employee_id is None: messagebox.showwarning("Selection Error", "Please select an employee from the table to delete."); return
-        if self.selected_employee_id == self.controller.user_info.get('employee_id'): messagebox.showerror("Action Forbidden", "You cannot delete your own account while logged in."); return
+        session = self.controller.current_session()
+        if not session: return
+        if self.selected_employee_id == session.user.get('employee_id'): messagebox.showerror("Action Forbidden", "You cannot delete your own account while logged in."); return
         if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete employee ID {self.selected_employee_id}?\nThis action cannot be undone."):
             response = delete_employee(self.selected_employee_id); messagebox.showinfo("Response", response)
             if "successfully" in response: self.refresh_employee_table(); self.clear_form_button_action()
 
+    def populate_diagnostics_tab(self, tab):
+        tab.grid_columnconfigure(0, weight=1); tab.grid_rowconfigure((1, 2), weight=1)
+        header_frame = ctk.CTkFrame(tab); header_frame.grid(row=0, column=0, sticky="ew", padx=10, pady=10); header_frame.grid_columnconfigure(1, weight=1)
+        ctk.CTkLabel(header_frame, text="Data Layer Diagnostics", font=ctk.CTkFont(size=20, weight="bold")).grid(row=0, column=0, padx=10, pady=10)
+        self.diagnostics_label = ctk.CTkLabel(header_frame, text="", text_color="gray", justify="left"); self.diagnostics_label.grid(row=0, column=1, padx=10, sticky="w")
+        ctk.CTkButton(header_frame, text="Save JSON...", width=100, command=self.save_metrics_event).grid(row=0, column=2, padx=5, pady=10)
+        ctk.CTkButton(header_frame, text="Reset", width=80, command=self.reset_metrics_event, fg_color="#D32F2F", hover_color="#B71C1C").grid(row=0, column=3, padx=(5, 10), pady=10)
+        tables_frame = ctk.CTkFrame(tab, fg_color="transparent"); tables_frame.grid(row=1, column=0, sticky="nsew", padx=10); tables_frame.grid_columnconfigure((0, 1), weight=1); tables_frame.grid_rowconfigure(1, weight=1)
+        self.diagnostics_trees = {}
+        for column, (key, title, columns) in enumerate([('functions', "Functions (slowest total first)", ("Function", "Calls", "Errors", "Avg ms", "p95 ms", "Max ms")),
+                                                        ('statements', "SQL Statements (slowest total first)", ("Statement", "Calls", "Rows", "Errors", "Avg ms", "p95 ms"))]):
+            ctk.CTkLabel(tables_frame, text=title, font=ctk.CTkFont(size=16, weight="bold")).grid(row=0, column=column, pady=5)
+            tree = ttk.Treeview(tables_frame, columns=columns, show="headings"); tree.grid(row=1, column=column, sticky="nsew", padx=5, pady=(0, 10))
+            for col in columns: tree.heading(col, text=col, anchor='center'); tree.column(col, anchor='w' if col in ("Function", "Statement") else 'center', width=260 if col in ("Function", "Statement") else 60)
+            self.diagnostics_trees[key] = tree
+        slow_frame = ctk.CTkFrame(tab); slow_frame.grid(row=2, column=0, sticky="nsew", padx=10, pady=(0, 10)); slow_frame.grid_columnconfigure((0, 1), weight=1); slow_frame.grid_rowconfigure(1, weight=1)
+        ctk.CTkLabel(slow_frame, text="Slow Queries (select one to see its plan)", font=ctk.CTkFont(size=16, weight="bold")).grid(row=0, column=0, pady=5)
+        slow_columns = ("Time", "ms", "Rows", "Statement"); self.slow_tree = ttk.Treeview(slow_frame, columns=slow_columns, show="headings", height=6); self.slow_tree.grid(row=1, column=0, sticky="nsew", padx=10, pady=(0, 10))
+        for col in slow_columns: self.slow_tree.heading(col, text=col, anchor='center'); self.slow_tree.column(col, anchor='w' if col == "Statement" else 'center', width=400 if col == "Statement" else 70)
+        self.slow_tree.bind("<<TreeviewSelect>>", self.on_slow_query_select)
+        self.plan_textbox = ctk.CTkTextbox(slow_frame, font=ctk.CTkFont(family="Courier", size=12)); self.plan_textbox.grid(row=1, column=1, sticky="nsew", padx=10, pady=(0, 10))
+        self.slow_queries = []
+        self.refresh_diagnostics()
+        self.diagnostics_poll_id = self.after(DIAGNOSTICS_REFRESH_MS, self.poll_diagnostics)
+
+    def poll_diagnostics(self):
+        self.diagnostics_poll_id = self.after(DIAGNOSTICS_REFRESH_MS, self.poll_diagnostics)
+        if self.notebook.get() == "Diagnostics": self.refresh_diagnostics()
+
+    def refresh_diagnostics(self):
+        self.loader.submit('diagnostics', lambda: (get_metrics(), get_pool_stats(), get_routing_stats(), get_sale_metrics(), get_recipe_cache_stats(), auth.get_auth_stats(), load_forecast_cache_stats()), self.apply_diagnostics, group="Diagnostics")
+
+    def apply_diagnostics(self, result):
+        metrics, pool, routing, sales, recipes, logins, forecast = result
+        forecast_text = f" | forecast {forecast['full_fits']} full fits, {forecast['days_folded']} days folded in, {forecast['cache_hits']} hits" if forecast else ""
+        self.diagnostics_label.configure(text=f"Since {metrics['started_at']} | pool: {pool['in_use']}/{pool['size']} in use, {pool['waits']} waits, {pool['timeouts']} timeouts | "
+                                              f"replica reads {routing['replica_reads']} | sales {sales['sales']}, retries {sales['retries']} | recipe cache {recipes['hits']} hits, {recipes['misses']} misses\n"
+                                              f"logins {logins['logins']}, failed {logins['failures']}, lockouts {logins['lockouts']}, open sessions {logins['sessions']}{forecast_text}")
+        rows = {'functions': [(name, m['count'], m['exceptions'] + m['error_results'], m['avg_ms'], m['p95_ms'], m['max_ms'], m['total_ms']) for name, m in metrics['functions'].items()],
+                'statements': [(sql, m['count'], m['rows'], m['errors'], m['avg_ms'], m['p95_ms'], m['total_ms']) for sql, m in metrics['statements'].items()]}
+        for key, tree in self.diagnostics_trees.items():
+            for item in tree.get_children(): tree.delete(item)
+            for row in sorted(rows[key], key=lambda r: r[-1], reverse=True): tree.insert("", "end", values=row[:-1])
+        self.slow_queries = metrics['slow_queries'][::-1]
+        for item in self.slow_tree.get_children(): self.slow_tree.delete(item)
+        for i, slow in enumerate(self.slow_queries): self.slow_tree.insert("", "end", iid=str(i), values=(slow['at'][11:], slow['ms'], slow['rows'], slow['statement']))
+
+    def on_slow_query_select(self, event):
+        selected = self.slow_tree.focus()
+        if not selected: return
+        slow = self.slow_queries[int(selected)]
+        plan = slow['plan']
+        if plan is None: text = "No plan recorded (batched statement, or already EXPLAINed recently)."
+        else: text = "\n\n".join("\n".join(f"{key}: {value}" for key, value in row.items()) for row in plan)
+        self.plan_textbox.delete("1.0", "end"); self.plan_textbox.insert("1.0", f"{slow['statement']}\n\n{text}")
+
+    def save_metrics_event(self):
+        path = filedialog.asksaveasfilename(title="Save Metrics", defaultextension=".json", filetypes=[("JSON", "*.json")])
+        if not path: return
+        try: messagebox.showinfo("Save Metrics", write_metrics_json(path))
+        except OSError as e: messagebox.showerror("Save Metrics", f"Error saving metrics: {e}")
+
+    def reset_metrics_event(self):
+        if messagebox.askyesno("Reset Metrics", "Clear all collected timings and the slow query log?"):
+            reset_metrics(); self.refresh_diagnostics()
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Restaurant BI & Inventory System")
+    parser.add_argument("--profile-startup", action="store_true", help="print time-to-login-screen and time-to-first-tab")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics (and /metrics.json)")
+    parser.add_argument("--metrics-json", help="rewrite this file with the metrics as JSON every minute")
+    args = parser.parse_args()
+    PROFILE_STARTUP = args.profile_startup
+    if args.metrics_port: start_metrics_server(args.metrics_port)
+    if args.metrics_json: start_json_dump(args.metrics_json)
     app = App()
+    app.after_idle(lambda: profile_mark("time to login screen"))
     app.mainloop()
\ No newline at end of file
@@ -0,0 +1,327 @@
+import argparse
+import sys
+
+import pymysql
+
+from auth import DEFAULT_ROLE_PERMISSIONS, LOGIN_ACCOUNT_SQL
+from utils import (db_connection, use_outlet, OUTLETS, rebuild_sales_rollups, dashboard_snapshot_procedure_sql, CHANGE_TOPICS,
+                   DASHBOARD_SNAPSHOT_QUERIES, RECIPE_LINES_SQL, RECIPE_LINE_EXISTS_SQL, SALE_BY_UUID_SQL, SALES_BY_DAY_SQL,
+                   DISHES_PAGE_SQL, EXPIRED_BATCHES_SQL, lock_batches_sql, batches_page_sql, batch_quantities_sql, deduct_stock_sql)
+
+# --- Migration Helpers ---
+# MySQL commits DDL implicitly, so every step checks the catalog first and can
+# safely be re-run after a partial failure.
+
+def _index_exists(cursor, table, index):
+    sql = """
+    SELECT 1 FROM information_schema.statistics
+    WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+    LIMIT 1
+    """
+    cursor.execute(sql, (table, index))
+    return cursor.fetchone() is not None
+
+def _table_exists(cursor, table):
+    sql = "SELECT 1 FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s LIMIT 1"
+    cursor.execute(sql, (table,))
+    return cursor.fetchone() is not None
+
+def _column_exists(cursor, table, column):
+    sql = """
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    LIMIT 1
+    """
+    cursor.execute(sql, (table, column))
+    return cursor.fetchone() is not None
+
+def _create_index(cursor, table, index, columns):
+    if not _index_exists(cursor, table, index):
+        cursor.execute(f"CREATE INDEX `{index}` ON `{table}` ({columns})")
+
+# --- Migrations ---
+# Append new steps to the end of MIGRATIONS; never renumber or edit an applied one.
+# A step that needs a table an earlier step never created creates it itself, with
+# the same idempotent helper a later step uses for databases already past it.
+
+def _001_batch_expiry_index(cursor):
+    # process_sale and get_batches_for_ingredient: ingredient_id = ? ORDER BY expiry_date,
+    # with quantity_remaining covered so the > 0 filter needs no row lookup.
+    _create_index(cursor, 'ingredient_batches', 'idx_batches_ingredient_expiry', '`ingredient_id`, `expiry_date`, `quantity_remaining`')
+
+def _002_sales_time_index(cursor):
+    # get_sales_by_day: range scan on sale_time, total_amount covered.
+    _create_index(cursor, 'sales', 'idx_sales_time_amount', '`sale_time`, `total_amount`')
+
+def _003_recipe_dish_ingredient_index(cursor):
+    # Recipe lookups by dish, and the (dish_id, ingredient_id) duplicate check.
+    _create_index(cursor, 'recipe', 'idx_recipe_dish_ingredient', '`dish_id`, `ingredient_id`, `quantity_needed`')
+
+def _004_sales_rollups(cursor):
+    # Dashboard KPIs, the sales chart and top dishes read these instead of the raw sales tables.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS `daily_sales_rollup` (
+      `sale_date` DATE PRIMARY KEY,
+      `total_revenue` DECIMAL(14, 2) NOT NULL DEFAULT 0,
+      `num_sales` INT NOT NULL DEFAULT 0,
+      `dishes_sold` INT NOT NULL DEFAULT 0
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS `dish_sales_rollup` (
+      `dish_id` INT PRIMARY KEY,
+      `total_sold` INT NOT NULL DEFAULT 0,
+      `total_revenue` DECIMAL(14, 2) NOT NULL DEFAULT 0,
+      INDEX `idx_dish_rollup_sold` (`total_sold`),
+      FOREIGN KEY (`dish_id`) REFERENCES `dish`(`id`) ON DELETE CASCADE
+    )
+    """)
+    response = rebuild_sales_rollups()
+    if "successfully" not in response:
+        raise RuntimeError(response)
+
+def _005_change_log(cursor):
+    # Polled by the live dashboard; bumped by process_sale and add_ingredient_batch.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS `change_log` (
+      `topic` VARCHAR(32) PRIMARY KEY,
+      `version` BIGINT NOT NULL DEFAULT 0
+    )
+    """)
+    cursor.executemany("INSERT IGNORE INTO change_log (topic, version) VALUES (%s, 0)", [(topic,) for topic in CHANGE_TOPICS])
+
+def _006_sale_client_uuid(cursor):
+    # Client-generated sale ids, so replaying the offline sale queue never records a sale twice.
+    if not _column_exists(cursor, 'sales', 'client_uuid'):
+        cursor.execute("ALTER TABLE `sales` ADD COLUMN `client_uuid` CHAR(36) NULL")
+    if not _index_exists(cursor, 'sales', 'uq_sales_client_uuid'):
+        cursor.execute("CREATE UNIQUE INDEX `uq_sales_client_uuid` ON `sales` (`client_uuid`)")
+
+def _create_ingredient_stock(cursor):
+    # Running stock total per ingredient, kept by deliveries and sales and joined by the
+    # stock view. Databases created before it only have ingredient_batches, so it is
+    # created and backfilled from them here.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS `ingredient_stock` (
+      `ingredient_id` INT PRIMARY KEY,
+      `total_stock` DECIMAL(12, 2) NOT NULL DEFAULT 0,
+      FOREIGN KEY (`ingredient_id`) REFERENCES `ingredients`(`id`) ON DELETE CASCADE
+    )
+    """)
+    cursor.execute("""
+    INSERT IGNORE INTO ingredient_stock (ingredient_id, total_stock)
+    SELECT i.id, COALESCE(SUM(ib.quantity_remaining), 0)
+    FROM ingredients i LEFT JOIN ingredient_batches ib ON ib.ingredient_id = i.id
+    GROUP BY i.id
+    """)
+
+EXPIRED_STOCK_SQL = """SELECT ingredient_id, SUM(quantity_remaining) AS expired_stock
+FROM ingredient_batches
+WHERE expiry_date < CURDATE() AND quantity_remaining > 0
+GROUP BY ingredient_id"""
+
+CURRENT_INVENTORY_VIEW_SQL = f"""
+CREATE OR REPLACE VIEW `current_inventory_view` AS
+SELECT
+    i.id AS ingredient_id,
+    i.name AS ingredient_name,
+    i.unit,
+    i.reorder_level,
+    s.total_stock - COALESCE(x.expired_stock, 0) AS total_stock
+FROM
+    ingredients i
+LEFT JOIN
+    ingredient_stock s ON i.id = s.ingredient_id
+LEFT JOIN
+    ({EXPIRED_STOCK_SQL}) x ON i.id = x.ingredient_id
+"""
+
+def _007_expiry_tracking(cursor):
+    # Expired batches drop out of usable stock; waste_report.py --write-off moves them to waste_log.
+    _create_index(cursor, 'ingredient_batches', 'idx_batches_expiry', '`expiry_date`, `quantity_remaining`')
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS `waste_log` (
+      `id` INT AUTO_INCREMENT PRIMARY KEY,
+      `batch_id` INT,
+      `ingredient_id` INT NOT NULL,
+      `quantity` DECIMAL(10, 2) NOT NULL,
+      `cost_per_unit` DECIMAL(10, 2) NOT NULL,
+      `reason` VARCHAR(32) NOT NULL,
+      `logged_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
+      INDEX `idx_waste_logged_at` (`logged_at`),
+      FOREIGN KEY (`batch_id`) REFERENCES `ingredient_batches`(`id`) ON DELETE SET NULL,
+      FOREIGN KEY (`ingredient_id`) REFERENCES `ingredients`(`id`) ON DELETE CASCADE
+    )
+    """)
+    _create_ingredient_stock(cursor)  # the view joins it
+    cursor.execute(CURRENT_INVENTORY_VIEW_SQL)
+
+def _008_dashboard_snapshot_procedure(cursor):
+    # get_dashboard_snapshot: every dashboard aggregate in one CALL. Re-run this step's
+    # body (or bump a new migration) whenever DASHBOARD_SNAPSHOT_QUERIES changes.
+    cursor.execute("DROP PROCEDURE IF EXISTS dashboard_snapshot")
+    cursor.execute(dashboard_snapshot_procedure_sql())
+
+def _009_role_permissions(cursor):
+    # Tab and action permissions per role, read and cached by auth.py at login.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS `role_permission` (
+      `role` VARCHAR(20) NOT NULL,
+      `permission` VARCHAR(50) NOT NULL,
+      PRIMARY KEY (`role`, `permission`)
+    )
+    """)
+    cursor.executemany("INSERT IGNORE INTO role_permission (role, permission) VALUES (%s, %s)",
+                       [(role, permission) for role, permissions in DEFAULT_ROLE_PERMISSIONS.items() for permission in sorted(permissions)])
+
+def _010_all_outlets_permission(cursor):
+    # Cross-outlet dashboard totals; databases migrated before it existed only have the 009 seed.
+    cursor.execute("INSERT IGNORE INTO role_permission (role, permission) VALUES ('admin', 'all_outlets')")
+
+def _011_diagnostics_permission(cursor):
+    # The Diagnostics tab (data-layer latency and slow queries) is for admins.
+    cursor.execute("INSERT IGNORE INTO role_permission (role, permission) VALUES ('admin', 'diagnostics')")
+
+def _012_ingredient_stock(cursor):
+    # Databases that ran 007 before it created the table get it here.
+    _create_ingredient_stock(cursor)
+
+def _013_live_batch_expiry_index(cursor):
+    # The stock view's expired_stock subquery and write_off_expired_batches: leading on
+    # quantity_remaining skips the used-up batches, which are most of the table, instead
+    # of range-scanning every batch that ever expired.
+    _create_index(cursor, 'ingredient_batches', 'idx_batches_live_expiry', '`quantity_remaining`, `expiry_date`, `ingredient_id`')
+    if _index_exists(cursor, 'ingredient_batches', 'idx_batches_expiry'):
+        cursor.execute("DROP INDEX `idx_batches_expiry` ON `ingredient_batches`")  # superseded by the index above
+
+MIGRATIONS = [
+    (1, "Covering index for FIFO batch lookups", _001_batch_expiry_index),
+    (2, "Covering index for sales by day", _002_sales_time_index),
+    (3, "Covering index for recipe lookups", _003_recipe_dish_ingredient_index),
+    (4, "Daily and per-dish sales rollup tables", _004_sales_rollups),
+    (5, "Change log for the live dashboard", _005_change_log),
+    (6, "Client UUIDs for idempotent sale replay", _006_sale_client_uuid),
+    (7, "Expiry index, waste log and expiry-aware stock view", _007_expiry_tracking),
+    (8, "Stored procedure for the dashboard snapshot", _008_dashboard_snapshot_procedure),
+    (9, "Role permissions for the login session", _009_role_permissions),
+    (10, "All-outlets dashboard permission for admins", _010_all_outlets_permission),
+    (11, "Diagnostics tab permission for admins", _011_diagnostics_permission),
+    (12, "Running ingredient_stock totals, backfilled from the batches", _012_ingredient_stock),
+    (13, "Live-batch expiry index for the stock view", _013_live_batch_expiry_index),
+]
+
+# --- Runner ---
+
+def _ensure_version_table(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS `schema_version` (
+      `version` INT PRIMARY KEY,
+      `description` VARCHAR(255) NOT NULL,
+      `applied_at` DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+def get_applied_versions(cursor):
+    _ensure_version_table(cursor)
+    cursor.execute("SELECT version FROM schema_version")
+    return {row['version'] for row in cursor.fetchall()}
+
+def migrate(target=None):
+    """Applies every pending migration up to and including target (or all), in list order. Returns the versions applied."""
+    order = [version for version, _, _ in MIGRATIONS]
+    if target is not None and target not in order:
+        raise RuntimeError(f"Unknown migration version {target}.")
+    steps = MIGRATIONS[:order.index(target) + 1] if target is not None else MIGRATIONS
+    applied_now = []
+    with db_connection() as conn:
+        if not conn:
+            raise RuntimeError("Database connection failed.")
+        with conn.cursor() as cursor:
+            applied = get_applied_versions(cursor)
+            for version, description, step in steps:
+                if version in applied:
+                    continue
+                print(f"Applying {version:03d}: {description}")
+                step(cursor)
+                cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)", (version, description))
+                conn.commit()
+                applied_now.append(version)
+    return applied_now
+
+# --- Query Plan Check ---
+# The filtered hot-path queries, taken from the same SQL constants and builders the
+# code runs (so a changed query is checked as it now is), with representative
+# parameters. Listing queries (get_all_*) read whole tables by design and are not checked.
+
+PLAN_CHECKS = [
+    ("process_sale: lock batches", lock_batches_sql(1), (1,)),
+    ("process_sale: sale UUID lookup", SALE_BY_UUID_SQL, ('00000000-0000-0000-0000-000000000000',)),
+    ("process_sale: batch quantities", batch_quantities_sql(1), (1, 0, 1)),
+    ("process_sale: deduct ingredient_stock", deduct_stock_sql(1), (1, 0, 1)),
+    ("get_order_recipes", RECIPE_LINES_SQL + "WHERE r.dish_id IN (%s)", (1,)),
+    ("get_batches_page", batches_page_sql(paged=True), (1, '2000-01-01', '2000-01-01', 0, 101)),
+    ("write_off_expired_batches", EXPIRED_BATCHES_SQL, ()),
+    ("current_inventory_view: expired stock", EXPIRED_STOCK_SQL, ()),
+    ("get_dishes_page", DISHES_PAGE_SQL, ('', 101)),
+    ("add_ingredient_to_recipe: duplicate check", RECIPE_LINE_EXISTS_SQL, (1, 1)),
+    ("get_sales_by_day", SALES_BY_DAY_SQL, (7,)),
+    ("login: account lookup", LOGIN_ACCOUNT_SQL, ('admin',)),
+] + [(f"dashboard_snapshot: {name}", sql, {'days': 7, 'top': 5}) for name, sql in DASHBOARD_SNAPSHOT_QUERIES
+     if name in ('sales_by_day', 'top_dishes')]  # the others read small tables (change_log, rollup days, the stock view) whole
+
+def check_query_plans():
+    """Runs EXPLAIN on each hot query. Returns a list of (name, table) pairs that fall back to a full scan."""
+    failures = []
+    with db_connection() as conn:
+        if not conn:
+            raise RuntimeError("Database connection failed.")
+        with conn.cursor() as cursor:
+            for name, sql, params in PLAN_CHECKS:
+                cursor.execute("EXPLAIN " + sql, params)
+                for row in cursor.fetchall():
+                    # A full scan is only a problem when no index could have served it;
+                    # on tiny tables the optimizer may pick ALL even when one exists.
+                    if row.get('type') == 'ALL' and not row.get('possible_keys'):
+                        failures.append((name, row.get('table')))
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply schema migrations to the restaurant database.")
+    parser.add_argument("--status", action="store_true", help="list applied and pending migrations")
+    parser.add_argument("--check-plans", action="store_true", help="fail if a hot query in utils.py needs a full table scan")
+    parser.add_argument("--target", type=int, help="migrate up to this version only")
+    parser.add_argument("--outlet", choices=list(OUTLETS), help="only this outlet's database (default: every outlet)")
+    args = parser.parse_args()
+
+    for outlet in [args.outlet] if args.outlet else OUTLETS:
+        if len(OUTLETS) > 1: print(f"--- Outlet: {outlet} ---")
+        with use_outlet(outlet):
+            run_command(args)
+
+def run_command(args):
+    try:
+        if args.status:
+            with db_connection() as conn:
+                if not conn:
+                    raise RuntimeError("Database connection failed.")
+                with conn.cursor() as cursor:
+                    applied = get_applied_versions(cursor)
+                conn.commit()
+            for version, description, _ in MIGRATIONS:
+                print(f"[{'x' if version in applied else ' '}] {version:03d} {description}")
+        elif args.check_plans:
+            failures = check_query_plans()
+            for name, table in failures:
+                print(f"FULL SCAN: {name} on table '{table}'")
+            if failures:
+                sys.exit(1)
+            print(f"All {len(PLAN_CHECKS)} checked queries use an index.")
+        else:
+            applied = migrate(args.target)
+            print(f"{len(applied)} migration(s) applied." if applied else "Schema is up to date.")
+    except (pymysql.Error, RuntimeError) as e:
+        print(f"Database Error: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
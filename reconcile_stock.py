@@ -0,0 +1,28 @@
+import argparse
+
+from utils import reconcile_ingredient_stock
+
+def main():
+    """Rebuilds the ingredient_stock summary table from ingredient_batches"""
+    parser = argparse.ArgumentParser(description="Reconcile ingredient_stock with the batch totals.")
+    parser.add_argument("--dry-run", action="store_true", help="only report drift, do not rebuild")
+    args = parser.parse_args()
+
+    print("--- Reconciling Ingredient Stock ---")
+    drift = reconcile_ingredient_stock(apply=not args.dry_run)
+    if drift is None:
+        print("Database Error: could not connect.")
+        return
+    if not drift:
+        print("No drift found. ingredient_stock matches the batches.")
+        return
+
+    for row in drift:
+        print(f"  {row['name']} (ID {row['ingredient_id']}): recorded {row['recorded']}, actual {row['actual']}")
+    if args.dry_run:
+        print(f"\n{len(drift)} ingredient(s) drifted. Run without --dry-run to rebuild.")
+    else:
+        print(f"\n{len(drift)} ingredient(s) drifted and have been corrected.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import argparse
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from utils import process_sale, current_outlet, use_outlet, OUTLETS, DEFAULT_OUTLET, SALE_CONNECTION_LOST
+
+# --- Offline Sale Queue ---
+# Every sale is journalled to a local SQLite file before it is sent to MySQL and
+# removed once MySQL has it. While the database is unreachable, or older sales
+# are still waiting, new sales go straight to the journal so checkout stays
+# instant; replay_pending() flushes them in order once the connection is back.
+# Each sale carries a client-generated UUID, so a replay after a crash or a lost
+# acknowledgement never records the same sale twice. Sales remember the outlet
+# they were rung up at and are replayed there, whoever is logged in by then.
+# A sale is claimed (status 'sending') before it is sent, so a direct send and a
+# replay, in this process or another, never send the same row at once. A claim
+# left behind by a crash is picked up again after CLAIM_TIMEOUT seconds.
+
+SALE_QUEUE_PATH = 'pending_sales.sqlite3'
+REPLAY_BATCH_SIZE = 50
+CLAIM_TIMEOUT = 120     # seconds before a 'sending' row is treated as abandoned
+CONNECTION_FAILED = "Database connection failed."
+QUEUED_MESSAGE = "Sale queued, will sync: it is saved on this terminal and will be sent to the database when the connection is back."
+
+_replay_lock = threading.Lock()
+
+def _open_queue():
+    conn = sqlite3.connect(SALE_QUEUE_PATH, timeout=5)
+    conn.row_factory = sqlite3.Row
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS pending_sales (
+      seq INTEGER PRIMARY KEY AUTOINCREMENT,
+      sale_uuid TEXT UNIQUE NOT NULL,
+      waiter_id INTEGER,
+      order_items TEXT NOT NULL,
+      total_amount REAL NOT NULL,
+      sale_time TEXT NOT NULL,
+      status TEXT NOT NULL DEFAULT 'pending',
+      error TEXT,
+      outlet TEXT
+    )
+    """)
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(pending_sales)")}
+    if 'outlet' not in columns:
+        conn.execute("ALTER TABLE pending_sales ADD COLUMN outlet TEXT")  # journals from before outlets existed
+    if 'claimed_at' not in columns:
+        conn.execute("ALTER TABLE pending_sales ADD COLUMN claimed_at REAL")
+    return conn
+
+def _journal(conn, sale_uuid, waiter_id, order_items, total_amount, sale_time):
+    with conn:
+        conn.execute(
+            "INSERT INTO pending_sales (sale_uuid, waiter_id, order_items, total_amount, sale_time, outlet) VALUES (?, ?, ?, ?, ?, ?)",
+            (sale_uuid, waiter_id, json.dumps(order_items), total_amount, sale_time, current_outlet()))
+
+def _is_unsent(response):
+    """True when the sale may not have reached MySQL and has to stay queued"""
+    return response in (CONNECTION_FAILED, SALE_CONNECTION_LOST)
+
+def _claim(conn, sale_uuid):
+    """Marks a pending (or abandoned) sale as being sent; False if someone else holds it"""
+    now = time.time()
+    with conn:
+        cursor = conn.execute(
+            "UPDATE pending_sales SET status = 'sending', claimed_at = ? WHERE sale_uuid = ? AND (status = 'pending' OR (status = 'sending' AND claimed_at < ?))",
+            (now, sale_uuid, now - CLAIM_TIMEOUT))
+    return cursor.rowcount == 1
+
+def _unclaim(conn, sale_uuid):
+    with conn:
+        conn.execute("UPDATE pending_sales SET status = 'pending', claimed_at = NULL WHERE sale_uuid = ?", (sale_uuid,))
+
+def _settle(conn, sale_uuid, response):
+    """Removes a sale MySQL accepted; keeps one it rejected, marked failed for review"""
+    with conn:
+        if "successfully" in response:
+            conn.execute("DELETE FROM pending_sales WHERE sale_uuid = ?", (sale_uuid,))
+        else:
+            conn.execute("UPDATE pending_sales SET status = 'failed', error = ? WHERE sale_uuid = ?", (response, sale_uuid))
+
+def submit_sale(waiter_id, order_items, total_amount):
+    """Journals a sale, then sends it to the database unless older sales are still queued.
+
+    Returns process_sale's message, or QUEUED_MESSAGE if the sale was kept offline.
+    """
+    sale_uuid = str(uuid.uuid4())
+    sale_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn = _open_queue()
+    try:
+        _journal(conn, sale_uuid, waiter_id, order_items, total_amount, sale_time)
+        queued_before = conn.execute("SELECT COUNT(*) FROM pending_sales WHERE status IN ('pending', 'sending') AND sale_uuid != ?", (sale_uuid,)).fetchone()[0]
+        if queued_before or not _claim(conn, sale_uuid):
+            return QUEUED_MESSAGE  # keep sales in order behind the ones waiting to replay
+        # Sent now, so the database stamps it; the journalled time is only for a later replay
+        response = process_sale(waiter_id, order_items, total_amount, sale_uuid=sale_uuid, sale_time=None)
+        if _is_unsent(response):
+            _unclaim(conn, sale_uuid)
+            return QUEUED_MESSAGE
+        # Accepted, or rejected with an error the waiter sees now: either way nothing is left to replay.
+        with conn:
+            conn.execute("DELETE FROM pending_sales WHERE sale_uuid = ?", (sale_uuid,))
+        return response
+    finally:
+        conn.close()
+
+def replay_pending(batch_size=REPLAY_BATCH_SIZE):
+    """Sends queued sales to the database, oldest first, stopping at the first connection failure.
+
+    Returns a dict with the number of sales sent, rejected (kept as failed) and still pending.
+    """
+    result = {'sent': 0, 'failed': 0, 'pending': 0}
+    if not _replay_lock.acquire(blocking=False):
+        return get_queue_counts()  # another replay is already running
+    conn = _open_queue()
+    try:
+        rows = conn.execute("SELECT * FROM pending_sales WHERE status IN ('pending', 'sending') ORDER BY seq LIMIT ?", (batch_size,)).fetchall()
+        for row in rows:
+            if not _claim(conn, row['sale_uuid']):
+                break  # being sent right now; later sales wait behind it
+            order_items = [tuple(item) for item in json.loads(row['order_items'])]
+            outlet = row['outlet'] or DEFAULT_OUTLET
+            if outlet not in OUTLETS:
+                _settle(conn, row['sale_uuid'], f"Error: Outlet '{outlet}' is no longer configured.")
+                result['failed'] += 1
+                continue
+            with use_outlet(outlet):
+                response = process_sale(row['waiter_id'], order_items, row['total_amount'], sale_uuid=row['sale_uuid'], sale_time=row['sale_time'])
+            if _is_unsent(response):
+                _unclaim(conn, row['sale_uuid'])
+                break
+            _settle(conn, row['sale_uuid'], response)
+            result['sent' if "successfully" in response else 'failed'] += 1
+        result['pending'] = conn.execute("SELECT COUNT(*) FROM pending_sales WHERE status IN ('pending', 'sending')").fetchone()[0]
+        return result
+    finally:
+        conn.close()
+        _replay_lock.release()
+
+def get_queue_counts():
+    """Returns the number of pending and failed sales in the local queue"""
+    conn = _open_queue()
+    try:
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM pending_sales GROUP BY status").fetchall())
+        return {'sent': 0, 'failed': counts.get('failed', 0), 'pending': counts.get('pending', 0) + counts.get('sending', 0)}
+    finally:
+        conn.close()
+
+def get_failed_sales():
+    conn = _open_queue()
+    try:
+        return [dict(row) for row in conn.execute("SELECT * FROM pending_sales WHERE status = 'failed' ORDER BY seq")]
+    finally:
+        conn.close()
+
+def main():
+    """Shows or replays the local offline sale queue"""
+    parser = argparse.ArgumentParser(description="Replay sales saved while the database was unreachable.")
+    parser.add_argument("--status", action="store_true", help="show queued and failed sales without replaying")
+    args = parser.parse_args()
+
+    if not args.status:
+        while True:
+            result = replay_pending()
+            print(f"Sent {result['sent']}, rejected {result['failed']}, {result['pending']} still pending.")
+            if not result['sent'] and not result['failed']:
+                break
+    counts = get_queue_counts()
+    print(f"--- {counts['pending']} pending, {counts['failed']} failed ---")
+    for sale in get_failed_sales():
+        print(f"  {sale['sale_time']} waiter {sale['waiter_id']} ₹{sale['total_amount']:.2f}: {sale['error']}")
+
+if __name__ == "__main__":
+    main()
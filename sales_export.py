@@ -0,0 +1,152 @@
+import argparse
+import csv
+import os
+from datetime import date, timedelta
+
+import pymysql
+import pymysql.cursors
+
+from utils import dedicated_connection, routed
+
+# --- Sales Export ---
+# Rows are streamed from MySQL with an unbuffered server-side cursor (SSDictCursor)
+# and written out as they arrive, so memory stays flat however long the range is.
+# The stream runs on its own connection rather than a pooled one, so it neither
+# holds a pool slot for the length of the export nor hands its session settings on.
+
+FETCH_SIZE = 5000   # rows pulled per fetchmany() and written per Parquet row group
+
+EXPORT_QUERIES = {
+    'items': ("""
+    SELECT s.id AS sale_id, s.sale_time, s.waiter_id, CONCAT(e.fname, ' ', e.lname) AS waiter_name,
+           si.dish_id, d.dname AS dish_name, d.category, si.quantity, si.price_per_item,
+           si.quantity * si.price_per_item AS line_total
+    FROM sales s
+    JOIN sale_items si ON si.sale_id = s.id
+    LEFT JOIN dish d ON si.dish_id = d.id
+    LEFT JOIN employee e ON s.waiter_id = e.id
+    """, "d.category = %s", "ORDER BY s.sale_time, s.id, si.id"),
+    'sales': ("""
+    SELECT s.id AS sale_id, s.sale_time, s.waiter_id, CONCAT(e.fname, ' ', e.lname) AS waiter_name, s.total_amount
+    FROM sales s
+    LEFT JOIN employee e ON s.waiter_id = e.id
+    """, "EXISTS (SELECT 1 FROM sale_items si JOIN dish d ON si.dish_id = d.id WHERE si.sale_id = s.id AND d.category = %s)",
+    "ORDER BY s.sale_time, s.id"),
+}
+
+def build_export_query(level='items', start=None, end=None, waiter_id=None, category=None):
+    """Returns (sql, params) for the export. end is inclusive."""
+    select, category_filter, order_by = EXPORT_QUERIES[level]
+    conditions, params = [], []
+    if start:
+        conditions.append("s.sale_time >= %s"); params.append(start)
+    if end:
+        conditions.append("s.sale_time < %s"); params.append(end + timedelta(days=1))
+    if waiter_id:
+        conditions.append("s.waiter_id = %s"); params.append(waiter_id)
+    if category:
+        conditions.append(category_filter); params.append(category)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"{select} {where} {order_by}", params
+
+@routed('replica')
+def stream_sales(level='items', start=None, end=None, waiter_id=None, category=None, fetch_size=FETCH_SIZE):
+    """Yields lists of up to fetch_size row dicts. Raises RuntimeError if the database is unreachable."""
+    sql, params = build_export_query(level, start, end, waiter_id, category)
+    with dedicated_connection(route='replica') as conn:
+        if not conn:
+            raise RuntimeError("Database connection failed.")
+        # The server waits for us while we write each chunk; give slow disks some slack.
+        with conn.cursor() as cursor:
+            cursor.execute("SET SESSION net_write_timeout = 600")
+        cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+        cursor.execute(sql, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield rows
+        except BaseException:
+            # Closing an unbuffered cursor first reads the rest of its result. On an early
+            # exit (the caller stopped, or a fetch failed) drop the connection instead and
+            # leave the cursor unclosed, so the unread rows are never transferred.
+            conn.close()
+            raise
+        cursor.close()
+
+# --- Writers ---
+
+def _write_csv(path, chunks):
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = None
+        for rows in chunks:
+            if writer is None:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+                writer.writeheader()
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+def _parquet_schema(pa, level):
+    money = pa.decimal128(14, 2)
+    fields = [('sale_id', pa.int32()), ('sale_time', pa.timestamp('s')), ('waiter_id', pa.int32()), ('waiter_name', pa.string())]
+    if level == 'items':
+        fields += [('dish_id', pa.int32()), ('dish_name', pa.string()), ('category', pa.string()),
+                   ('quantity', pa.int32()), ('price_per_item', money), ('line_total', money)]
+    else:
+        fields += [('total_amount', money)]
+    return pa.schema(fields)
+
+def _write_parquet(path, chunks, level):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow).")
+    schema = _parquet_schema(pa, level)
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in chunks:
+            # One row group per fetched chunk, so only one chunk is ever held in memory
+            columns = {name: [row[name] for row in rows] for name in schema.names}
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            count += len(rows)
+    return count
+
+def export_sales(path, level='items', start=None, end=None, waiter_id=None, category=None):
+    """Streams sales (one row per sale) or sale items to a .csv or .parquet file. Returns a summary message."""
+    if level not in EXPORT_QUERIES:
+        return f"Error: Unknown export level '{level}'."
+    chunks = stream_sales(level, start, end, waiter_id, category)
+    try:
+        if path.lower().endswith('.parquet'):
+            count = _write_parquet(path, chunks, level)
+        else:
+            count = _write_csv(path, chunks)
+    except (pymysql.Error, RuntimeError, OSError) as e:
+        return f"Error exporting sales: {e}"
+    finally:
+        chunks.close()  # a writer that failed part-way leaves the stream open until then
+    if not count and os.path.exists(path) and not path.lower().endswith('.parquet'):
+        os.remove(path)
+        return "No sales match the selected filters."
+    return f"Exported {count} row(s) to {path} successfully!"
+
+def main():
+    """Exports sales or sale items for a date range to CSV or Parquet"""
+    parser = argparse.ArgumentParser(description="Stream a sales export to CSV or Parquet.")
+    parser.add_argument("path", help="output file; .parquet writes Parquet (needs pyarrow), anything else CSV")
+    parser.add_argument("--level", choices=list(EXPORT_QUERIES), default='items', help="one row per sale item (default) or per sale")
+    parser.add_argument("--from", dest="start", type=date.fromisoformat, help="first day, YYYY-MM-DD")
+    parser.add_argument("--to", dest="end", type=date.fromisoformat, help="last day (inclusive), YYYY-MM-DD")
+    parser.add_argument("--waiter", type=int, help="employee id of the waiter")
+    parser.add_argument("--category", help="dish category")
+    args = parser.parse_args()
+
+    print(f"--- Exporting sales {args.level} ---")
+    print(export_sales(args.path, args.level, args.start, args.end, args.waiter, args.category))
+
+if __name__ == "__main__":
+    main()
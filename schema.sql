@@ -97,6 +97,18 @@ CREATE TABLE IF NOT EXISTS `ingredient_batches` (
     FOREIGN KEY (`supplier_id`) REFERENCES `supplier`(`id`) ON DELETE SET NULL
 );
 
+-- Running stock total per ingredient, kept in step with ingredient_batches by the
+-- application (deliveries add to it, sales deduct from it in the same transaction).
+-- Rebuild with `python reconcile_stock.py` if it ever drifts.
+CREATE TABLE IF NOT EXISTS `ingredient_stock` (
+    `ingredient_id` INT PRIMARY KEY,
+    `total_stock` DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    FOREIGN KEY (`ingredient_id`) REFERENCES `ingredients`(`id`) ON DELETE CASCADE
+);
+
+INSERT IGNORE INTO `ingredient_stock` (`ingredient_id`, `total_stock`)
+SELECT `ingredient_id`, SUM(`quantity_remaining`) FROM `ingredient_batches` GROUP BY `ingredient_id`;
+
 -- Stores the recipe for each dish
 CREATE TABLE IF NOT EXISTS `recipe` (
   `id` INT AUTO_INCREMENT PRIMARY KEY,
@@ -111,20 +123,24 @@ CREATE TABLE IF NOT EXISTS `recipe` (
 -- 5. VIEWS 
 -- =================================================================
 
--- VIEW to see the current total stock of each ingredient
+-- VIEW to see the current usable stock of each ingredient (expired batches are not counted)
+-- The expired_stock subquery relies on migration 013's (quantity_remaining, expiry_date) index.
 CREATE OR REPLACE VIEW `current_inventory_view` AS
 SELECT
     i.id AS ingredient_id,
     i.name AS ingredient_name,
     i.unit,
     i.reorder_level,
-    SUM(ib.quantity_remaining) AS total_stock
+    s.total_stock - COALESCE(x.expired_stock, 0) AS total_stock
 FROM
     ingredients i
 LEFT JOIN
-    ingredient_batches ib ON i.id = ib.ingredient_id
-GROUP BY
-    i.id;
+    ingredient_stock s ON i.id = s.ingredient_id
+LEFT JOIN
+    (SELECT ingredient_id, SUM(quantity_remaining) AS expired_stock
+     FROM ingredient_batches
+     WHERE expiry_date < CURDATE() AND quantity_remaining > 0
+     GROUP BY ingredient_id) x ON i.id = x.ingredient_id;
 
 -- VIEW to calculate the cost of making each dish
 CREATE OR REPLACE VIEW `dish_cost_view` AS
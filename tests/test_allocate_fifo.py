@@ -0,0 +1,34 @@
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip('pymysql')  # utils connects through PyMySQL, imported at module level
+
+from utils import allocate_fifo
+
+def batch(batch_id, ingredient_id, remaining):
+    return {'id': batch_id, 'ingredient_id': ingredient_id, 'quantity_remaining': Decimal(remaining)}
+
+def test_draws_soonest_expiring_batch_first():
+    batches = [batch(1, 10, '2'), batch(2, 10, '5')]
+    assert allocate_fifo({10: Decimal('3')}, batches) == {1: Decimal('0'), 2: Decimal('4')}
+
+def test_untouched_batches_are_left_out():
+    batches = [batch(1, 10, '5'), batch(2, 10, '5')]
+    assert allocate_fifo({10: Decimal('5')}, batches) == {1: Decimal('0')}
+
+def test_several_ingredients():
+    batches = [batch(1, 10, '1.5'), batch(2, 20, '4'), batch(3, 20, '4')]
+    result = allocate_fifo({10: Decimal('1.5'), 20: Decimal('6')}, batches)
+    assert result == {1: Decimal('0'), 2: Decimal('0'), 3: Decimal('2')}
+
+def test_exact_stock_is_enough():
+    assert allocate_fifo({10: Decimal('2')}, [batch(1, 10, '2')]) == {1: Decimal('0')}
+
+def test_insufficient_stock_names_the_ingredient():
+    with pytest.raises(ValueError, match="Insufficient stock for Paneer. Required: 3, Available: 2"):
+        allocate_fifo({10: Decimal('3')}, [batch(1, 10, '2')], lambda ing_id: "Paneer")
+
+def test_ingredient_without_batches():
+    with pytest.raises(ValueError, match="ID 99"):
+        allocate_fifo({99: Decimal('1')}, [batch(1, 10, '2')])
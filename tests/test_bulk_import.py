@@ -0,0 +1,75 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip('pymysql')  # bulk_import reaches the database through utils
+
+from bulk_import import validate_row, release_claims
+
+@pytest.fixture
+def lookups():
+    return {'ingredients': {'paneer': 1}, 'suppliers': {'fresh farms': 7}, 'dishes': {'paneer tikka': 3},
+            'recipe_pairs': {(3, 1)}}
+
+def batch_row(**overrides):
+    return {'ingredient': 'Paneer', 'supplier': 'Fresh Farms', 'quantity': '12.5', 'cost_per_unit': '310',
+            'expiry_date': '2026-11-01', 'received_date': '', **overrides}
+
+def test_valid_batch(lookups):
+    row = validate_row('batches', batch_row(), lookups)
+    assert row == (1, 7, Decimal('12.50'), Decimal('12.50'), Decimal('310.00'), date.today(), date(2026, 11, 1))
+
+@pytest.mark.parametrize('value', ['NaN', 'nan', 'sNaN', 'Infinity', '-inf', 'abc', ''])
+def test_non_numbers_are_row_errors(lookups, value):
+    with pytest.raises(ValueError):
+        validate_row('batches', batch_row(quantity=value), lookups)
+
+@pytest.mark.parametrize('value', ['0', '-1', '0.001', '100000000', '1e30'])
+def test_out_of_range_quantities_are_row_errors(lookups, value):
+    with pytest.raises(ValueError):
+        validate_row('batches', batch_row(quantity=value), lookups)
+
+def test_zero_cost_is_allowed(lookups):
+    assert validate_row('batches', batch_row(cost_per_unit='0'), lookups)[4] == Decimal('0.00')
+
+def test_unknown_ingredient(lookups):
+    with pytest.raises(ValueError, match="unknown ingredient 'Tofu'"):
+        validate_row('batches', batch_row(ingredient='Tofu'), lookups)
+
+def test_bad_date(lookups):
+    with pytest.raises(ValueError, match="expiry_date"):
+        validate_row('batches', batch_row(expiry_date='next week'), lookups)
+
+def test_duplicate_names_within_one_file(lookups):
+    validate_row('dishes', {'name': 'Dal Makhani', 'price': '240', 'category': 'Mains'}, lookups)
+    with pytest.raises(ValueError, match="already exists"):
+        validate_row('dishes', {'name': 'dal makhani', 'price': '240', 'category': 'Mains'}, lookups)
+
+def test_duplicate_recipe_line(lookups):
+    with pytest.raises(ValueError, match="already in the recipe"):
+        validate_row('recipes', {'dish': 'Paneer Tikka', 'ingredient': 'Paneer', 'quantity': '0.2'}, lookups)
+
+def test_rejected_row_does_not_claim_its_name(lookups):
+    with pytest.raises(ValueError, match="price"):
+        validate_row('dishes', {'name': 'Dal', 'price': 'free', 'category': 'Mains'}, lookups)
+    assert validate_row('dishes', {'name': 'Dal', 'price': '180', 'category': 'Mains'}, lookups)[0] == 'Dal'
+
+def test_rejected_row_does_not_claim_its_recipe_line(lookups):
+    lookups['ingredients']['ghee'] = 2
+    with pytest.raises(ValueError, match="quantity"):
+        validate_row('recipes', {'dish': 'Paneer Tikka', 'ingredient': 'Ghee', 'quantity': '-1'}, lookups)
+    assert validate_row('recipes', {'dish': 'Paneer Tikka', 'ingredient': 'Ghee', 'quantity': '0.05'}, lookups)[:2] == (3, 2)
+
+def test_rolled_back_chunk_releases_its_claims(lookups):
+    rows = [validate_row('dishes', {'name': 'Dal', 'price': '180', 'category': 'Mains'}, lookups)]
+    release_claims('dishes', rows, lookups)
+    assert validate_row('dishes', {'name': 'dal', 'price': '180', 'category': 'Mains'}, lookups)
+
+@pytest.mark.parametrize('value', ['2.5', '0.01'])
+def test_fractional_reorder_level_is_rejected(lookups, value):
+    with pytest.raises(ValueError, match="whole number"):
+        validate_row('ingredients', {'name': 'Ghee', 'unit': 'kg', 'reorder_level': value}, lookups)
+
+def test_whole_reorder_level(lookups):
+    assert validate_row('ingredients', {'name': 'Ghee', 'unit': 'kg', 'reorder_level': '5.0'}, lookups) == ('Ghee', 'kg', 5)
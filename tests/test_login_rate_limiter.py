@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip('pymysql')  # auth connects through PyMySQL, imported at module level
+
+import auth
+from auth import LoginRateLimiter
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(auth.time, 'monotonic', clock)
+    return clock
+
+def test_locks_out_after_max_failures(clock):
+    limiter = LoginRateLimiter(max_failures=3, window=300, lockout=60)
+    for _ in range(2): limiter.record_failure('waiter')
+    assert limiter.retry_after('waiter') == 0
+    limiter.record_failure('waiter')
+    assert limiter.retry_after('waiter') == 60
+    clock.now += 61
+    assert limiter.retry_after('waiter') == 0
+
+def test_failures_outside_the_window_do_not_count(clock):
+    limiter = LoginRateLimiter(max_failures=3, window=300, lockout=60)
+    for _ in range(2): limiter.record_failure('waiter')
+    clock.now += 301
+    limiter.record_failure('waiter')
+    assert limiter.retry_after('waiter') == 0
+
+def test_success_clears_failures(clock):
+    limiter = LoginRateLimiter(max_failures=2, window=300, lockout=60)
+    limiter.record_failure('waiter')
+    limiter.record_success('waiter')
+    limiter.record_failure('waiter')
+    assert limiter.retry_after('waiter') == 0
+
+def test_usernames_are_tracked_separately(clock):
+    limiter = LoginRateLimiter(max_failures=2, window=300, lockout=60)
+    for _ in range(2): limiter.record_failure('a')
+    assert limiter.retry_after('a') > 0
+    assert limiter.retry_after('b') == 0
+
+def test_tracking_stays_bounded_but_keeps_lockouts(clock):
+    limiter = LoginRateLimiter(max_failures=2, window=300, lockout=60, max_tracked=100)
+    for _ in range(2): limiter.record_failure('target')
+    for i in range(1000):
+        limiter.record_failure(f'spray{i}')
+    stats = limiter.get_stats()
+    assert stats['tracked_users'] + stats['locked_users'] <= 101
+    assert limiter.retry_after('target') > 0
+
+def test_password_hash_round_trip():
+    stored = auth.hash_password('s3cret', iterations=1000)
+    assert auth.verify_password('s3cret', stored)
+    assert not auth.verify_password('wrong', stored)
+    assert auth.needs_rehash(stored)
+    assert not auth.verify_password('s3cret', 'pbkdf2_sha256$bad')
@@ -0,0 +1,44 @@
+import pytest
+
+pytest.importorskip('pymysql')  # utils connects through PyMySQL, imported at module level
+
+from utils import MenuIndex, POS_UNCATEGORISED
+
+DISHES = [
+    {'id': 1, 'dname': 'Butter Chicken', 'price': 320, 'category': 'Mains'},
+    {'id': 2, 'dname': 'Chicken Tikka', 'price': 280, 'category': 'Starters'},
+    {'id': 3, 'dname': 'Garlic Naan', 'price': 60, 'category': 'Breads'},
+    {'id': 4, 'dname': 'Masala Chai', 'price': 40, 'category': None},
+    {'id': 5, 'dname': 'Paneer Tikka', 'price': 260, 'category': 'Starters'},
+]
+
+def names(dishes):
+    return [d['dname'] for d in dishes]
+
+def test_categories_include_uncategorised():
+    index = MenuIndex(DISHES)
+    assert index.categories == sorted(['Breads', 'Mains', 'Starters', POS_UNCATEGORISED])
+
+def test_page_clamps_to_the_last_page():
+    index = MenuIndex(DISHES)
+    dishes, page, pages = index.page(page=5, page_size=2)
+    assert (names(dishes), page, pages) == (['Paneer Tikka'], 2, 3)
+    assert index.page('Starters')[0] == [DISHES[1], DISHES[4]]
+    assert index.page('Desserts') == ([], 0, 1)
+
+def test_name_starting_with_the_query_ranks_first():
+    assert names(MenuIndex(DISHES).search('chicken')) == ['Chicken Tikka', 'Butter Chicken']
+
+def test_every_word_must_match_a_word_start():
+    assert names(MenuIndex(DISHES).search('tik pan')) == ['Paneer Tikka']
+
+def test_mid_word_fragment():
+    assert set(names(MenuIndex(DISHES).search('ikk'))) == {'Chicken Tikka', 'Paneer Tikka'}
+
+def test_typo_still_matches():
+    assert names(MenuIndex(DISHES).search('garlik naan'))[:1] == ['Garlic Naan']
+
+def test_empty_query_and_limit():
+    index = MenuIndex(DISHES)
+    assert index.search('  ') == []
+    assert len(index.search('tikka', limit=1)) == 1
@@ -0,0 +1,34 @@
+import pytest
+
+pytest.importorskip('pymysql')  # utils connects through PyMySQL, imported at module level
+
+from utils import RecipeCache
+
+def line(dish_id, ingredient_id, quantity=1):
+    return {'dish_id': dish_id, 'ingredient_id': ingredient_id, 'quantity_needed': quantity, 'name': f"ingredient {ingredient_id}"}
+
+def test_store_and_hit():
+    cache = RecipeCache()
+    cache.store([line(1, 10), line(1, 11, 2)], [1], cache.generation())
+    assert cache.get_many([1]) == ({1: [(10, 1), (11, 2)]}, [])
+
+def test_dish_without_recipe_is_not_cached():
+    cache = RecipeCache()
+    assert cache.store([], [2], cache.generation()) == {2: []}
+    assert cache.get_many([2]) == ({}, [2])
+
+def test_load_raced_by_invalidation_is_not_stored():
+    cache = RecipeCache()
+    generation = cache.generation()
+    cache.invalidate(1)
+    cache.store([line(1, 10)], [1], generation)
+    assert cache.get_many([1]) == ({}, [1])
+
+def test_recipes_version_change_drops_the_cache():
+    cache = RecipeCache()
+    cache.sync(4)
+    cache.store([line(1, 10)], [1], cache.generation())
+    cache.sync(4)
+    assert cache.get_many([1])[1] == []
+    cache.sync(5)
+    assert cache.get_many([1]) == ({}, [1])
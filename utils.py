@@ -1,137 +1,603 @@
+"""Backend engine: database connections and every data function the app and scripts use.
+
+Connections come from a small thread-safe pool per outlet (db_connection(), sized
+by POOL_SIZE). Outlets are listed in OUTLETS; each entry overrides DB_CONFIG keys
+(database name, host, ...). db_connection() goes to the logged-in session's outlet,
+use_outlet() redirects one block to another, and fan_out() runs a function on every
+outlet in parallel (get_group_dashboard_snapshot() merges the dashboards with it).
+Run `python migrations.py` after adding an outlet; it migrates every outlet.
+
+Data functions are tagged @routed('primary') for writes or @routed('replica') for
+listings, dashboards and analytics. With a replica in REPLICAS, replica reads go
+there while its lag (SHOW REPLICA STATUS) is at most REPLICA_MAX_LAG seconds, and
+fall back to the primary when it is down or behind, or for a few seconds after this
+terminal writes; get_routing_stats() shows where reads went. To try it locally,
+start a second MySQL (e.g. `docker run -d -p 3307:3306 -e MYSQL_ROOT_PASSWORD=java0603
+mysql:8`), load schema.sql into it and set REPLICAS = {'main': {'port': 3307}}. A
+stand-in that is not replicating counts as current; a real replica needs an account
+with the REPLICATION CLIENT privilege to report its lag.
+
+The dashboard's KPIs, sales chart and top dishes come from get_dashboard_snapshot(),
+one call to the dashboard_snapshot stored procedure (migration 008) cached for a few
+seconds so panels and refreshes that arrive together share one fetch.
+"""
 import pymysql
 import pymysql.cursors
-import hashlib
-from datetime import date
+import bisect
+import functools
+import inspect
+import math
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from instrumentation import InstrumentedCursor, metrics, call_outcome
 
 # --- Database Connection ---
-def connect_db():
-    """Establishes a connection to the database."""
+DB_CONFIG = {
+    'host': 'localhost',
+    'user': 'root',
+    'password': 'java0603',
+    'database': 'restaurant-inventory-db',
+}
+
+# --- Outlets ---
+# Each restaurant location keeps its data in its own database (or server). An
+# outlet's entry overrides DB_CONFIG keys; the default outlet uses DB_CONFIG as is.
+# Example: 'downtown': {'database': 'restaurant-downtown'} or {'host': '10.0.0.12'}
+OUTLETS = {
+    'main': {},
+}
+DEFAULT_OUTLET = 'main'
+FAN_OUT_WORKERS = 8          # outlets queried at once by fan_out()
+
+# --- Read Replicas ---
+# Optional read replica per outlet, given as overrides on top of the outlet's own
+# settings. Functions tagged @routed('replica') read from it while it is no more
+# than REPLICA_MAX_LAG seconds behind; everything else uses the primary.
+# Example: 'main': {'host': '10.0.0.21'} or, for a local stand-in, {'port': 3307}
+REPLICAS = {}
+REPLICA_MAX_LAG = 5          # seconds of replication lag tolerated before reads go back to the primary
+REPLICA_LAG_CHECK_SECONDS = 2  # how long one lag reading is trusted
+
+POOL_SIZE = 5                # maximum number of open connections per outlet
+POOL_IDLE_TIMEOUT = 300      # seconds an unused connection is kept before it is closed
+POOL_PING_AFTER = 30         # seconds idle after which a connection is pinged on checkout
+POOL_CHECKOUT_TIMEOUT = 10   # seconds to wait for a free connection before giving up
+
+def connect_db(outlet=None, replica=False):
+    """Establishes a connection to the database of an outlet (the current one by default), or to its replica."""
+    outlet = outlet or current_outlet()
     try:
         return pymysql.connect(
-            host='localhost',
-            user='root',
-            password='java0603', 
-            database='restaurant-inventory-db',
-            cursorclass=pymysql.cursors.DictCursor,
+            **{**DB_CONFIG, **OUTLETS[outlet], **(REPLICAS[outlet] if replica else {})},
+            cursorclass=InstrumentedCursor,
             autocommit=False 
         )
     except pymysql.Error:
         return None
 
-# --- Employee Management Functions ---
+class ConnectionPool:
+    """Thread-safe pool of reusable database connections."""
 
-def get_all_employees():
-    conn = connect_db()
-    if not conn: return []
+    def __init__(self, size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT, ping_after=POOL_PING_AFTER, checkout_timeout=POOL_CHECKOUT_TIMEOUT, outlet=DEFAULT_OUTLET, replica=False):
+        self.outlet = outlet
+        self.replica = replica
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.ping_after = ping_after
+        self.checkout_timeout = checkout_timeout
+        self._idle = []  # (connection, last_used) pairs, most recently used last
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self.stats = {'checkouts': 0, 'waits': 0, 'timeouts': 0, 'connections_created': 0, 'health_check_failures': 0, 'evicted': 0}
+
+    def acquire(self):
+        """Returns a live connection, or None if the database is unreachable or the pool is exhausted."""
+        conn = None
+        last_used = 0
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._cond:
+            self.stats['checkouts'] += 1
+            waited = False
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._in_use < self.size:
+                    break
+                if not waited:
+                    self.stats['waits'] += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    return None
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        if conn is not None and time.monotonic() - last_used > self.ping_after and not self._is_healthy(conn):
+            with self._cond:
+                self.stats['health_check_failures'] += 1
+            self._close(conn)
+            conn = None
+        if conn is None:
+            conn = connect_db(self.outlet, self.replica)
+            with self._cond:
+                if conn is None:
+                    self._in_use -= 1
+                    self._cond.notify()
+                    return None
+                self.stats['connections_created'] += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        """Returns a connection to the pool, discarding it if it is broken."""
+        if not discard:
+            try:
+                conn.rollback()
+            except pymysql.Error:
+                discard = True
+        if discard:
+            self._close(conn)
+        with self._cond:
+            self._in_use -= 1
+            if not discard:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+    def _evict_idle(self):
+        # The oldest connections sit at the front of the list.
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.pop(0)
+            self.stats['evicted'] += 1
+            self._close(conn)
+
+    def get_stats(self):
+        with self._cond:
+            return {**self.stats, 'in_use': self._in_use, 'idle': len(self._idle), 'size': self.size}
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except pymysql.Error:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except pymysql.Error:
+            pass
+
+# --- Outlet Routing ---
+# The outlet a session logged into is the process-wide default. use_outlet()
+# overrides it for the current thread or task only, which is how fan_out()
+# points each worker at a different outlet while the UI keeps its own.
+
+_active_outlet = DEFAULT_OUTLET
+_outlet_override = ContextVar('outlet', default=None)
+
+def current_outlet():
+    return _outlet_override.get() or _active_outlet
+
+def set_current_outlet(outlet):
+    """Makes outlet the default for every later db_connection() (called at login)"""
+    global _active_outlet
+    if outlet not in OUTLETS:
+        raise KeyError(f"Unknown outlet '{outlet}'")
+    _active_outlet = outlet
+
+@contextmanager
+def use_outlet(outlet):
+    """Routes db_connection() calls made inside the with-block to outlet"""
+    if outlet not in OUTLETS:
+        raise KeyError(f"Unknown outlet '{outlet}'")
+    token = _outlet_override.set(outlet)
     try:
-        with conn.cursor() as cursor:
-            sql = "SELECT e.id, e.fname, e.lname, e.role, e.email, u.username FROM employee e LEFT JOIN user_account u ON e.uid = u.uid ORDER BY e.id"
-            cursor.execute(sql)
-            return cursor.fetchall()
+        yield outlet
     finally:
-        if conn: conn.close()
+        _outlet_override.reset(token)
 
-def add_employee(details):
-    conn = connect_db()
-    if not conn: return "Database connection failed."
+class PerOutlet:
+    """Keeps one instance of a cache per outlet; attribute access goes to the current outlet's."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def get(self, outlet=None):
+        outlet = outlet or current_outlet()
+        with self._lock:
+            if outlet not in self._instances:
+                self._instances[outlet] = self._factory()
+            return self._instances[outlet]
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+_pools = {outlet: ConnectionPool(outlet=outlet) for outlet in OUTLETS}
+_replica_pools = {outlet: ConnectionPool(outlet=outlet, replica=True) for outlet in REPLICAS}
+
+def _get_pool(outlet=None):
+    return _pools[outlet or current_outlet()]
+
+def configure_pool(size=None, idle_timeout=None, ping_after=None, checkout_timeout=None):
+    """Adjusts settings of every outlet's pool (and replica pool) at runtime. Existing connections are kept."""
+    for pool in [*_pools.values(), *_replica_pools.values()]:
+        with pool._cond:
+            if size is not None: pool.size = size
+            if idle_timeout is not None: pool.idle_timeout = idle_timeout
+            if ping_after is not None: pool.ping_after = ping_after
+            if checkout_timeout is not None: pool.checkout_timeout = checkout_timeout
+            pool._cond.notify_all()
+
+def get_pool_stats(outlet=None):
+    """Returns pool metrics for an outlet (the current one by default): checkouts, waits, connections created and current usage."""
+    return _get_pool(outlet).get_stats()
+
+def close_pool():
+    for pool in [*_pools.values(), *_replica_pools.values()]:
+        pool.close_all()
+
+# --- Read/Write Routing ---
+# Every data function is tagged with the route it takes. 'primary' functions write,
+# or read data they are about to write against; 'replica' functions are read-only
+# listings and analytics that can take a few seconds of lag. A replica read falls
+# back to the primary when the outlet has no replica, the replica is down or too
+# far behind, or this process wrote to the outlet in the last REPLICA_MAX_LAG
+# seconds (so a screen refreshed right after a save shows the save).
+
+ROUTES = ('primary', 'replica')
+
+_route = ContextVar('route', default='primary')
+_last_write = {}         # outlet -> monotonic time of the last primary-routed call
+_replica_lag = {}        # outlet -> (checked_at, seconds behind or None if unusable)
+_routing_lock = threading.Lock()
+_routing_stats = {'replica_reads': 0, 'fallback_recent_write': 0, 'fallback_lag': 0, 'fallback_unavailable': 0}
+
+def routed(route):
+    """Tags a data function with its route and sends its db_connection() calls that way.
+
+    Each call is also timed for the instrumentation metrics, together with whether
+    it raised or returned an error message. Generator functions run their body
+    after the call returns, so they are only tagged and must pass route= to
+    db_connection() themselves.
+    """
+    if route not in ROUTES:
+        raise ValueError(f"Unknown route '{route}'")
+
+    def decorate(fn):
+        fn.route = route
+        if inspect.isgeneratorfunction(fn):
+            return fn
+
+        name = f"{fn.__module__}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            token = _route.set(route)
+            started = time.perf_counter()
+            outcome = 'exceptions'
+            try:
+                result = fn(*args, **kwargs)
+                outcome = call_outcome(result)
+                return result
+            finally:
+                metrics.record_call(name, time.perf_counter() - started, outcome)
+                _route.reset(token)
+                if route == 'primary':
+                    with _routing_lock: _last_write[current_outlet()] = time.monotonic()
+        return wrapper
+    return decorate
+
+def _acquire(pool):
+    started = time.perf_counter()
+    conn = pool.acquire()
+    metrics.record_acquire(f"{pool.outlet}/{'replica' if pool.replica else 'primary'}", time.perf_counter() - started, failed=conn is None)
+    return conn
+
+def _read_replica_lag(pool):
+    conn = _acquire(pool)
+    if conn is None: return None
+    discard = False
     try:
         with conn.cursor() as cursor:
-            password_hash = hashlib.sha256(details['password'].encode()).hexdigest()
-            sql_user = "INSERT INTO user_account (username, password_hash) VALUES (%s, %s)"
-            cursor.execute(sql_user, (details['username'], password_hash))
-            user_id = cursor.lastrowid
-            sql_employee = "INSERT INTO employee (fname, lname, email, role, uid) VALUES (%s, %s, %s, %s, %s)"
-            cursor.execute(sql_employee, (details['fname'], details['lname'], details['email'], details['role'], user_id))
-            conn.commit()
-        return "Employee added successfully!"
-    except pymysql.IntegrityError as e:
-        conn.rollback()
-        if 'username' in str(e): return "Error: This username is already taken."
-        if 'email' in str(e): return "Error: This email address is already in use."
-        return f"Database Error: {e}"
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except pymysql.ProgrammingError:
+                cursor.execute("SHOW SLAVE STATUS")  # MySQL before 8.0.22
+            status = cursor.fetchone()
+        if status is None:
+            return 0  # a stand-in that is not replicating (e.g. a local test copy) counts as current
+        lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+        return lag  # NULL (None): replication is stopped
+    except pymysql.Error:
+        discard = True
+        return None  # unreachable, or the account lacks REPLICATION CLIENT
     finally:
-        if conn: conn.close()
+        pool.release(conn, discard)
 
-def update_employee(emp_id, details):
-    conn = connect_db()
-    if not conn: return "Database connection failed."
+def _replica_usable(outlet):
+    with _routing_lock:
+        checked = _replica_lag.get(outlet)
+    if checked is None or time.monotonic() - checked[0] > REPLICA_LAG_CHECK_SECONDS:
+        checked = (time.monotonic(), _read_replica_lag(_replica_pools[outlet]))
+        with _routing_lock: _replica_lag[outlet] = checked
+    return checked[1] is not None and checked[1] <= REPLICA_MAX_LAG, checked[1]
+
+def _choose_pool(outlet, route):
+    if route != 'replica' or outlet not in _replica_pools:
+        return _pools[outlet]
+    with _routing_lock:
+        recent_write = time.monotonic() - _last_write.get(outlet, -REPLICA_MAX_LAG) < REPLICA_MAX_LAG
+    if recent_write:
+        reason = 'fallback_recent_write'
+    else:
+        usable, lag = _replica_usable(outlet)
+        if usable:
+            with _routing_lock: _routing_stats['replica_reads'] += 1
+            return _replica_pools[outlet]
+        reason = 'fallback_unavailable' if lag is None else 'fallback_lag'
+    with _routing_lock: _routing_stats[reason] += 1
+    return _pools[outlet]
+
+def get_routing_stats():
+    """Returns replica reads, primary fallbacks by reason and the last measured lag per outlet"""
+    with _routing_lock:
+        return {**_routing_stats, 'replica_lag': {outlet: lag for outlet, (_, lag) in _replica_lag.items()}}
+
+@contextmanager
+def db_connection(outlet=None, route=None):
+    """Checks a connection out of an outlet's pool for the duration of a with-block (yields None if unavailable).
+
+    route defaults to that of the @routed function being run, or 'primary'.
+    """
+    outlet = outlet or current_outlet()
+    pool = _choose_pool(outlet, route or _route.get())
+    conn = _acquire(pool)
+    if conn is None and pool.replica:
+        with _routing_lock:
+            _replica_lag[outlet] = (time.monotonic(), None)
+            _routing_stats['fallback_unavailable'] += 1
+        pool = _pools[outlet]
+        conn = _acquire(pool)
+    discard = False
     try:
-        with conn.cursor() as cursor:
-            sql = "UPDATE employee SET fname = %s, lname = %s, email = %s, role = %s WHERE id = %s"
-            cursor.execute(sql, (details['fname'], details['lname'], details['email'], details['role'], emp_id))
-            conn.commit()
-        return "Employee updated successfully!"
-    except pymysql.IntegrityError:
-        conn.rollback()
-        return "Error: The email address may already be in use by another employee."
+        yield conn
+    except (pymysql.OperationalError, pymysql.InterfaceError):
+        discard = True
+        raise
     finally:
-        if conn: conn.close()
+        if conn:
+            pool.release(conn, discard)
 
-def delete_employee(emp_id):
-    conn = connect_db()
-    if not conn: return "Database connection failed."
+@contextmanager
+def dedicated_connection(outlet=None, route=None):
+    """Like db_connection(), but opens a fresh connection outside the pool and closes it afterwards.
+
+    For long streams and SET SESSION changes that must not hold a pool slot or
+    leak to the next user of a pooled connection. Yields None if unavailable.
+    """
+    outlet = outlet or current_outlet()
+    replica = _choose_pool(outlet, route or _route.get()).replica
+    conn = connect_db(outlet, replica)
+    if conn is None and replica:
+        conn = connect_db(outlet)
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT uid FROM employee WHERE id = %s", (emp_id,))
-            result = cursor.fetchone()
-            if not result: return "Error: Employee not found."
-            user_id = result['uid']
-            cursor.execute("DELETE FROM employee WHERE id = %s", (emp_id,))
-            if user_id:
-                cursor.execute("DELETE FROM user_account WHERE uid = %s", (user_id,))
-            conn.commit()
-        return "Employee deleted successfully!"
-    except Exception as e:
-        conn.rollback()
-        return f"An error occurred: {e}"
+        yield conn
     finally:
-        if conn: conn.close()
+        if conn:
+            ConnectionPool._close(conn)
+
+def fan_out(fn, *args, outlets=None):
+    """Runs fn(*args) once per outlet in parallel, each routed to its own outlet.
+
+    Returns {outlet: result}; an outlet whose call raised maps to the exception.
+    """
+    outlets = list(outlets or OUTLETS)
+
+    def run(outlet):
+        with use_outlet(outlet):
+            return fn(*args)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=min(FAN_OUT_WORKERS, len(outlets))) as executor:
+        # Each worker runs in a copy of the caller's context, so the caller's route carries over
+        futures = {outlet: executor.submit(copy_context().run, run, outlet) for outlet in outlets}
+        for outlet, future in futures.items():
+            try:
+                results[outlet] = future.result()
+            except Exception as e:
+                results[outlet] = e
+    return results
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+# --- Change Feed ---
+# change_log holds one monotonically increasing version per topic. Writers bump it
+# inside their own transaction; the live dashboard polls it to see what changed.
+
+CHANGE_TOPICS = ('sales', 'stock', 'recipes')
+
+def _bump_change_log(cursor, *topics):
+    sql = f"""
+    INSERT INTO change_log (topic, version) VALUES {', '.join(['(%s, 1)'] * len(topics))}
+    ON DUPLICATE KEY UPDATE version = version + 1
+    """
+    cursor.execute(sql, topics)
+
+@routed('replica')
+def get_change_versions():
+    """Fetches the current version of every change-log topic"""
+    with db_connection() as conn:
+        if not conn: return {}
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT topic, version FROM change_log")
+            return {row['topic']: row['version'] for row in cursor.fetchall()}
+
+# --- Employee Management Functions ---
+
+@routed('replica')
+def get_all_employees():
+    with db_connection() as conn:
+        if not conn: return []
+        with conn.cursor() as cursor:
+            sql = "SELECT e.id, e.fname, e.lname, e.role, e.email, u.username FROM employee e LEFT JOIN user_account u ON e.uid = u.uid ORDER BY e.id"
+            cursor.execute(sql)
+            return cursor.fetchall()
+
+
+@routed('replica')
+def get_employees_page(after_id=None, limit=100):
+    """Fetches up to `limit` employees with an id greater than after_id (keyset pagination)"""
+    with db_connection() as conn:
+        if not conn: return []
+        with conn.cursor() as cursor:
+            sql = "SELECT e.id, e.fname, e.lname, e.role, e.email, u.username FROM employee e LEFT JOIN user_account u ON e.uid = u.uid WHERE e.id > %s ORDER BY e.id LIMIT %s"
+            cursor.execute(sql, (after_id or 0, limit))
+            return cursor.fetchall()
+
+@routed('primary')
+def add_employee(details):
+    from auth import hash_password  # auth imports this module
+    with db_connection() as conn:
+        if not conn: return "Database connection failed."
+        try:
+            with conn.cursor() as cursor:
+                password_hash = hash_password(details['password'])
+                sql_user = "INSERT INTO user_account (username, password_hash) VALUES (%s, %s)"
+                cursor.execute(sql_user, (details['username'], password_hash))
+                user_id = cursor.lastrowid
+                sql_employee = "INSERT INTO employee (fname, lname, email, role, uid) VALUES (%s, %s, %s, %s, %s)"
+                cursor.execute(sql_employee, (details['fname'], details['lname'], details['email'], details['role'], user_id))
+                conn.commit()
+            return "Employee added successfully!"
+        except pymysql.IntegrityError as e:
+            conn.rollback()
+            if 'username' in str(e): return "Error: This username is already taken."
+            if 'email' in str(e): return "Error: This email address is already in use."
+            return f"Database Error: {e}"
+
+def _close_employee_sessions(emp_id):
+    from auth import forget_employee  # auth imports this module
+    forget_employee(int(emp_id), current_outlet())
+
+@routed('primary')
+def update_employee(emp_id, details):
+    with db_connection() as conn:
+        if not conn: return "Database connection failed."
+        try:
+            with conn.cursor() as cursor:
+                sql = "UPDATE employee SET fname = %s, lname = %s, email = %s, role = %s WHERE id = %s"
+                cursor.execute(sql, (details['fname'], details['lname'], details['email'], details['role'], emp_id))
+                conn.commit()
+            _close_employee_sessions(emp_id)  # the new role applies from the next login
+            return "Employee updated successfully!"
+        except pymysql.IntegrityError:
+            conn.rollback()
+            return "Error: The email address may already be in use by another employee."
+
+@routed('primary')
+def delete_employee(emp_id):
+    with db_connection() as conn:
+        if not conn: return "Database connection failed."
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT uid FROM employee WHERE id = %s", (emp_id,))
+                result = cursor.fetchone()
+                if not result: return "Error: Employee not found."
+                user_id = result['uid']
+                cursor.execute("DELETE FROM employee WHERE id = %s", (emp_id,))
+                if user_id:
+                    cursor.execute("DELETE FROM user_account WHERE uid = %s", (user_id,))
+                conn.commit()
+            _close_employee_sessions(emp_id)
+            return "Employee deleted successfully!"
+        except Exception as e:
+            conn.rollback()
+            return f"An error occurred: {e}"
 
 # --- Inventory & Supplier Management Functions ---
 
+@routed('replica')
 def get_all_ingredient_types():
-    conn = connect_db()
-    if not conn: return []
-    try:
+    with db_connection() as conn:
+        if not conn: return []
         with conn.cursor() as cursor:
             sql = "SELECT ingredient_id, ingredient_name, unit, total_stock, reorder_level FROM current_inventory_view"
             cursor.execute(sql)
             return cursor.fetchall()
-    finally:
-        if conn: conn.close()
 
-def add_ingredient_type(details):
-    conn = connect_db()
-    if not conn: return "Database connection failed."
-    try:
+
+@routed('replica')
+def get_ingredient_types_page(after_id=None, limit=100):
+    """Fetches up to `limit` ingredients with their stock, ordered by id (keyset pagination)"""
+    with db_connection() as conn:
+        if not conn: return []
         with conn.cursor() as cursor:
-            sql = "INSERT INTO ingredients (name, unit, reorder_level) VALUES (%s, %s, %s)"
-            cursor.execute(sql, (details['name'], details['unit'], details['reorder_level']))
-            conn.commit()
-        return "Ingredient type added successfully!"
-    except pymysql.IntegrityError:
-        conn.rollback()
-        return "Error: An ingredient with this name already exists."
-    except Exception as e:
-        conn.rollback()
-        return f"An unexpected error occurred: {e}"
-    finally:
-        if conn: conn.close()
+            sql = "SELECT ingredient_id, ingredient_name, unit, total_stock, reorder_level FROM current_inventory_view WHERE ingredient_id > %s ORDER BY ingredient_id LIMIT %s"
+            cursor.execute(sql, (after_id or 0, limit))
+            return cursor.fetchall()
 
+@routed('primary')
+def add_ingredient_type(details):
+    with db_connection() as conn:
+        if not conn: return "Database connection failed."
+        try:
+            with conn.cursor() as cursor:
+                sql = "INSERT INTO ingredients (name, unit, reorder_level) VALUES (%s, %s, %s)"
+                cursor.execute(sql, (details['name'], details['unit'], details['reorder_level']))
+                conn.commit()
+            return "Ingredient type added successfully!"
+        except pymysql.IntegrityError:
+            conn.rollback()
+            return "Error: An ingredient with this name already exists."
+        except Exception as e:
+            conn.rollback()
+            return f"An unexpected error occurred: {e}"
+
+@routed('replica')
 def get_all_suppliers():
-    conn = connect_db()
-    if not conn: return []
-    try:
+    with db_connection() as conn:
+        if not conn: return []
         with conn.cursor() as cursor:
             cursor.execute("SELECT id, name, email, phone FROM supplier")
             return cursor.fetchall()
-    finally:
-        if conn: conn.close()
 
+
+@routed('replica')
+def get_suppliers_page(after_id=None, limit=100):
+    """Fetches up to `limit` suppliers ordered by id (keyset pagination)"""
+    with db_connection() as conn:
+        if not conn: return []
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id, name, email, phone FROM supplier WHERE id > %s ORDER BY id LIMIT %s", (after_id or 0, limit))
+            return cursor.fetchall()
+
+@routed('replica')
 def get_batches_for_ingredient(ingredient_id):
-    conn = connect_db()
-    if not conn: return []
-    try:
+    with db_connection() as conn:
+        if not conn: return []
         with conn.cursor() as cursor:
             sql = """
             SELECT ib.id, s.name as supplier_name, ib.quantity_received, ib.quantity_remaining, 
@@ -142,135 +608,467 @@ def get_batches_for_ingredient(ingredient_id):
             """
             cursor.execute(sql, (ingredient_id,))
             return cursor.fetchall()
-    finally:
-        if conn: conn.close()
 
-def add_ingredient_batch(details):
-    conn = connect_db()
-    if not conn: return "Database connection failed."
-    try:
+
+def batches_page_sql(include_depleted=False, paged=False):
+    """SQL of get_batches_page (params: ingredient_id, [expiry, expiry, id,] limit)"""
+    sql = """
+    SELECT ib.id, s.name as supplier_name, ib.quantity_received, ib.quantity_remaining,
+           ib.cost_per_unit, ib.received_date, ib.expiry_date
+    FROM ingredient_batches ib
+    LEFT JOIN supplier s ON ib.supplier_id = s.id
+    WHERE ib.ingredient_id = %s
+    """
+    if not include_depleted:
+        sql += " AND ib.quantity_remaining > 0"
+    if paged:
+        sql += " AND (ib.expiry_date > %s OR (ib.expiry_date = %s AND ib.id > %s))"
+    return sql + " ORDER BY ib.expiry_date ASC, ib.id ASC LIMIT %s"
+
+@routed('replica')
+def get_batches_page(ingredient_id, include_depleted=False, after=None, limit=100):
+    """Fetches one page of an ingredient's batches, soonest expiry first.
+
+    `after` is the (expiry_date, id) of the last batch on the previous page.
+    Depleted batches are skipped unless include_depleted is set.
+    """
+    with db_connection() as conn:
+        if not conn: return []
         with conn.cursor() as cursor:
-            sql = """
-            INSERT INTO ingredient_batches 
-            (ingredient_id, supplier_id, quantity_received, quantity_remaining, cost_per_unit, received_date, expiry_date)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(sql, (
-                details['ingredient_id'], details['supplier_id'], details['quantity'],
-                details['quantity'], details['cost_per_unit'], date.today(), details['expiry_date']
-            ))
+            params = [ingredient_id]
+            if after is not None:
+                params += [after[0], after[0], after[1]]
+            cursor.execute(batches_page_sql(include_depleted, after is not None), params + [limit])
+            return cursor.fetchall()
+
+@routed('primary')
+def add_ingredient_batch(details):
+    with db_connection() as conn:
+        if not conn: return "Database connection failed."
+        try:
+            with conn.cursor() as cursor:
+                sql = """
+                INSERT INTO ingredient_batches 
+                (ingredient_id, supplier_id, quantity_received, quantity_remaining, cost_per_unit, received_date, expiry_date)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """
+                cursor.execute(sql, (
+                    details['ingredient_id'], details['supplier_id'], details['quantity'],
+                    details['quantity'], details['cost_per_unit'], date.today(), details['expiry_date']
+                ))
+                sql_stock = """
+                INSERT INTO ingredient_stock (ingredient_id, total_stock) VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE total_stock = total_stock + VALUES(total_stock)
+                """
+                cursor.execute(sql_stock, (details['ingredient_id'], details['quantity']))
+                _bump_change_log(cursor, 'stock')
+                conn.commit()
+            return "Delivery recorded successfully!"
+        except Exception as e:
+            conn.rollback()
+            return f"An unexpected error occurred: {e}"
+
+@routed('primary')
+def reconcile_ingredient_stock(apply=True):
+    """Compares ingredient_stock with the batch totals and, if apply is set, rebuilds it.
+
+    Returns a list of drifted rows (ingredient_id, name, recorded, actual), or None
+    if the database is unreachable.
+    """
+    with db_connection() as conn:
+        if not conn: return None
+        try:
+            with conn.cursor() as cursor:
+                sql = """
+                SELECT i.id AS ingredient_id, i.name, COALESCE(s.total_stock, 0) AS recorded,
+                       COALESCE(b.actual, 0) AS actual
+                FROM ingredients i
+                LEFT JOIN ingredient_stock s ON s.ingredient_id = i.id
+                LEFT JOIN (SELECT ingredient_id, SUM(quantity_remaining) AS actual
+                           FROM ingredient_batches GROUP BY ingredient_id) b ON b.ingredient_id = i.id
+                WHERE COALESCE(s.total_stock, 0) <> COALESCE(b.actual, 0)
+                ORDER BY i.id
+                """
+                cursor.execute(sql)
+                drift = cursor.fetchall()
+                if apply and drift:
+                    sql_rebuild = """
+                    INSERT INTO ingredient_stock (ingredient_id, total_stock)
+                    SELECT i.id, COALESCE(SUM(ib.quantity_remaining), 0)
+                    FROM ingredients i
+                    LEFT JOIN ingredient_batches ib ON ib.ingredient_id = i.id
+                    GROUP BY i.id
+                    ON DUPLICATE KEY UPDATE total_stock = VALUES(total_stock)
+                    """
+                    cursor.execute(sql_rebuild)
             conn.commit()
-        return "Delivery recorded successfully!"
-    except Exception as e:
-        conn.rollback()
-        return f"An unexpected error occurred: {e}"
-    finally:
-        if conn: conn.close()
+            return drift
+        except pymysql.Error:
+            conn.rollback()
+            raise
 
+@routed('primary')
 def add_supplier(details):
-    conn = connect_db()
-    if not conn: return "Database connection failed."
-    try:
-        with conn.cursor() as cursor:
-            sql = "INSERT INTO supplier (name, email, phone) VALUES (%s, %s, %s)"
-            cursor.execute(sql, (details['name'], details['email'], details['phone']))
-            conn.commit()
-        return "Supplier added successfully!"
-    except pymysql.IntegrityError:
-        conn.rollback()
-        return "Error: A supplier with this name or email may already exist."
-    finally:
-        if conn: conn.close()
+    with db_connection() as conn:
+        if not conn: return "Database connection failed."
+        try:
+            with conn.cursor() as cursor:
+                sql = "INSERT INTO supplier (name, email, phone) VALUES (%s, %s, %s)"
+                cursor.execute(sql, (details['name'], details['email'], details['phone']))
+                conn.commit()
+            return "Supplier added successfully!"
+        except pymysql.IntegrityError:
+            conn.rollback()
+            return "Error: A supplier with this name or email may already exist."
 
+@routed('primary')
 def update_supplier(supplier_id, details):
-    conn = connect_db()
-    if not conn: return "Database connection failed."
-    try:
-        with conn.cursor() as cursor:
-            sql = "UPDATE supplier SET name = %s, email = %s, phone = %s WHERE id = %s"
-            cursor.execute(sql, (details['name'], details['email'], details['phone'], supplier_id))
-            conn.commit()
-        return "Supplier updated successfully!"
-    except pymysql.IntegrityError:
-        conn.rollback()
-        return "Error: The email may already be in use by another supplier."
-    finally:
-        if conn: conn.close()
+    with db_connection() as conn:
+        if not conn: return "Database connection failed."
+        try:
+            with conn.cursor() as cursor:
+                sql = "UPDATE supplier SET name = %s, email = %s, phone = %s WHERE id = %s"
+                cursor.execute(sql, (details['name'], details['email'], details['phone'], supplier_id))
+                conn.commit()
+            return "Supplier updated successfully!"
+        except pymysql.IntegrityError:
+            conn.rollback()
+            return "Error: The email may already be in use by another supplier."
 
+@routed('primary')
 def delete_supplier(supplier_id):
-    conn = connect_db()
-    if not conn: return "Database connection failed."
-    try:
+    with db_connection() as conn:
+        if not conn: return "Database connection failed."
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM supplier WHERE id = %s", (supplier_id,))
+                conn.commit()
+            return "Supplier deleted successfully!"
+        except Exception as e:
+            conn.rollback()
+            return f"An error occurred: {e}"
+
+# --- Batch Expiry Index ---
+# All non-depleted batches held in memory, sorted by expiry date, so "what expires
+# in the next N days", value at risk and expired stock are answered with a bisect
+# instead of a query. The index reloads as soon as the 'stock' change-log version
+# moves; only a further change within BATCH_INDEX_DEBOUNCE_SECONDS of such a reload
+# waits, so a rush of sales costs one reload per window instead of one per sale.
+
+BATCH_INDEX_DEBOUNCE_SECONDS = 5
+
+class BatchExpiryIndex:
+    """Non-depleted batches ordered by (expiry_date, id)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []      # sorted (expiry_date, batch_id)
+        self._batches = {}   # batch_id -> batch row
+        self._version = None
+        self._loaded_at = None
+        self._changed_at = None  # when the last reload caused by a version change happened
+        self.stats = {'reloads': 0, 'lookups': 0}
+
+    def is_stale(self, version):
+        with self._lock:
+            if self._loaded_at is None: return True
+            if version == self._version: return False
+            return self._changed_at is None or time.monotonic() - self._changed_at >= BATCH_INDEX_DEBOUNCE_SECONDS
+
+    def load(self, rows, version):
+        keys = sorted((row['expiry_date'], row['id']) for row in rows)
+        batches = {row['id']: row for row in rows}
+        with self._lock:
+            if self._loaded_at is not None and version != self._version:
+                self._changed_at = time.monotonic()
+            self._keys, self._batches, self._version = keys, batches, version
+            self._loaded_at = time.monotonic()
+            self.stats['reloads'] += 1
+
+    def between(self, start=None, end=None):
+        """Batches with start <= expiry_date < end, soonest first (either bound may be None)"""
+        with self._lock:
+            self.stats['lookups'] += 1
+            lo = bisect.bisect_left(self._keys, (start,)) if start else 0
+            hi = bisect.bisect_left(self._keys, (end,)) if end else len(self._keys)
+            return [self._batches[batch_id] for _, batch_id in self._keys[lo:hi]]
+
+    def expired(self, today=None):
+        """Batches past their expiry date that still have stock"""
+        return self.between(end=today or date.today())
+
+    def expiring_within(self, days, today=None):
+        today = today or date.today()
+        return self.between(today, today + timedelta(days=days + 1))
+
+    @staticmethod
+    def value(batches):
+        return sum((b['quantity_remaining'] * b['cost_per_unit'] for b in batches), Decimal(0))
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, 'batches': len(self._keys)}
+
+_batch_index = PerOutlet(BatchExpiryIndex)
+
+@routed('replica')
+def get_batch_index():
+    """Returns the expiry index, reloading it first if stock has changed since it was built"""
+    version = get_change_versions().get('stock')
+    if _batch_index.is_stale(version):
+        with db_connection() as conn:
+            if not conn: return _batch_index.get()
+            with conn.cursor() as cursor:
+                sql = """
+                SELECT ib.id, ib.ingredient_id, i.name AS ingredient_name, i.unit, s.name AS supplier_name,
+                       ib.quantity_remaining, ib.cost_per_unit, ib.expiry_date
+                FROM ingredient_batches ib
+                JOIN ingredients i ON ib.ingredient_id = i.id
+                LEFT JOIN supplier s ON ib.supplier_id = s.id
+                WHERE ib.quantity_remaining > 0
+                """
+                cursor.execute(sql)
+                _batch_index.load(cursor.fetchall(), version)
+    return _batch_index.get()
+
+@routed('replica')
+def get_expiry_summary(days=7):
+    """Counts and values of batches expiring within N days and of expired batches still on hand"""
+    index = get_batch_index()
+    at_risk = index.expiring_within(days)
+    expired = index.expired()
+    return {
+        "days": days,
+        "at_risk_batches": len(at_risk), "value_at_risk": index.value(at_risk),
+        "expired_batches": len(expired), "expired_value": index.value(expired),
+    }
+
+EXPIRED_BATCHES_SQL = """
+SELECT id, ingredient_id, quantity_remaining, cost_per_unit
+FROM ingredient_batches
+WHERE expiry_date < CURDATE() AND quantity_remaining > 0
+ORDER BY ingredient_id, expiry_date, id
+FOR UPDATE
+"""
+
+@routed('primary')
+def write_off_expired_batches():
+    """Moves the remaining stock of every expired batch into waste_log and out of stock"""
+    with db_connection() as conn:
+        if not conn: return "Database connection failed."
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(EXPIRED_BATCHES_SQL)
+                expired = cursor.fetchall()
+                if not expired:
+                    conn.commit()
+                    return "No expired stock to write off."
+                sql_log = "INSERT INTO waste_log (batch_id, ingredient_id, quantity, cost_per_unit, reason) VALUES (%s, %s, %s, %s, 'expired')"
+                cursor.executemany(sql_log, [(b['id'], b['ingredient_id'], b['quantity_remaining'], b['cost_per_unit']) for b in expired])
+                _write_batch_quantities(cursor, {b['id']: 0 for b in expired})
+                wasted = {}
+                for b in expired:
+                    wasted[b['ingredient_id']] = wasted.get(b['ingredient_id'], Decimal(0)) + b['quantity_remaining']
+                _deduct_ingredient_stock(cursor, wasted)
+                _bump_change_log(cursor, 'stock')
+                conn.commit()
+            value = BatchExpiryIndex.value(expired)
+            return f"Wrote off {len(expired)} expired batch(es) worth ₹{value:.2f} successfully!"
+        except pymysql.Error as e:
+            conn.rollback()
+            return f"An unexpected error occurred: {e}"
+
+# --- Recipe Cache ---
+# Recipe lines for the dishes in an order, loaded on a miss and kept until a recipe
+# write bumps the 'recipes' change-log version, which every sale checks first.
+
+class RecipeCache:
+    """In-memory map of dish_id -> [(ingredient_id, quantity_needed), ...]."""
+
+    def __init__(self):
+        self._recipes = {}
+        self._ingredient_names = {}
+        self._generation = 0  # bumped on every invalidation so stale loads are not stored
+        self._version = None  # the 'recipes' change-log version the cached lines belong to
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get_many(self, dish_ids):
+        """Returns (found, missing) where found maps dish_id to its recipe lines."""
+        found, missing = {}, []
+        with self._lock:
+            for dish_id in dish_ids:
+                lines = self._recipes.get(dish_id)
+                if lines is None:
+                    missing.append(dish_id)
+                else:
+                    found[dish_id] = lines
+            self.stats['hits'] += len(found)
+            self.stats['misses'] += len(missing)
+            return found, missing
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def sync(self, version):
+        """Drops every cached recipe if the 'recipes' version moved (a recipe changed, possibly in another process)"""
+        with self._lock:
+            if version != self._version:
+                self._generation += 1
+                self._recipes.clear()
+                self._version = version
+
+    def store(self, rows, dish_ids, generation):
+        """Caches recipe rows loaded for dish_ids, unless an invalidation happened meanwhile.
+
+        Dishes without recipe lines are returned but not cached, so lines added later are seen.
+        """
+        recipes = {dish_id: [] for dish_id in dish_ids}
+        names = {}
+        for row in rows:
+            recipes.setdefault(row['dish_id'], []).append((row['ingredient_id'], row['quantity_needed']))
+            names[row['ingredient_id']] = row['name']
+        with self._lock:
+            if generation != self._generation:
+                return recipes
+            self._recipes.update((dish_id, lines) for dish_id, lines in recipes.items() if lines)
+            self._ingredient_names.update(names)
+        return recipes
+
+    def ingredient_name(self, ingredient_id):
+        with self._lock:
+            return self._ingredient_names.get(ingredient_id, f"ID {ingredient_id}")
+
+    def invalidate(self, dish_id):
+        with self._lock:
+            self._generation += 1
+            self.stats['invalidations'] += 1
+            self._recipes.pop(dish_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._recipes.clear()
+            self._ingredient_names.clear()
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, 'dishes_cached': len(self._recipes)}
+
+_recipe_cache = PerOutlet(RecipeCache)
+
+RECIPE_LINES_SQL = """
+SELECT r.dish_id, r.ingredient_id, r.quantity_needed, i.name
+FROM recipe r
+JOIN ingredients i ON r.ingredient_id = i.id
+"""
+
+def _sync_recipe_cache(cursor):
+    cursor.execute("SELECT version FROM change_log WHERE topic = 'recipes'")
+    row = cursor.fetchone()
+    _recipe_cache.sync(row['version'] if row else 0)
+
+@routed('primary')
+def warm_recipe_cache(outlet=None):
+    """Loads every recipe of an outlet (default: the current one) into the cache with a single scan of the recipe table"""
+    with use_outlet(outlet or current_outlet()), db_connection() as conn:
+        if not conn: return False
         with conn.cursor() as cursor:
-            cursor.execute("DELETE FROM supplier WHERE id = %s", (supplier_id,))
-            conn.commit()
-        return "Supplier deleted successfully!"
-    except Exception as e:
-        conn.rollback()
-        return f"An error occurred: {e}"
-    finally:
-        if conn: conn.close()
+            _sync_recipe_cache(cursor)
+            generation = _recipe_cache.generation()
+            cursor.execute(RECIPE_LINES_SQL)
+            _recipe_cache.store(cursor.fetchall(), [], generation)
+        return True
+
+def get_order_recipes(cursor, dish_ids):
+    """Returns recipe lines for the given dishes, querying only for cache misses"""
+    _sync_recipe_cache(cursor)
+    recipes, missing = _recipe_cache.get_many(dish_ids)
+    if missing:
+        generation = _recipe_cache.generation()
+        cursor.execute(RECIPE_LINES_SQL + f"WHERE r.dish_id IN ({_placeholders(missing)})", missing)
+        recipes.update(_recipe_cache.store(cursor.fetchall(), missing, generation))
+    return recipes
+
+def get_recipe_cache_stats():
+    """Returns recipe cache hit, miss and invalidation counters"""
+    return _recipe_cache.get_stats()
+
+def _dish_for_recipe_line(cursor, recipe_id):
+    cursor.execute("SELECT dish_id FROM recipe WHERE id = %s", (recipe_id,))
+    result = cursor.fetchone()
+    return result['dish_id'] if result else None
 
 # --- Dish & Recipe Management Functions ---
 
+@routed('replica')
 def get_all_dishes():
-    conn = connect_db()
-    if not conn: return []
-    try:
+    with db_connection() as conn:
+        if not conn: return []
         with conn.cursor() as cursor:
             cursor.execute("SELECT id, dname, price, category FROM dish ORDER BY dname")
             return cursor.fetchall()
-    finally:
-        if conn: conn.close()
 
-def add_dish(details):
-    conn = connect_db()
-    if not conn: return "Database connection failed."
-    try:
+
+DISHES_PAGE_SQL = "SELECT id, dname, price, category FROM dish WHERE dname > %s ORDER BY dname LIMIT %s"
+
+@routed('replica')
+def get_dishes_page(after_name=None, limit=100):
+    """Fetches up to `limit` dishes ordered by name, starting after after_name (keyset pagination)"""
+    with db_connection() as conn:
+        if not conn: return []
         with conn.cursor() as cursor:
-            sql = "INSERT INTO dish (dname, price, category) VALUES (%s, %s, %s)"
-            cursor.execute(sql, (details['dname'], details['price'], details['category']))
-            conn.commit()
-        return "Dish added successfully!"
-    except pymysql.IntegrityError:
-        conn.rollback()
-        return "Error: A dish with this name already exists."
-    finally:
-        if conn: conn.close()
+            cursor.execute(DISHES_PAGE_SQL, (after_name or '', limit))
+            return cursor.fetchall()
+
+@routed('primary')
+def add_dish(details):
+    with db_connection() as conn:
+        if not conn: return "Database connection failed."
+        try:
+            with conn.cursor() as cursor:
+                sql = "INSERT INTO dish (dname, price, category) VALUES (%s, %s, %s)"
+                cursor.execute(sql, (details['dname'], details['price'], details['category']))
+                conn.commit()
+            return "Dish added successfully!"
+        except pymysql.IntegrityError:
+            conn.rollback()
+            return "Error: A dish with this name already exists."
 
+@routed('primary')
 def update_dish(dish_id, details):
-    conn = connect_db()
-    if not conn: return "Database connection failed."
-    try:
-        with conn.cursor() as cursor:
-            sql = "UPDATE dish SET dname = %s, price = %s, category = %s WHERE id = %s"
-            cursor.execute(sql, (details['dname'], details['price'], details['category'], dish_id))
-            conn.commit()
-        return "Dish updated successfully!"
-    except pymysql.IntegrityError:
-        conn.rollback()
-        return "Error: A dish with this name may already exist."
-    finally:
-        if conn: conn.close()
+    with db_connection() as conn:
+        if not conn: return "Database connection failed."
+        try:
+            with conn.cursor() as cursor:
+                sql = "UPDATE dish SET dname = %s, price = %s, category = %s WHERE id = %s"
+                cursor.execute(sql, (details['dname'], details['price'], details['category'], dish_id))
+                conn.commit()
+            return "Dish updated successfully!"
+        except pymysql.IntegrityError:
+            conn.rollback()
+            return "Error: A dish with this name may already exist."
 
+@routed('primary')
 def delete_dish(dish_id):
-    conn = connect_db()
-    if not conn: return "Database connection failed."
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("DELETE FROM dish WHERE id = %s", (dish_id,))
-            conn.commit()
-        return "Dish deleted successfully!"
-    except Exception as e:
-        conn.rollback()
-        return f"An error occurred: {e}"
-    finally:
-        if conn: conn.close()
+    with db_connection() as conn:
+        if not conn: return "Database connection failed."
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM dish WHERE id = %s", (dish_id,))
+                _bump_change_log(cursor, 'recipes')
+                conn.commit()
+            _recipe_cache.invalidate(dish_id)
+            return "Dish deleted successfully!"
+        except Exception as e:
+            conn.rollback()
+            return f"An error occurred: {e}"
 
+@routed('replica')
 def get_recipe_for_dish(dish_id):
-    conn = connect_db()
-    if not conn: return []
-    try:
+    with db_connection() as conn:
+        if not conn: return []
         with conn.cursor() as cursor:
             sql = """
             SELECT r.id, i.id as ingredient_id, i.name, r.quantity_needed, i.unit 
@@ -280,195 +1078,533 @@ def get_recipe_for_dish(dish_id):
             """
             cursor.execute(sql, (dish_id,))
             return cursor.fetchall()
-    finally:
-        if conn: conn.close()
 
+RECIPE_LINE_EXISTS_SQL = "SELECT id FROM recipe WHERE dish_id = %s AND ingredient_id = %s"
+
+@routed('primary')
 def add_ingredient_to_recipe(details):
-    conn = connect_db()
-    if not conn: return "Database connection failed."
-    try:
-        with conn.cursor() as cursor:
-            sql_check = "SELECT id FROM recipe WHERE dish_id = %s AND ingredient_id = %s"
-            cursor.execute(sql_check, (details['dish_id'], details['ingredient_id']))
-            if cursor.fetchone():
-                return "Error: This ingredient is already in the recipe. Update it instead."
-            sql = "INSERT INTO recipe (dish_id, ingredient_id, quantity_needed) VALUES (%s, %s, %s)"
-            cursor.execute(sql, (details['dish_id'], details['ingredient_id'], details['quantity']))
-            conn.commit()
-        return "Ingredient added to recipe successfully!"
-    except Exception as e:
-        conn.rollback()
-        return f"An unexpected error occurred: {e}"
-    finally:
-        if conn: conn.close()
+    with db_connection() as conn:
+        if not conn: return "Database connection failed."
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(RECIPE_LINE_EXISTS_SQL, (details['dish_id'], details['ingredient_id']))
+                if cursor.fetchone():
+                    return "Error: This ingredient is already in the recipe. Update it instead."
+                sql = "INSERT INTO recipe (dish_id, ingredient_id, quantity_needed) VALUES (%s, %s, %s)"
+                cursor.execute(sql, (details['dish_id'], details['ingredient_id'], details['quantity']))
+                _bump_change_log(cursor, 'recipes')
+                conn.commit()
+            _recipe_cache.invalidate(details['dish_id'])
+            return "Ingredient added to recipe successfully!"
+        except Exception as e:
+            conn.rollback()
+            return f"An unexpected error occurred: {e}"
 
+@routed('primary')
 def update_recipe_ingredient(recipe_id, quantity):
-    conn = connect_db()
-    if not conn: return "Database connection failed."
-    try:
-        with conn.cursor() as cursor:
-            sql = "UPDATE recipe SET quantity_needed = %s WHERE id = %s"
-            cursor.execute(sql, (quantity, recipe_id))
-            conn.commit()
-        return "Recipe ingredient updated successfully!"
-    except Exception as e:
-        conn.rollback()
-        return f"An unexpected error occurred: {e}"
-    finally:
-        if conn: conn.close()
+    with db_connection() as conn:
+        if not conn: return "Database connection failed."
+        try:
+            with conn.cursor() as cursor:
+                dish_id = _dish_for_recipe_line(cursor, recipe_id)
+                sql = "UPDATE recipe SET quantity_needed = %s WHERE id = %s"
+                cursor.execute(sql, (quantity, recipe_id))
+                _bump_change_log(cursor, 'recipes')
+                conn.commit()
+            _recipe_cache.invalidate(dish_id)
+            return "Recipe ingredient updated successfully!"
+        except Exception as e:
+            conn.rollback()
+            return f"An unexpected error occurred: {e}"
 
+@routed('primary')
 def remove_ingredient_from_recipe(recipe_id):
-    conn = connect_db()
-    if not conn: return "Database connection failed."
-    try:
-        with conn.cursor() as cursor:
-            sql = "DELETE FROM recipe WHERE id = %s"
-            cursor.execute(sql, (recipe_id,))
-            conn.commit()
-        return "Ingredient removed from recipe successfully!"
-    except Exception as e:
-        conn.rollback()
-        return f"An unexpected error occurred: {e}"
-    finally:
-        if conn: conn.close()
+    with db_connection() as conn:
+        if not conn: return "Database connection failed."
+        try:
+            with conn.cursor() as cursor:
+                dish_id = _dish_for_recipe_line(cursor, recipe_id)
+                sql = "DELETE FROM recipe WHERE id = %s"
+                cursor.execute(sql, (recipe_id,))
+                _bump_change_log(cursor, 'recipes')
+                conn.commit()
+            _recipe_cache.invalidate(dish_id)
+            return "Ingredient removed from recipe successfully!"
+        except Exception as e:
+            conn.rollback()
+            return f"An unexpected error occurred: {e}"
 
+@routed('replica')
 def get_all_ingredient_names():
-    conn = connect_db()
-    if not conn: return []
-    try:
+    with db_connection() as conn:
+        if not conn: return []
         with conn.cursor() as cursor:
             cursor.execute("SELECT id, name FROM ingredients ORDER BY name")
             return cursor.fetchall()
-    finally:
-        if conn: conn.close()
 
-# --- Point-of-Sale Functions ---
+# --- POS Menu Index ---
+# The POS screen pages through one category at a time and searches as the waiter
+# types. Both run against this in-memory index, built once per menu load on a
+# worker thread: dishes grouped by category, a sorted word list for prefix
+# matches (bisect) and a trigram map for typos and fragments.
 
-def process_sale(waiter_id, order_items, total_amount):
-    conn = connect_db()
-    if not conn:
-        return "Database connection failed."
-    try:
+POS_UNCATEGORISED = "Other"
+POS_SEARCH_LIMIT = 24
+POS_FUZZY_MIN = 0.5   # share of the query's trigrams a dish name must contain to match fuzzily
+
+def _search_words(text):
+    return ' '.join(str(text).lower().split()).split()
+
+def _trigrams(words, pad_end=True):
+    grams = set()
+    for word in words:
+        padded = f"  {word} " if pad_end else f"  {word}"
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+class MenuIndex:
+    """Dishes by category with word-prefix and trigram search"""
+
+    def __init__(self, dishes):
+        self.all_dishes = list(dishes)  # already ordered by name
+        self.dishes = {d['id']: d for d in self.all_dishes}
+        self._by_category = {}
+        for dish in self.all_dishes:
+            self._by_category.setdefault(dish['category'] or POS_UNCATEGORISED, []).append(dish)
+        self.categories = sorted(self._by_category)
+        words = sorted((word, d['id']) for d in self.all_dishes for word in set(_search_words(d['dname'])))
+        self._word_keys = [word for word, _ in words]
+        self._word_ids = [dish_id for _, dish_id in words]
+        self._trigram_ids = {}
+        for dish in self.all_dishes:
+            for gram in _trigrams(_search_words(dish['dname'])):
+                self._trigram_ids.setdefault(gram, []).append(dish['id'])
+
+    def page(self, category=None, page=0, page_size=POS_SEARCH_LIMIT):
+        """Returns (dishes on the page, page number, page count) for a category (None: every dish)"""
+        dishes = self.all_dishes if category is None else self._by_category.get(category, [])
+        pages = max(1, math.ceil(len(dishes) / page_size))
+        page = min(max(page, 0), pages - 1)
+        return dishes[page * page_size:(page + 1) * page_size], page, pages
+
+    def _prefix_ids(self, word):
+        start = bisect.bisect_left(self._word_keys, word)
+        end = bisect.bisect_left(self._word_keys, word + '\uffff', lo=start)
+        return set(self._word_ids[start:end])
+
+    def search(self, query, limit=POS_SEARCH_LIMIT):
+        """Dishes matching query, best first.
+
+        Names where every query word starts a word rank first (a name starting with
+        the whole query ahead of the rest), then names containing every trigram of
+        the query, then names sharing at least POS_FUZZY_MIN of them.
+        """
+        words = _search_words(query)
+        if not words: return []
+        scores = {}
+        matched = self._prefix_ids(words[0])
+        for word in words[1:]:
+            matched &= self._prefix_ids(word)
+        phrase = ' '.join(words)
+        for dish_id in matched:
+            scores[dish_id] = 3 if ' '.join(_search_words(self.dishes[dish_id]['dname'])).startswith(phrase) else 2
+        # The query's last word may be half typed, so its trigrams are not closed off at the end
+        grams = _trigrams(words[:-1]) | _trigrams(words[-1:], pad_end=False)
+        shared = Counter(dish_id for gram in grams for dish_id in self._trigram_ids.get(gram, ()))
+        # Fragments from the middle of a word ("ikk" in "tikka") share none of the padded word-start trigrams
+        core = {word[i:i + 3] for word in words for i in range(len(word) - 2)}
+        if core:
+            inside = Counter(dish_id for gram in core for dish_id in self._trigram_ids.get(gram, ()))
+            for dish_id, count in inside.items():
+                if count == len(core) and dish_id not in scores:
+                    scores[dish_id] = 1.5
+        for dish_id, count in shared.items():
+            similarity = count / len(grams)
+            if similarity >= POS_FUZZY_MIN and dish_id not in scores:
+                scores[dish_id] = similarity
+        ranked = sorted(scores, key=lambda dish_id: (-scores[dish_id], self.dishes[dish_id]['dname'].lower()))
+        return [self.dishes[dish_id] for dish_id in ranked[:limit]]
+
+@routed('replica')
+def get_pos_menu_index():
+    """Loads every dish and builds the POS menu index from them"""
+    return MenuIndex(get_all_dishes())
+
+# --- Bulk Import Functions ---
+# Used by bulk_import.py. Names are resolved against one lookup per table taken at
+# the start of the import, and each chunk of rows is written in one transaction.
+
+IMPORT_SQL = {
+    'ingredients': "INSERT INTO ingredients (name, unit, reorder_level) VALUES (%s, %s, %s)",
+    'suppliers': "INSERT INTO supplier (name, email, phone) VALUES (%s, %s, %s)",
+    'batches': """
+    INSERT INTO ingredient_batches
+    (ingredient_id, supplier_id, quantity_received, quantity_remaining, cost_per_unit, received_date, expiry_date)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """,
+    'dishes': "INSERT INTO dish (dname, price, category) VALUES (%s, %s, %s)",
+    'recipes': "INSERT INTO recipe (dish_id, ingredient_id, quantity_needed) VALUES (%s, %s, %s)",
+}
+
+@routed('primary')
+def get_import_lookups():
+    """Fetches lower-cased name -> id maps for ingredients, suppliers and dishes, and existing recipe pairs"""
+    with db_connection() as conn:
+        if not conn: return None
         with conn.cursor() as cursor:
-            ingredients_needed = {}
-            for dish_id, quantity, price in order_items:
-                recipe = get_recipe_for_dish(dish_id)
-                if not recipe:
-                    return f"Error: No recipe found for dish ID {dish_id}. Cannot process sale."
-                for item in recipe:
-                    ing_id = item['ingredient_id']
-                    needed = float(item['quantity_needed']) * int(quantity)
-                    ingredients_needed[ing_id] = ingredients_needed.get(ing_id, 0) + needed
+            lookups = {}
+            for key, sql in (('ingredients', "SELECT id, name FROM ingredients"),
+                             ('suppliers', "SELECT id, name FROM supplier ORDER BY id DESC"),
+                             ('dishes', "SELECT id, dname AS name FROM dish")):
+                cursor.execute(sql)
+                # Supplier names are not unique; ordering by id DESC leaves the oldest one in the map
+                lookups[key] = {row['name'].strip().lower(): row['id'] for row in cursor.fetchall()}
+            cursor.execute("SELECT dish_id, ingredient_id FROM recipe")
+            lookups['recipe_pairs'] = {(row['dish_id'], row['ingredient_id']) for row in cursor.fetchall()}
+            return lookups
 
-            for ing_id, total_needed in ingredients_needed.items():
-                cursor.execute("SELECT total_stock, ingredient_name FROM current_inventory_view WHERE ingredient_id = %s", (ing_id,))
-                result = cursor.fetchone()
-                if not result or result['total_stock'] < total_needed:
-                    name = result['ingredient_name'] if result else f"ID {ing_id}"
-                    stock = result['total_stock'] if result else 0
-                    raise ValueError(f"Insufficient stock for {name}. Required: {total_needed}, Available: {stock}")
+@routed('primary')
+def bulk_insert_rows(kind, rows):
+    """Inserts one chunk of validated import rows in a single transaction.
+
+    Returns the number of rows inserted, or an error message string.
+    """
+    with db_connection() as conn:
+        if not conn: return "Database connection failed."
+        try:
+            with conn.cursor() as cursor:
+                # pymysql folds this into multi-row INSERT statements
+                cursor.executemany(IMPORT_SQL[kind], rows)
+                if kind == 'batches':
+                    stock = {}
+                    for row in rows:
+                        stock[row[0]] = stock.get(row[0], Decimal(0)) + row[2]
+                    cursor.executemany("""
+                    INSERT INTO ingredient_stock (ingredient_id, total_stock) VALUES (%s, %s)
+                    ON DUPLICATE KEY UPDATE total_stock = total_stock + VALUES(total_stock)
+                    """, sorted(stock.items()))
+                    _bump_change_log(cursor, 'stock')
+                elif kind == 'recipes':
+                    _bump_change_log(cursor, 'recipes')
+                conn.commit()
+            if kind == 'recipes':
+                for dish_id in {row[0] for row in rows}: _recipe_cache.invalidate(dish_id)
+            return len(rows)
+        except pymysql.Error as e:
+            conn.rollback()
+            return f"An unexpected error occurred: {e}"
+
+# --- Point-of-Sale Functions ---
+# Every sale takes its row locks in the same order (batches by ingredient_id then
+# expiry/id, then ingredient_stock and the rollups by primary key), so concurrent
+# sales queue behind each other instead of deadlocking. Whatever InnoDB still
+# aborts (deadlock 1213, lock wait timeout 1205) is retried with jittered backoff.
+
+SALE_MAX_RETRIES = 4           # extra attempts after a deadlock or lock wait timeout
+SALE_RETRY_BASE_DELAY = 0.02   # seconds; doubled on each attempt, with full jitter
+RETRYABLE_SALE_ERRORS = {1213: 'deadlocks', 1205: 'lock_wait_timeouts'}
+# Can't connect (2003), server has gone away (2006), lost connection during or before the query (2013, 2055).
+# The outcome of the sale is unknown, so it is reported with SALE_CONNECTION_LOST and the caller keeps it for replay.
+CONNECTION_LOST_ERRORS = {2003, 2006, 2013, 2055}
+SALE_CONNECTION_LOST = "Database connection lost before the sale was confirmed."
+
+_sale_metrics = {'sales': 0, 'retries': 0, 'deadlocks': 0, 'lock_wait_timeouts': 0, 'gave_up': 0}
+_sale_metrics_lock = threading.Lock()
+
+def _count_sale_metric(*keys):
+    with _sale_metrics_lock:
+        for key in keys:
+            _sale_metrics[key] += 1
+
+def get_sale_metrics():
+    """Returns sale counters: completed sales, retries, deadlocks, lock wait timeouts and sales that gave up."""
+    with _sale_metrics_lock:
+        return dict(_sale_metrics)
+
+def _connection_lost(e):
+    return isinstance(e, pymysql.InterfaceError) or (isinstance(e, pymysql.OperationalError) and bool(e.args) and e.args[0] in CONNECTION_LOST_ERRORS)
+
+SALE_BY_UUID_SQL = "SELECT id FROM sales WHERE client_uuid = %s"
+
+def _existing_sale_id(cursor, sale_uuid):
+    cursor.execute(SALE_BY_UUID_SQL, (sale_uuid,))
+    existing = cursor.fetchone()
+    return existing['id'] if existing else None
+
+def lock_batches_sql(count):
+    """SQL of _lock_batches for count ingredient ids"""
+    return f"""
+    SELECT id, ingredient_id, quantity_remaining
+    FROM ingredient_batches
+    WHERE ingredient_id IN ({', '.join(['%s'] * count)}) AND expiry_date >= CURDATE() AND quantity_remaining > 0
+    ORDER BY ingredient_id, expiry_date ASC, id
+    FOR UPDATE
+    """
 
-            sql_sale = "INSERT INTO sales (waiter_id, total_amount) VALUES (%s, %s)"
-            cursor.execute(sql_sale, (waiter_id, total_amount))
-            sale_id = cursor.lastrowid
+def _lock_batches(cursor, ingredient_ids):
+    """Locks every non-empty, unexpired batch of the given ingredients, soonest expiry first"""
+    cursor.execute(lock_batches_sql(len(ingredient_ids)), list(ingredient_ids))
+    return cursor.fetchall()
 
+def allocate_fifo(ingredients_needed, batches, ingredient_name=None):
+    """Works out FIFO-by-expiry deductions in memory.
+
+    `batches` must be ordered by expiry within each ingredient. Returns a dict of
+    batch_id -> new quantity_remaining, or raises ValueError on insufficient stock.
+    """
+    ingredient_name = ingredient_name or (lambda ing_id: f"ID {ing_id}")
+    by_ingredient = {}
+    for batch in batches:
+        by_ingredient.setdefault(batch['ingredient_id'], []).append(batch)
+
+    new_quantities = {}
+    for ing_id, total_needed in ingredients_needed.items():
+        ing_batches = by_ingredient.get(ing_id, [])
+        stock = sum((b['quantity_remaining'] for b in ing_batches), Decimal(0))
+        if stock < total_needed:
+            name = ingredient_name(ing_id)
+            raise ValueError(f"Insufficient stock for {name}. Required: {total_needed}, Available: {stock}")
+        qty_to_deduct = total_needed
+        for batch in ing_batches:
+            if qty_to_deduct <= 0:
+                break
+            deduct_from_this_batch = min(qty_to_deduct, batch['quantity_remaining'])
+            new_quantities[batch['id']] = batch['quantity_remaining'] - deduct_from_this_batch
+            qty_to_deduct -= deduct_from_this_batch
+    return new_quantities
+
+def _write_batch_quantities(cursor, new_quantities):
+    # pymysql only folds INSERTs into one statement in executemany(), so the
+    # batch updates are sent as a single UPDATE ... CASE instead.
+    if not new_quantities:
+        return
+    ids = sorted(new_quantities)
+    params = [v for batch_id in ids for v in (batch_id, new_quantities[batch_id])]
+    cursor.execute(batch_quantities_sql(len(ids)), params + ids)
+
+def batch_quantities_sql(count):
+    """SQL of _write_batch_quantities for count batches (params: id, quantity pairs, then the ids)"""
+    cases = ' '.join(['WHEN %s THEN %s'] * count)
+    return f"UPDATE ingredient_batches SET quantity_remaining = CASE id {cases} END WHERE id IN ({', '.join(['%s'] * count)})"
+
+def deduct_stock_sql(count):
+    """SQL of _deduct_ingredient_stock for count ingredients (params: id, quantity pairs, then the ids)"""
+    cases = ' '.join(['WHEN %s THEN %s'] * count)
+    return f"UPDATE ingredient_stock SET total_stock = total_stock - CASE ingredient_id {cases} END WHERE ingredient_id IN ({', '.join(['%s'] * count)})"
+
+def _deduct_ingredient_stock(cursor, ingredients_needed):
+    ids = sorted(ingredients_needed)
+    params = [v for ing_id in ids for v in (ing_id, ingredients_needed[ing_id])]
+    cursor.execute(deduct_stock_sql(len(ids)), params + ids)
+
+def _record_sale_rollups(cursor, sale_id, order_items):
+    sql_daily = """
+    INSERT INTO daily_sales_rollup (sale_date, total_revenue, num_sales, dishes_sold)
+    SELECT DATE(sale_time), total_amount, 1, %s FROM sales WHERE id = %s
+    ON DUPLICATE KEY UPDATE total_revenue = total_revenue + VALUES(total_revenue),
+                            num_sales = num_sales + 1,
+                            dishes_sold = dishes_sold + VALUES(dishes_sold)
+    """
+    cursor.execute(sql_daily, (sum(int(quantity) for _, quantity, _ in order_items), sale_id))
+    sql_dish = """
+    INSERT INTO dish_sales_rollup (dish_id, total_sold, total_revenue) VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE total_sold = total_sold + VALUES(total_sold),
+                            total_revenue = total_revenue + VALUES(total_revenue)
+    """
+    dish_totals = {}
+    for dish_id, quantity, price in order_items:
+        sold, revenue = dish_totals.get(dish_id, (0, Decimal(0)))
+        dish_totals[dish_id] = (sold + int(quantity), revenue + Decimal(str(price)) * int(quantity))
+    # Sorted so two sales of the same dishes lock the rollup rows in the same order
+    cursor.executemany(sql_dish, [(dish_id, *dish_totals[dish_id]) for dish_id in sorted(dish_totals)])
+
+def _record_sale(conn, waiter_id, order_items, total_amount, ingredients_needed, sale_uuid, sale_time):
+    """One attempt at the sale transaction. Returns the new sale id."""
+    with conn.cursor() as cursor:
+        batches = _lock_batches(cursor, list(ingredients_needed))
+        new_quantities = allocate_fifo(ingredients_needed, batches, _recipe_cache.ingredient_name)
+
+        sql_sale = "INSERT INTO sales (waiter_id, total_amount, client_uuid, sale_time) VALUES (%s, %s, %s, COALESCE(%s, NOW()))"
+        cursor.execute(sql_sale, (waiter_id, total_amount, sale_uuid, sale_time))
+        sale_id = cursor.lastrowid
+
+        sql_sale_item = "INSERT INTO sale_items (sale_id, dish_id, quantity, price_per_item) VALUES (%s, %s, %s, %s)"
+        cursor.executemany(sql_sale_item, [(sale_id, dish_id, quantity, price) for dish_id, quantity, price in order_items])
+        _write_batch_quantities(cursor, new_quantities)
+        _deduct_ingredient_stock(cursor, ingredients_needed)
+        _record_sale_rollups(cursor, sale_id, order_items)
+        # Last, so the shared change_log rows stay locked for as short a time as possible
+        _bump_change_log(cursor, 'sales', 'stock')
+    conn.commit()
+    return sale_id
+
+@routed('primary')
+def process_sale(waiter_id, order_items, total_amount, sale_uuid=None, sale_time=None):
+    """Records a sale and deducts its ingredients in one transaction.
+
+    The number of round trips is the same whatever the size of the order: one
+    locking batch query (plus one recipe query if any dish misses the recipe
+    cache), and one write each for the sale, its line items, the batch updates,
+    the ingredient_stock totals and the two dashboard rollups. Recipes are
+    resolved before the transaction takes any locks, and deadlocks or lock wait
+    timeouts are retried up to SALE_MAX_RETRIES times.
+
+    sale_uuid makes the call idempotent: a sale whose UUID is already recorded is
+    reported as processed without being written again (used by sale_queue replay).
+    sale_time defaults to now. If the connection drops mid-sale the result is
+    SALE_CONNECTION_LOST, and the same sale_uuid can safely be sent again.
+    """
+    if not order_items:
+        return "Error processing sale: The order is empty."
+    with db_connection() as conn:
+        if not conn:
+            return "Database connection failed."
+        try:
+            dish_quantities = {}
             for dish_id, quantity, price in order_items:
-                sql_sale_item = "INSERT INTO sale_items (sale_id, dish_id, quantity, price_per_item) VALUES (%s, %s, %s, %s)"
-                cursor.execute(sql_sale_item, (sale_id, dish_id, quantity, price))
-                recipe = get_recipe_for_dish(dish_id)
-                for item in recipe:
-                    ing_id = item['ingredient_id']
-                    qty_to_deduct = float(item['quantity_needed']) * int(quantity)
-                    sql_batches = "SELECT id, quantity_remaining FROM ingredient_batches WHERE ingredient_id = %s AND quantity_remaining > 0 ORDER BY expiry_date ASC"
-                    cursor.execute(sql_batches, (ing_id,))
-                    batches = cursor.fetchall()
-                    for batch in batches:
-                        if qty_to_deduct <= 0:
-                            break
-                        deduct_from_this_batch = min(qty_to_deduct, batch['quantity_remaining'])
-                        new_qty = float(batch['quantity_remaining']) - deduct_from_this_batch
-                        sql_update_batch = "UPDATE ingredient_batches SET quantity_remaining = %s WHERE id = %s"
-                        cursor.execute(sql_update_batch, (new_qty, batch['id']))
-                        qty_to_deduct -= deduct_from_this_batch
-            conn.commit()
-            return f"Sale #{sale_id} processed successfully!"
-    except (pymysql.Error, ValueError) as e:
-        conn.rollback()
-        return f"Error processing sale: {e}"
-    finally:
-        if conn:
-            conn.close()
+                dish_quantities[dish_id] = dish_quantities.get(dish_id, 0) + int(quantity)
+
+            with conn.cursor() as cursor:
+                existing = sale_uuid and _existing_sale_id(cursor, sale_uuid)
+                if existing:
+                    return f"Sale #{existing} processed successfully!"
+                recipes = get_order_recipes(cursor, list(dish_quantities))
+            conn.commit()  # ends the read-only snapshot before the locking transaction
+            ingredients_needed = {}
+            for dish_id, quantity in dish_quantities.items():
+                recipe = recipes.get(dish_id)
+                if not recipe:
+                    return f"Error: No recipe found for dish ID {dish_id}. Cannot process sale."
+                for ing_id, quantity_needed in recipe:
+                    ingredients_needed[ing_id] = ingredients_needed.get(ing_id, Decimal(0)) + quantity_needed * quantity
+        except pymysql.Error as e:
+            if _connection_lost(e):
+                return SALE_CONNECTION_LOST
+            conn.rollback()
+            return f"Error processing sale: {e}"
+
+        for attempt in range(SALE_MAX_RETRIES + 1):
+            try:
+                sale_id = _record_sale(conn, waiter_id, order_items, total_amount, ingredients_needed, sale_uuid, sale_time)
+                _count_sale_metric('sales')
+                return f"Sale #{sale_id} processed successfully!"
+            except pymysql.IntegrityError as e:
+                conn.rollback()
+                # 1062 on uq_sales_client_uuid: the same sale was recorded by a concurrent send
+                if sale_uuid and e.args and e.args[0] == 1062:
+                    try:
+                        with conn.cursor() as cursor:
+                            existing = _existing_sale_id(cursor, sale_uuid)
+                    except pymysql.Error as lookup_error:
+                        return SALE_CONNECTION_LOST if _connection_lost(lookup_error) else f"Error processing sale: {lookup_error}"
+                    if existing:
+                        return f"Sale #{existing} processed successfully!"
+                return f"Error processing sale: {e}"
+            except pymysql.OperationalError as e:
+                if _connection_lost(e):
+                    return SALE_CONNECTION_LOST
+                conn.rollback()
+                metric = RETRYABLE_SALE_ERRORS.get(e.args[0]) if e.args else None
+                if metric is None or attempt == SALE_MAX_RETRIES:
+                    if metric: _count_sale_metric(metric, 'gave_up')
+                    return f"Error processing sale: {e}"
+                _count_sale_metric(metric, 'retries')
+                time.sleep(random.uniform(0, SALE_RETRY_BASE_DELAY * 2 ** attempt))
+            except (pymysql.Error, ValueError) as e:
+                if isinstance(e, pymysql.Error) and _connection_lost(e):
+                    return SALE_CONNECTION_LOST
+                conn.rollback()
+                return f"Error processing sale: {e}"
 
 # --- Dashboard Data Functions ---
 
+@routed('replica')
 def get_dashboard_kpis():
     """Fetches Key Performance Indicators for the dashboard"""
-    conn = connect_db()
-    if not conn: return {}
-    try:
+    with db_connection() as conn:
+        if not conn: return {}
         with conn.cursor() as cursor:
-            # Total Revenue
-            cursor.execute("SELECT SUM(total_amount) AS total_revenue FROM sales")
-            total_revenue = cursor.fetchone()['total_revenue'] or 0
-            
-            # Total Dishes Sold
-            cursor.execute("SELECT SUM(quantity) AS total_dishes_sold FROM sale_items")
-            total_dishes_sold = cursor.fetchone()['total_dishes_sold'] or 0
-            
-            # Number of Sales
-            cursor.execute("SELECT COUNT(id) AS num_sales FROM sales")
-            num_sales = cursor.fetchone()['num_sales'] or 0
-            
+            # One row per trading day, so this stays cheap however many sales there are
+            sql = """
+            SELECT SUM(total_revenue) AS total_revenue, SUM(dishes_sold) AS total_dishes_sold, SUM(num_sales) AS num_sales
+            FROM daily_sales_rollup
+            """
+            cursor.execute(sql)
+            row = cursor.fetchone()
             return {
-                "total_revenue": total_revenue,
-                "total_dishes_sold": total_dishes_sold,
-                "num_sales": num_sales
+                "total_revenue": row['total_revenue'] or 0,
+                "total_dishes_sold": row['total_dishes_sold'] or 0,
+                "num_sales": row['num_sales'] or 0
             }
-    finally:
-        if conn: conn.close()
 
+SALES_BY_DAY_SQL = """
+SELECT sale_date, total_revenue AS daily_sales
+FROM daily_sales_rollup
+WHERE sale_date >= CURDATE() - INTERVAL %s DAY
+ORDER BY sale_date ASC
+"""
+
+@routed('replica')
 def get_sales_by_day(days=7):
     """Fetches total sales revenue for the last N days"""
-    conn = connect_db()
-    if not conn: return []
-    try:
+    with db_connection() as conn:
+        if not conn: return []
         with conn.cursor() as cursor:
-            sql = """
-            SELECT DATE(sale_time) AS sale_date, SUM(total_amount) AS daily_sales
-            FROM sales
-            WHERE sale_time >= CURDATE() - INTERVAL %s DAY
-            GROUP BY DATE(sale_time)
-            ORDER BY sale_date ASC
-            """
-            cursor.execute(sql, (days,))
+            cursor.execute(SALES_BY_DAY_SQL, (days,))
             return cursor.fetchall()
-    finally:
-        if conn: conn.close()
-        
+
+@routed('replica')
 def get_top_selling_dishes(limit=5):
     """Fetches the most frequently sold dishes"""
-    conn = connect_db()
-    if not conn: return []
-    try:
+    with db_connection() as conn:
+        if not conn: return []
         with conn.cursor() as cursor:
             sql = """
-            SELECT d.dname, SUM(si.quantity) AS total_sold
-            FROM sale_items si
-            JOIN dish d ON si.dish_id = d.id
-            GROUP BY d.dname
-            ORDER BY total_sold DESC
+            SELECT d.dname, r.total_sold
+            FROM dish_sales_rollup r
+            JOIN dish d ON r.dish_id = d.id
+            ORDER BY r.total_sold DESC
             LIMIT %s
             """
             cursor.execute(sql, (limit,))
             return cursor.fetchall()
-    finally:
-        if conn: conn.close()
 
+@routed('primary')
+def rebuild_sales_rollups():
+    """Rebuilds daily_sales_rollup and dish_sales_rollup from the full sales history"""
+    with db_connection() as conn:
+        if not conn: return "Database connection failed."
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM daily_sales_rollup")
+                cursor.execute("""
+                INSERT INTO daily_sales_rollup (sale_date, total_revenue, num_sales, dishes_sold)
+                SELECT d.sale_date, d.revenue, d.num_sales, COALESCE(q.dishes_sold, 0)
+                FROM (SELECT DATE(sale_time) AS sale_date, SUM(total_amount) AS revenue, COUNT(*) AS num_sales
+                      FROM sales WHERE sale_time IS NOT NULL GROUP BY DATE(sale_time)) d
+                LEFT JOIN (SELECT DATE(s.sale_time) AS sale_date, SUM(si.quantity) AS dishes_sold
+                           FROM sale_items si JOIN sales s ON si.sale_id = s.id
+                           WHERE s.sale_time IS NOT NULL GROUP BY DATE(s.sale_time)) q ON q.sale_date = d.sale_date
+                """)
+                days = cursor.rowcount
+                cursor.execute("DELETE FROM dish_sales_rollup")
+                cursor.execute("""
+                INSERT INTO dish_sales_rollup (dish_id, total_sold, total_revenue)
+                SELECT dish_id, SUM(quantity), SUM(quantity * price_per_item)
+                FROM sale_items WHERE dish_id IS NOT NULL GROUP BY dish_id
+                """)
+                dishes = cursor.rowcount
+            conn.commit()
+            return f"Rollups rebuilt successfully! ({days} day(s), {dishes} dish(es))"
+        except pymysql.Error as e:
+            conn.rollback()
+            return f"Database Error: {e}"
+
+@routed('replica')
 def get_low_stock_alerts():
     """Fetches ingredients where stock is at or below the reorder level"""
-    conn = connect_db()
-    if not conn: return []
-    try:
+    with db_connection() as conn:
+        if not conn: return []
         with conn.cursor() as cursor:
             sql = """
             SELECT ingredient_name, total_stock, reorder_level, unit
@@ -477,5 +1613,133 @@ def get_low_stock_alerts():
             """
             cursor.execute(sql)
             return cursor.fetchall()
-    finally:
-        if conn: conn.close()
+
+# --- Dashboard Snapshot ---
+# Everything the SQL-backed dashboard panels need, fetched with a single CALL to the
+# dashboard_snapshot procedure (one result set per query, one round trip, one
+# consistent read view). Snapshots are cached for DASHBOARD_SNAPSHOT_TTL seconds
+# and callers that arrive while a fetch is running wait for it instead of
+# starting their own.
+
+DASHBOARD_SNAPSHOT_TTL = 5
+
+DASHBOARD_SNAPSHOT_QUERIES = [
+    ('versions', "SELECT topic, version FROM change_log"),
+    ('kpis', "SELECT SUM(total_revenue) AS total_revenue, SUM(dishes_sold) AS total_dishes_sold, SUM(num_sales) AS num_sales FROM daily_sales_rollup"),
+    ('sales_by_day', "SELECT sale_date, total_revenue AS daily_sales FROM daily_sales_rollup WHERE sale_date >= CURDATE() - INTERVAL %(days)s DAY ORDER BY sale_date ASC"),
+    ('top_dishes', "SELECT d.dname, r.total_sold FROM dish_sales_rollup r JOIN dish d ON r.dish_id = d.id ORDER BY r.total_sold DESC LIMIT %(top)s"),
+    ('low_stock_alerts', "SELECT ingredient_name, total_stock, reorder_level, unit FROM current_inventory_view WHERE total_stock <= reorder_level"),
+]
+
+def dashboard_snapshot_procedure_sql():
+    """CREATE PROCEDURE statement for dashboard_snapshot, built from DASHBOARD_SNAPSHOT_QUERIES"""
+    body = ";\n    ".join(sql.replace('%(days)s', 'p_days').replace('%(top)s', 'p_top') for _, sql in DASHBOARD_SNAPSHOT_QUERIES)
+    return f"CREATE PROCEDURE dashboard_snapshot(IN p_days INT, IN p_top INT)\nBEGIN\n    {body};\nEND"
+
+@dataclass(frozen=True)
+class DashboardSnapshot:
+    taken_at: datetime
+    versions: dict
+    kpis: dict
+    sales_by_day: list
+    top_dishes: list
+    low_stock_alerts: list
+
+_snapshot_lock = threading.Lock()   # guards the two dicts below, never held during a fetch
+_snapshot_cache = {}  # (outlet, days, top) -> (monotonic time, DashboardSnapshot)
+_snapshot_fetch_locks = {}  # (outlet, days, top) -> Lock held while that key is being fetched
+
+def _fetch_dashboard_snapshot(days, top):
+    with db_connection() as conn:
+        if not conn: return None
+        with conn.cursor() as cursor:
+            try:
+                cursor.execute("CALL dashboard_snapshot(%s, %s)", (days, top))
+                result_sets = [cursor.fetchall()]
+                while len(result_sets) < len(DASHBOARD_SNAPSHOT_QUERIES) and cursor.nextset():
+                    result_sets.append(cursor.fetchall())
+                while cursor.nextset(): pass  # the CALL's trailing status packet
+            except pymysql.Error as e:
+                if not e.args or e.args[0] != 1305: raise  # 1305: procedure missing, migration 008 not applied
+                result_sets = []
+                for _, sql in DASHBOARD_SNAPSHOT_QUERIES:
+                    cursor.execute(sql, {'days': days, 'top': top})
+                    result_sets.append(cursor.fetchall())
+        conn.commit()
+    results = dict(zip((name for name, _ in DASHBOARD_SNAPSHOT_QUERIES), result_sets))
+    kpis = results['kpis'][0] if results['kpis'] else {}
+    return DashboardSnapshot(
+        taken_at=datetime.now(),
+        versions={row['topic']: row['version'] for row in results['versions']},
+        kpis={key: kpis.get(key) or 0 for key in ('total_revenue', 'total_dishes_sold', 'num_sales')},
+        sales_by_day=list(results['sales_by_day']),
+        top_dishes=list(results['top_dishes']),
+        low_stock_alerts=list(results['low_stock_alerts']),
+    )
+
+@routed('replica')
+def get_dashboard_snapshot(days=7, top=5, versions=None):
+    """Returns a DashboardSnapshot no older than DASHBOARD_SNAPSHOT_TTL seconds (None if the database is unreachable).
+
+    Pass the change-log versions the caller has already seen to skip a cached
+    snapshot that predates them.
+    """
+    key = (current_outlet(), days, top)
+    with _snapshot_lock:
+        fetch_lock = _snapshot_fetch_locks.setdefault(key, threading.Lock())
+    # Only callers after the same snapshot queue here; other outlets and (days, top) fetch in parallel
+    with fetch_lock:
+        with _snapshot_lock:
+            cached = _snapshot_cache.get(key)
+        if cached:
+            fetched_at, snapshot = cached
+            behind = versions and any(snapshot.versions.get(topic, 0) < version for topic, version in versions.items())
+            if time.monotonic() - fetched_at < DASHBOARD_SNAPSHOT_TTL and not behind:
+                return snapshot
+        snapshot = _fetch_dashboard_snapshot(days, top)
+        if snapshot:
+            with _snapshot_lock: _snapshot_cache[key] = (time.monotonic(), snapshot)
+        return snapshot
+
+def _fetch_dish_totals():
+    # One row per dish that has sold, so the whole rollup is cheap to ship
+    with db_connection() as conn:
+        if not conn: return None
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT d.dname, r.total_sold FROM dish_sales_rollup r JOIN dish d ON r.dish_id = d.id")
+            rows = cursor.fetchall()
+        conn.commit()
+    return rows
+
+def _fetch_group_parts(days, top):
+    snapshot = _fetch_dashboard_snapshot(days, top)
+    dish_totals = _fetch_dish_totals() if snapshot else None
+    return (snapshot, dish_totals) if dish_totals is not None else None
+
+@routed('replica')
+def get_group_dashboard_snapshot(days=7, top=5, outlets=None):
+    """Fetches every outlet's dashboard snapshot in parallel and merges them into one.
+
+    KPIs and daily sales are summed, dishes are ranked by their combined sales and
+    low stock alerts are tagged with their outlet. Returns None if no outlet answered.
+    """
+    results = fan_out(_fetch_group_parts, days, top, outlets=outlets)
+    parts = {outlet: part for outlet, part in results.items() if isinstance(part, tuple)}
+    if not parts: return None
+    kpis, by_day, by_dish, alerts = {}, {}, {}, []
+    for outlet, (snap, dish_totals) in parts.items():
+        for key, value in snap.kpis.items(): kpis[key] = kpis.get(key, 0) + value
+        for row in snap.sales_by_day: by_day[row['sale_date']] = by_day.get(row['sale_date'], 0) + row['daily_sales']
+        # Ranked on every dish's total, not each outlet's top N: a dish that is 6th
+        # everywhere can still be 1st across the group.
+        for row in dish_totals: by_dish[row['dname']] = by_dish.get(row['dname'], 0) + row['total_sold']
+        alerts += [{**row, 'outlet': outlet} for row in snap.low_stock_alerts]
+    top_dishes = sorted(by_dish.items(), key=lambda item: item[1], reverse=True)[:top]
+    return DashboardSnapshot(
+        taken_at=datetime.now(),
+        versions={},
+        kpis=kpis,
+        sales_by_day=[{'sale_date': day, 'daily_sales': total} for day, total in sorted(by_day.items())],
+        top_dishes=[{'dname': name, 'total_sold': sold} for name, sold in top_dishes],
+        low_stock_alerts=alerts,
+    )
@@ -0,0 +1,40 @@
+import argparse
+import csv
+from datetime import date
+
+from utils import get_batch_index, write_off_expired_batches
+
+def print_batches(title, batches, index):
+    print(f"\n--- {title}: {len(batches)} batch(es), ₹{index.value(batches):.2f} ---")
+    for b in batches:
+        print(f"  {b['expiry_date']}  {b['ingredient_name']}: {b['quantity_remaining']} {b['unit']} "
+              f"(batch {b['id']}, {b['supplier_name'] or 'no supplier'}, ₹{b['quantity_remaining'] * b['cost_per_unit']:.2f})")
+
+def main():
+    """Nightly waste report: expired stock still on hand and stock expiring soon"""
+    parser = argparse.ArgumentParser(description="Report expired and soon-to-expire ingredient batches.")
+    parser.add_argument("--days", type=int, default=7, help="look-ahead window for expiring stock")
+    parser.add_argument("--csv", help="also write both lists to this CSV file")
+    parser.add_argument("--write-off", action="store_true", help="move expired stock to waste_log after reporting")
+    args = parser.parse_args()
+
+    print(f"=== Waste Report for {date.today()} ===")
+    index = get_batch_index()
+    expired = index.expired()
+    expiring = index.expiring_within(args.days)
+    print_batches("Expired, still counted in batches", expired, index)
+    print_batches(f"Expiring within {args.days} days", expiring, index)
+
+    if args.csv:
+        with open(args.csv, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['status', 'batch_id', 'ingredient', 'supplier', 'quantity_remaining', 'unit', 'cost_per_unit', 'value', 'expiry_date'])
+            for status, batches in (('expired', expired), ('expiring', expiring)):
+                for b in batches:
+                    writer.writerow([status, b['id'], b['ingredient_name'], b['supplier_name'], b['quantity_remaining'], b['unit'],
+                                     b['cost_per_unit'], b['quantity_remaining'] * b['cost_per_unit'], b['expiry_date']])
+    if args.write_off:
+        print("\n" + write_off_expired_batches())
+
+if __name__ == "__main__":
+    main()